@@ -0,0 +1,225 @@
+"""
+多数据流时间对齐
+
+把任意多个带时间戳的数据流（现货/合约 K 线、资金费率、其他交易对……）对齐到同一个主时钟上。
+K 线一类的流要求时间戳与时钟完全一致（exact）；资金费率一类的事件流取不晚于时钟时刻的最近一条（asof），
+可以限定最大时滞。
+
+每个数据流只在时间列上与主时钟做一次有序归并（searchsorted），得到时钟每个时刻对应的源数据行号；
+缺失判断、剔除不完整的时刻都在行号数组上完成，最后每列按行号 take 一次生成结果，
+不做 intersection / resample / reindex，也不复制中间 DataFrame。结果共享同一个时间索引，
+可以直接作为 backtrader 的多个数据源，分钟级、多交易对的对齐也只是几次排序和查找。
+"""
+import logging
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+logger = logging.getLogger(__name__)
+
+ALIGN_MODES = ('exact', 'asof')
+
+def to_ns(values):
+    """时间索引、datetime 列或毫秒时间戳转换为 int64 纳秒数组（带时区的转换为 UTC）"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        index = pd.DatetimeIndex(values)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        return index.to_numpy().astype('datetime64[ns]').view(np.int64)
+    return pd.to_numeric(pd.Series(values)).to_numpy(dtype=np.int64) * 1_000_000
+
+def stream(frame, columns=None, mode='exact', tolerance=None, required=True, valid=None, time_column=None):
+    """
+    描述一个待对齐的数据流
+
+    Args:
+        frame (DataFrame): 以时间为索引（或含 time_column 列）的数据，不要求已排序，重复时间戳取最后一行
+        columns (list): 输出的列，默认为全部列（time_column 除外）
+        mode (str): 'exact' 只匹配时间戳完全一致的行；'asof' 取不晚于时钟时刻的最近一行
+        tolerance (str): asof 模式下允许的最大时滞（如 '8h'），超过视为缺失
+        required (bool): 为 True 时该流缺失的时钟时刻整行剔除，否则保留并填 NaN
+        valid (array): 可选的布尔掩码，为假的行不参与对齐（例如价格无效的 K 线）
+
+    Returns:
+        dict: 供 align 使用的数据流描述
+    """
+    if mode not in ALIGN_MODES:
+        raise ValueError(f"Unknown align mode: {mode}")
+    times = to_ns(frame[time_column] if time_column else frame.index)
+    # rows 为排序后每个时间戳在原数据中的行号，数据本身不动
+    rows = None
+    if valid is not None:
+        rows = np.flatnonzero(np.asarray(valid, dtype=bool))
+        times = times[rows]
+    if len(times) > 1 and np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        rows = order if rows is None else rows[order]
+    return {
+        'frame': frame,
+        'columns': list(columns) if columns is not None else [c for c in frame.columns if c != time_column],
+        'times': times,
+        'rows': rows,
+        'mode': mode,
+        'tolerance': pd.Timedelta(tolerance).value if tolerance is not None else None,
+        'required': required
+    }
+
+def asof_positions(times, clock, mode='asof', tolerance=None):
+    """
+    主时钟每个时刻在已排序的 times 中对应的位置，缺失为 -1
+
+    同一时间戳有多行时取最后一行。tolerance 为纳秒。
+    """
+    if len(times) == 0:
+        return np.full(len(clock), -1, dtype=np.int64)
+    positions = np.searchsorted(times, clock, side='right') - 1
+    found = positions >= 0
+    matched = times[np.maximum(positions, 0)]
+    if mode == 'exact':
+        found &= matched == clock
+    elif tolerance is not None:
+        found &= clock - matched <= tolerance
+    return np.where(found, positions, -1)
+
+def _sorted_unique(times):
+    if len(times) < 2:
+        return times
+    return times[np.concatenate([[True], times[1:] != times[:-1]])]
+
+def build_clock(streams, freq=None, how='inner', start=None, end=None):
+    """
+    主时钟（int64 纳秒数组）
+
+    Args:
+        streams (dict): {name: stream(...)}，只用 exact 流决定时钟，没有 exact 流时使用全部流
+        freq (str): 给定时为等间隔时钟（按间隔的整数倍取点），范围为各流的共同区间（inner）或全部区间（outer）
+        how (str): 不给 freq 时，'inner' 取所有流都有的时间戳，'outer' 取任一流出现过的时间戳
+        start, end: 可选的时钟起止时间
+    """
+    base = [s['times'] for s in streams.values() if s['mode'] == 'exact' and len(s['times'])]
+    if not base:
+        base = [s['times'] for s in streams.values() if len(s['times'])]
+    if not base:
+        return np.empty(0, dtype=np.int64)
+
+    if freq is not None:
+        firsts = [times[0] for times in base]
+        lasts = [times[-1] for times in base]
+        lo, hi = (max(firsts), min(lasts)) if how == 'inner' else (min(firsts), max(lasts))
+        if start is not None:
+            lo = max(lo, pd.Timestamp(start).value)
+        if end is not None:
+            hi = min(hi, pd.Timestamp(end).value)
+        step = pd.Timedelta(freq).value
+        return np.arange(-(-lo // step) * step, hi + 1, step, dtype=np.int64)
+
+    clock = _sorted_unique(base[0])
+    for times in base[1:]:
+        if how == 'inner':
+            # 各流已排序，交集只需在当前时钟上逐个查找，不需要重新排序
+            clock = clock[asof_positions(times, clock, 'exact') >= 0]
+        else:
+            clock = np.union1d(clock, times)
+    if start is not None:
+        clock = clock[clock >= pd.Timestamp(start).value]
+    if end is not None:
+        clock = clock[clock <= pd.Timestamp(end).value]
+    return clock
+
+def _take(frame, columns, rows, index):
+    """按行号取出各列，-1 为缺失"""
+    missing = rows < 0
+    any_missing = missing.any()
+    safe_rows = np.where(missing, 0, rows) if any_missing else rows
+    data = {}
+    for column in columns:
+        values = frame[column].to_numpy()
+        if len(values) == 0:
+            data[column] = np.full(len(rows), np.nan)
+            continue
+        taken = values.take(safe_rows)
+        if any_missing:
+            if taken.dtype.kind in 'iub':
+                taken = taken.astype(float)
+            if taken.dtype.kind == 'M':
+                taken[missing] = np.datetime64('NaT')
+            elif taken.dtype.kind == 'f':
+                taken[missing] = np.nan
+            else:
+                taken = taken.astype(object)
+                taken[missing] = None
+        data[column] = taken
+    return pd.DataFrame(data, index=index, columns=columns)
+
+def align(streams, clock=None, freq=None, how='inner', start=None, end=None):
+    """
+    把多个数据流对齐到同一个主时钟
+
+    Args:
+        streams (dict): {name: stream(...) 或 DataFrame}，DataFrame 按 exact、必需处理
+        clock: 可选的主时钟（DatetimeIndex 或时间数组），为空时由 build_clock 根据 freq/how/start/end 生成
+
+    Returns:
+        dict: {name: DataFrame}，按 streams 的顺序，所有结果共享同一个 DatetimeIndex（名为 timestamp）
+    """
+    streams = {name: s if isinstance(s, dict) else stream(s) for name, s in streams.items()}
+    if clock is None:
+        clock = build_clock(streams, freq=freq, how=how, start=start, end=end)
+    else:
+        clock = to_ns(pd.DatetimeIndex(clock))
+
+    positions = {name: asof_positions(s['times'], clock, s['mode'], s['tolerance']) for name, s in streams.items()}
+    keep = np.ones(len(clock), dtype=bool)
+    for name, s in streams.items():
+        if s['required']:
+            keep &= positions[name] >= 0
+    if not keep.all():
+        missing = ", ".join(f"{name} {int((positions[name] < 0).sum())}" for name, s in streams.items()
+                            if s['required'] and (positions[name] < 0).any())
+        logger.info(f"Dropped {int((~keep).sum())} of {len(clock)} clock times with missing data ({missing})")
+
+    index = pd.DatetimeIndex(clock[keep].view('datetime64[ns]'), name='timestamp')
+    aligned = {}
+    for name, s in streams.items():
+        rows = positions[name][keep]
+        if s['rows'] is not None:
+            rows = np.where(rows >= 0, s['rows'][np.maximum(rows, 0)], -1)
+        aligned[name] = _take(s['frame'], s['columns'], rows, index)
+    return aligned
+
+def align_panel(frames, column='close', mode='exact', how='inner', tolerance=None, **kwargs):
+    """
+    多个交易对的同一列对齐成宽表（行为主时钟、列为交易对），适合分钟级多交易对分析
+
+    Args:
+        frames (dict): {symbol: DataFrame}
+        how (str): 'inner' 只保留所有交易对都有数据的时刻；'outer' 保留全部时刻，缺失为 NaN
+    """
+    streams = {symbol: stream(frame, columns=[column], mode=mode, tolerance=tolerance, required=how == 'inner')
+               for symbol, frame in frames.items()}
+    aligned = align(streams, how=how, **kwargs)
+    index = next(iter(aligned.values())).index if aligned else pd.DatetimeIndex([], name='timestamp')
+    return pd.DataFrame({symbol: frame[column].to_numpy() for symbol, frame in aligned.items()}, index=index)
+
+def add_feeds(cerebro, aligned, params=None, feed_class=bt.feeds.PandasData):
+    """
+    把对齐结果按顺序作为数据源加入 cerebro（数据源名称为字典的键）
+
+    Args:
+        aligned (dict): align 的结果
+        params (dict): {name: 数据源参数}，例如资金费率 {'close': 'fundingRate'}；
+                       未指定的字段按列名自动匹配，缺少的列视为没有该字段
+
+    Returns:
+        list: 按顺序加入的数据源
+    """
+    params = params or {}
+    feeds = []
+    for name, frame in aligned.items():
+        kwargs = {'datetime': None, 'openinterest': None}  # 使用索引作为时间戳
+        kwargs.update(params.get(name, {}))
+        feed = feed_class(dataname=frame, **kwargs)
+        cerebro.adddata(feed, name=name)
+        feeds.append(feed)
+    return feeds
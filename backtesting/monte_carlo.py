@@ -0,0 +1,181 @@
+"""
+回测结果的 Monte Carlo / Bootstrap 风险评估
+
+输入一次回测的收益率序列（TimeReturn 分析器）或逐笔交易盈亏，不重新跑回测，
+对序列做上万次重采样，得到最大回撤、破产概率和年化收益的分布，用来判断回测结果有多依赖具体的行情路径。
+
+每批路径在一个 (n_paths, n_obs) 矩阵上一次算完，多批路径分给进程池并行计算。
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认重采样路径数
+N_PATHS = 10000
+# 块自助法的默认块长度（保留收益率的短期自相关，如趋势策略的连续盈亏）
+BLOCK_SIZE = 20
+# 权益跌到初始资金的这个比例以下视为破产
+RUIN_LEVEL = 0.5
+# 每批路径矩阵的最大元素个数，控制单个进程的内存占用（约 40MB）
+MAX_CHUNK_ELEMENTS = 5_000_000
+# 输出分布的分位数
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# 重采样方法：
+#   'block'    循环块自助法，按块有放回抽样
+#   'bootstrap' 逐期有放回抽样（假设收益独立）
+#   'shuffle'  不放回打乱顺序，总收益不变，只改变盈亏出现的顺序（经典的交易顺序 Monte Carlo）
+METHODS = ('block', 'bootstrap', 'shuffle')
+
+def trade_returns(pnls, initial_cash):
+    """
+    把逐笔交易盈亏转换为收益率序列
+
+    每笔收益率为该笔盈亏除以交易前的权益，这样重采样后按复利累计不会出现负权益。
+    """
+    pnls = np.asarray(pnls, dtype=float)
+    equity_before = initial_cash + np.concatenate([[0.0], np.cumsum(pnls)[:-1]])
+    return pnls / np.maximum(equity_before, 1e-12)
+
+def analyzer_returns(time_return_analysis):
+    """TimeReturn 分析器的 get_analysis() 结果（日期 -> 收益率）转换为 numpy 数组"""
+    return np.fromiter(time_return_analysis.values(), dtype=float, count=len(time_return_analysis))
+
+def resample_indices(rng, n_obs, n_paths, method='block', block_size=BLOCK_SIZE):
+    """生成 (n_paths, n_obs) 的重采样下标矩阵"""
+    if method == 'bootstrap':
+        return rng.integers(0, n_obs, size=(n_paths, n_obs))
+    if method == 'shuffle':
+        return rng.permuted(np.broadcast_to(np.arange(n_obs), (n_paths, n_obs)), axis=1)
+    if method == 'block':
+        block_size = max(1, min(block_size, n_obs))
+        n_blocks = -(-n_obs // block_size)
+        starts = rng.integers(0, n_obs, size=(n_paths, n_blocks))
+        # 循环块：超过序列末尾的部分从头接上
+        indices = (starts[:, :, None] + np.arange(block_size)) % n_obs
+        return indices.reshape(n_paths, -1)[:, :n_obs]
+    raise ValueError(f"Unknown resampling method: {method}")
+
+def path_statistics(path_returns, periods_per_year, ruin_level=RUIN_LEVEL):
+    """
+    对每条收益率路径（矩阵的一行）计算统计量
+
+    Returns:
+        dict: max_drawdown（比例）、cagr、total_return、ruined（布尔数组），均为长度 n_paths 的数组
+    """
+    # 在对数空间累加比逐期累乘更稳定，单期亏损 100% 时权益为 0
+    growth = np.log1p(np.maximum(path_returns, -1.0 + 1e-12))
+    equity = np.exp(np.cumsum(growth, axis=1))
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), 1.0)
+    max_drawdown = (1.0 - equity / peak).max(axis=1)
+    final = equity[:, -1]
+    years = path_returns.shape[1] / periods_per_year
+    return {
+        'max_drawdown': max_drawdown,
+        'cagr': final ** (1.0 / years) - 1.0 if years > 0 else np.zeros(len(final)),
+        'total_return': final - 1.0,
+        'ruined': equity.min(axis=1) <= ruin_level
+    }
+
+def actual_statistics(returns, periods_per_year):
+    """
+    原回测收益率序列本身的最大回撤和年化收益率
+
+    与重采样路径使用同一个序列和同一套计算（包括每年的期数），在分布中的位置才可比；
+    backtrader 的 Returns 分析器按每年 252 个交易日年化，不能直接与按 365 期模拟的分布比较。
+
+    Returns:
+        dict: max_drawdown、cagr、total_return（比例），序列为空时返回 None
+    """
+    returns = np.asarray(returns, dtype=float)
+    if len(returns) == 0:
+        return None
+    stats = path_statistics(returns[None, :], periods_per_year)
+    return {key: float(stats[key][0]) for key in ('max_drawdown', 'cagr', 'total_return')}
+
+def _simulate_chunk(returns, n_paths, method, block_size, periods_per_year, ruin_level, seed):
+    """进程池中执行的一批路径"""
+    rng = np.random.default_rng(seed)
+    indices = resample_indices(rng, len(returns), n_paths, method, block_size)
+    return path_statistics(returns[indices], periods_per_year, ruin_level)
+
+def run_monte_carlo(returns, periods_per_year, n_paths=N_PATHS, method='block', block_size=BLOCK_SIZE,
+                    ruin_level=RUIN_LEVEL, seed=None, workers=None):
+    """
+    对收益率序列做重采样并返回各统计量的分布
+
+    Args:
+        returns (array): 每期收益率（或 trade_returns 转换后的逐笔收益率）
+        periods_per_year (float): 每年的期数，日收益为 365，逐笔交易时为每年交易次数
+        n_paths (int): 重采样路径数
+        method (str): 'block'、'bootstrap' 或 'shuffle'
+        block_size (int): 块自助法的块长度
+        ruin_level (float): 权益低于初始资金该比例视为破产
+        seed (int): 随机种子，相同种子下结果可复现（与进程数无关）
+        workers (int): 进程数，默认为 CPU 数；为 1 时在当前进程计算
+
+    Returns:
+        dict: max_drawdown、cagr、total_return 三个分布数组，ruin_probability，以及 summary 分位数表；
+              序列为空时返回 None
+    """
+    returns = np.asarray(returns, dtype=float)
+    returns = returns[np.isfinite(returns)]
+    if len(returns) < 2:
+        logger.warning("Not enough returns for Monte Carlo simulation")
+        return None
+    if method not in METHODS:
+        raise ValueError(f"Unknown resampling method: {method}")
+
+    chunk_paths = max(1, min(n_paths, MAX_CHUNK_ELEMENTS // len(returns)))
+    sizes = [chunk_paths] * (n_paths // chunk_paths)
+    if n_paths % chunk_paths:
+        sizes.append(n_paths % chunk_paths)
+    # 每批使用独立的随机流
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(returns, size, method, block_size, periods_per_year, ruin_level, chunk_seed)
+            for size, chunk_seed in zip(sizes, seeds)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(sizes) == 1:
+        chunks = [_simulate_chunk(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sizes))) as executor:
+            chunks = list(executor.map(_simulate_chunk, *zip(*args)))
+
+    result = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+    ruined = result.pop('ruined')
+    result['ruin_probability'] = float(ruined.mean())
+    result['ruin_level'] = ruin_level
+    result['summary'] = summarize(result)
+    logger.info(f"Monte Carlo finished: {n_paths} {method} paths over {len(returns)} periods")
+    return result
+
+def summarize(result, percentiles=PERCENTILES):
+    """各分布的分位数和均值"""
+    summary = {}
+    for key in ('max_drawdown', 'cagr', 'total_return'):
+        values = result[key]
+        summary[key] = dict(zip([f"p{p}" for p in percentiles], np.percentile(values, percentiles).tolist()))
+        summary[key]['mean'] = float(values.mean())
+    summary['ruin_probability'] = result['ruin_probability']
+    return summary
+
+def log_summary(result, actual_max_drawdown=None, actual_cagr=None):
+    """把 Monte Carlo 结果写入日志，actual_* 为原回测的数值（比例），用于标出其在分布中的位置"""
+    if result is None:
+        return
+    summary = result['summary']
+    logger.info('\n=== Monte Carlo 风险评估 ===')
+    for key, label in (('max_drawdown', '最大回撤'), ('cagr', '年化收益率')):
+        row = summary[key]
+        logger.info(f"{label}: " + ', '.join(f"{name} {value * 100:.2f}%" for name, value in row.items()))
+    if actual_max_drawdown is not None:
+        rank = (result['max_drawdown'] <= actual_max_drawdown).mean() * 100
+        logger.info(f"回测最大回撤 {actual_max_drawdown * 100:.2f}% 位于分布的第 {rank:.1f} 百分位")
+    if actual_cagr is not None:
+        rank = (result['cagr'] <= actual_cagr).mean() * 100
+        logger.info(f"回测年化收益率 {actual_cagr * 100:.2f}% 位于分布的第 {rank:.1f} 百分位")
+    logger.info(f"破产概率（权益跌破初始资金的 {result['ruin_level']:.0%}）: {summary['ruin_probability'] * 100:.2f}%")
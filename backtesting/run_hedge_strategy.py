@@ -12,6 +12,8 @@ project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
 from strategies.hedge_strategy import SpotFuturesHedgeStrategy
+from data_storage.data_quality import FUNDING_INTERVAL, FUNDING_TOLERANCE, check_funding_rates, check_klines, log_report
+from backtesting.alignment import align, stream, add_feeds
 
 # 设置日志
 logging.basicConfig(
@@ -20,17 +22,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class HDF5CSVData(bt.feeds.PandasData):
-    """自定义数据加载类"""
-    params = (
-        ('datetime', None),
-        ('open', 'open'),
-        ('high', 'high'),
-        ('low', 'low'),
-        ('close', 'close'),
-        ('volume', 'volume'),
-        ('openinterest', None),
-    )
+def _valid_prices(df, name):
+    """价格为正且有限的K线掩码，并记录无效的行数"""
+    prices = df[['open', 'high', 'low', 'close']].to_numpy(dtype=float)
+    valid = np.isfinite(prices).all(axis=1) & (prices > 0).all(axis=1)
+    if not valid.all():
+        logger.warning(f"{name}: 剔除 {int((~valid).sum())} 根价格无效的K线")
+    return valid
 
 def load_data():
     """加载现货和合约数据"""
@@ -66,34 +64,28 @@ def load_data():
         if 'fundingTime' in funding_df.columns:
             funding_df['fundingTime'] = pd.to_datetime(funding_df['fundingTime'])
             funding_df.set_index('fundingTime', inplace=True)
-        
-        # 对齐数据的时间索引
-        common_index = spot_df.index.intersection(futures_df.index)
-        spot_df = spot_df.loc[common_index]
-        futures_df = futures_df.loc[common_index]
-        
-        # 将资金费率数据重采样到4小时并对齐
-        funding_df = funding_df.resample('4H').ffill()
-        funding_df = funding_df.reindex(common_index)
-        
-        # 确保数据完整性
-        spot_df = spot_df.fillna(method='ffill')
-        futures_df = futures_df.fillna(method='ffill')
-        funding_df = funding_df.fillna(0)  # 将缺失的资金费率填充为0
-        
-        # 移除包含无限值的行
-        spot_df = spot_df.replace([np.inf, -np.inf], np.nan).dropna()
-        futures_df = futures_df.replace([np.inf, -np.inf], np.nan).dropna()
-        funding_df = funding_df.replace([np.inf, -np.inf], np.nan).dropna()
-        
-        # 再次对齐数据
-        common_index = spot_df.index.intersection(futures_df.index).intersection(funding_df.index)
-        spot_df = spot_df.loc[common_index]
-        futures_df = futures_df.loc[common_index]
-        funding_df = funding_df.loc[common_index]
-        
-        logger.info(f"数据时间范围: {common_index[0]} 到 {common_index[-1]}")
-        logger.info(f"总数据点数: {len(common_index)}")
+        funding_df['fundingRate'] = pd.to_numeric(funding_df['fundingRate'], errors='coerce')
+        
+        # 数据质量检查：缺口、重复、乱序和异常值只报告，不再用前值或 0 填充掩盖
+        # （运行 data_storage/data_quality.py 写入问题索引，回补脚本据此重新下载）
+        log_report('spot klines', check_klines(spot_df, '4h'))
+        log_report('futures klines', check_klines(futures_df, '4h'))
+        log_report('funding rates', check_funding_rates(funding_df))
+        
+        # 一次对齐：主时钟为现货和合约都有的K线时间，每根K线取当时最近一次结算的资金费率；
+        # 价格无效的K线、第一次结算之前的K线，以及距上次结算超过一个结算间隔（资金费率缺口）的K线
+        # 直接剔除并记录数量，不沿用旧的费率（重复时间戳取最后一行，不要求已排序）
+        aligned = align({
+            'spot': stream(spot_df, valid=_valid_prices(spot_df, 'spot')),
+            'futures': stream(futures_df, valid=_valid_prices(futures_df, 'futures')),
+            'funding': stream(funding_df, columns=['fundingRate'], mode='asof',
+                              tolerance=pd.Timedelta(FUNDING_INTERVAL) + pd.Timedelta(FUNDING_TOLERANCE),
+                              valid=np.isfinite(funding_df['fundingRate'].to_numpy()))
+        })
+        spot_df, futures_df, funding_df = aligned['spot'], aligned['futures'], aligned['funding']
+        
+        logger.info(f"数据时间范围: {spot_df.index[0]} 到 {spot_df.index[-1]}")
+        logger.info(f"总数据点数: {len(spot_df)}")
         logger.info(f"平均资金费率: {funding_df['fundingRate'].mean():.6%}")
         logger.info(f"最大资金费率: {funding_df['fundingRate'].max():.6%}")
         logger.info(f"最小资金费率: {funding_df['fundingRate'].min():.6%}")
@@ -115,19 +107,9 @@ def run_backtest():
         if spot_df is None or futures_df is None or funding_df is None:
             return
             
-        # 添加数据到回测引擎
-        spot_data = HDF5CSVData(dataname=spot_df)
-        futures_data = HDF5CSVData(dataname=futures_df)
-        funding_data = bt.feeds.PandasData(
-            dataname=funding_df[['fundingRate']],
-            datetime=None,
-            openinterest=None,
-            volume=None
-        )
-        
-        cerebro.adddata(spot_data, name='spot')
-        cerebro.adddata(futures_data, name='futures')
-        cerebro.adddata(funding_data, name='funding')
+        # 添加数据到回测引擎（三个数据源共享同一个时间索引）；资金费率映射到 close 线，策略中用 funding_data[0] 读取
+        add_feeds(cerebro, {'spot': spot_df, 'futures': futures_df, 'funding': funding_df},
+                  params={'funding': {'close': 'fundingRate'}})
         
         # 设置初始资金
         initial_cash = 100000.0
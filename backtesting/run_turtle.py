@@ -11,6 +11,8 @@ project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
 from strategies.turtle_trading import TurtleStrategy
+from backtesting.monte_carlo import run_monte_carlo, analyzer_returns, actual_statistics, log_summary
+from strategies.bar_builder import build_bars, to_feed
 
 # 设置日志
 logging.basicConfig(
@@ -19,32 +21,51 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def run_turtle_strategy():
+# 数据源：默认使用 4h K 线文件；设置 BAR_KIND（time/tick/volume/dollar/tick_imbalance）时改用由 tick 库生成的 bar，
+# BAR_THRESHOLD 为对应的阈值（时间间隔、笔数、成交量或成交额，tick_imbalance 不需要）
+BAR_KIND = os.getenv('BAR_KIND')
+BAR_THRESHOLD = os.getenv('BAR_THRESHOLD')
+TICK_FILE = os.path.join(project_root, 'tick_data', 'BTCUSDT_all_tick_data.h5')
+
+def load_data_feed(bar_kind=None, bar_threshold=None):
+    """返回回测数据源：bar_kind 为空时读取 K 线文件，否则用 build_bars 从 tick 库生成 bar"""
+    if bar_kind:
+        bars = build_bars(TICK_FILE, kind=bar_kind, threshold=bar_threshold)
+        if bars.empty:
+            logger.error(f"{TICK_FILE} 中没有可用的成交数据")
+            return None
+        logger.info(f"使用 {bar_kind} bar（阈值 {bar_threshold}），共 {len(bars)} 根")
+        return to_feed(bars)
+
+    data_folder = os.path.join(project_root, 'kline_data')
+    filename = 'BTCUSDT_4h_klines.h5'
+    filepath = os.path.join(data_folder, filename)
+    
+    # 读取HDF5数据
+    df = pd.read_hdf(filepath, key='klines')
+    df.set_index('timestamp', inplace=True)
+    
+    return bt.feeds.PandasData(
+        dataname=df,
+        datetime=None,  # 使用索引作为时间戳
+        open='open',
+        high='high',
+        low='low',
+        close='close',
+        volume='volume',
+        openinterest=-1  # 不使用未平仓量
+    )
+
+def run_turtle_strategy(bar_kind=BAR_KIND, bar_threshold=BAR_THRESHOLD):
     """运行海龟交易策略回测"""
     try:
         # 创建cerebro引擎
         cerebro = bt.Cerebro()
         
-        # 加载数据
-        data_folder = os.path.join(project_root, 'kline_data')
-        filename = 'BTCUSDT_4h_klines.h5'
-        filepath = os.path.join(data_folder, filename)
-        
-        # 读取HDF5数据
-        df = pd.read_hdf(filepath, key='klines')
-        df.set_index('timestamp', inplace=True)
-        
-        # 创建数据源
-        data = bt.feeds.PandasData(
-            dataname=df,
-            datetime=None,  # 使用索引作为时间戳
-            open='open',
-            high='high',
-            low='low',
-            close='close',
-            volume='volume',
-            openinterest=-1  # 不使用未平仓量
-        )
+        # 加载数据（K 线文件或由 tick 库生成的 bar）
+        data = load_data_feed(bar_kind, bar_threshold)
+        if data is None:
+            return
         
         # 添加数据到回测引擎
         cerebro.adddata(data)
@@ -63,6 +84,7 @@ def run_turtle_strategy():
         cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
         cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
         cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')
+        cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='time_return', timeframe=bt.TimeFrame.Days)
         
         # 打印初始资金
         logger.info('Starting Portfolio Value: %.2f' % cerebro.broker.getvalue())
@@ -93,6 +115,14 @@ def run_turtle_strategy():
             if trade_analysis['lost']['total'] > 0:
                 logger.info('平均亏损: %.2f' % trade_analysis['lost']['pnl']['average'])
         
+        # 对日收益率重采样，评估回撤和收益对行情路径的敏感程度（加密货币全年交易，每年 365 期）
+        daily_returns = analyzer_returns(strat.analyzers.time_return.get_analysis())
+        mc_result = run_monte_carlo(daily_returns, periods_per_year=365)
+        # 回测自身的回撤和年化收益用同一个日收益率序列计算，与模拟分布口径一致
+        actual = actual_statistics(daily_returns, periods_per_year=365)
+        if actual:
+            log_summary(mc_result, actual_max_drawdown=actual['max_drawdown'], actual_cagr=actual['cagr'])
+        
         # 绘制图表
         cerebro.plot()
         
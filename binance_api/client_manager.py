@@ -0,0 +1,58 @@
+import logging
+import asyncio
+import os
+from binance.client import AsyncClient
+from dotenv import load_dotenv
+from .rate_limiter import limiter_for_uri
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class ManagedAsyncClient(AsyncClient):
+    """所有 REST 请求前向限流器申请权重，响应后按 x-mbx-used-weight-1m 校正剩余额度"""
+
+    async def _request(self, method, uri, signed, force_params=False, **kwargs):
+        limiter = limiter_for_uri(uri)
+        await limiter.before_request()
+        kwargs = self._get_request_kwargs(method, signed, force_params, **kwargs)
+        async with getattr(self.session, method)(uri, **kwargs) as response:
+            self.response = response
+            await limiter.update_from_headers(response.headers)
+            return await self._handle_response(response)
+
+class ClientManager:
+    """
+    全局共享的 Binance 客户端
+
+    所有模块借用同一个 AsyncClient（同一个 aiohttp 会话，连接保持复用），
+    请求权重由 rate_limiter 统一调度，退出时统一关闭。
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = asyncio.Lock()
+
+    async def get_client(self):
+        """返回共享客户端，首次调用时创建"""
+        if self._client is not None:
+            return self._client
+        async with self._lock:
+            if self._client is None:
+                self._client = await ManagedAsyncClient.create(
+                    os.getenv('BINANCE_API_KEY'), os.getenv('BINANCE_SECRET_KEY')
+                )
+                logger.info("Shared Binance client created")
+        return self._client
+
+    async def close(self):
+        async with self._lock:
+            if self._client is not None:
+                await self._client.close_connection()
+                self._client = None
+                logger.info("Shared Binance client closed")
+
+client_manager = ClientManager()
+
+async def get_client():
+    return await client_manager.get_client()
@@ -0,0 +1,195 @@
+import logging
+import asyncio
+from decimal import Decimal, ROUND_DOWN
+from .rate_limiter import rate_limiter, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# exchangeInfo 刷新间隔（秒），交易规则很少变化
+EXCHANGE_INFO_REFRESH = 3600
+EXCHANGE_INFO_WEIGHT = 20
+
+class OrderValidationError(Exception):
+    """订单在本地校验失败（不满足交易所过滤器），未发送到交易所"""
+
+def _to_decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+def _round_down(value, step):
+    """按步长向下取整，step 为 0 时表示不限制"""
+    value = _to_decimal(value)
+    if not step:
+        return value
+    return (value / step).to_integral_value(rounding=ROUND_DOWN) * step
+
+def format_decimal(value):
+    """转为不带科学计数法的字符串，去掉多余的0"""
+    return format(_to_decimal(value).normalize(), 'f')
+
+class SymbolFilters:
+    """单个交易对的下单规则（PRICE_FILTER、LOT_SIZE、MARKET_LOT_SIZE、MIN_NOTIONAL/NOTIONAL）"""
+
+    def __init__(self, info):
+        self.symbol = info['symbol']
+        self.status = info.get('status', 'TRADING')
+        self.quote_precision = int(info.get('quoteAssetPrecision', info.get('quotePrecision', 8)))
+        self.tick_size = self.min_price = self.max_price = Decimal(0)
+        self.step_size = self.min_qty = self.max_qty = Decimal(0)
+        self.market_step_size = self.market_min_qty = self.market_max_qty = None
+        self.min_notional = self.max_notional = Decimal(0)
+        self.min_notional_market = True
+        self.max_notional_market = False
+
+        for f in info.get('filters', []):
+            filter_type = f['filterType']
+            if filter_type == 'PRICE_FILTER':
+                self.tick_size = Decimal(f['tickSize'])
+                self.min_price = Decimal(f['minPrice'])
+                self.max_price = Decimal(f['maxPrice'])
+            elif filter_type == 'LOT_SIZE':
+                self.step_size = Decimal(f['stepSize'])
+                self.min_qty = Decimal(f['minQty'])
+                self.max_qty = Decimal(f['maxQty'])
+            elif filter_type == 'MARKET_LOT_SIZE':
+                self.market_step_size = Decimal(f['stepSize'])
+                self.market_min_qty = Decimal(f['minQty'])
+                self.market_max_qty = Decimal(f['maxQty'])
+            elif filter_type == 'MIN_NOTIONAL':
+                self.min_notional = Decimal(f['minNotional'])
+                self.min_notional_market = f.get('applyToMarket', True)
+            elif filter_type == 'NOTIONAL':
+                self.min_notional = Decimal(f['minNotional'])
+                self.max_notional = Decimal(f.get('maxNotional', 0))
+                self.min_notional_market = f.get('applyMinToMarket', True)
+                self.max_notional_market = f.get('applyMaxToMarket', False)
+
+    def round_price(self, price):
+        return _round_down(price, self.tick_size)
+
+    def round_quantity(self, quantity, market=False):
+        # 市价单的 MARKET_LOT_SIZE 步长为 0 时沿用 LOT_SIZE
+        step = self.market_step_size if market and self.market_step_size else self.step_size
+        return _round_down(quantity, step)
+
+    def round_quote_quantity(self, amount):
+        return _round_down(amount, Decimal(1).scaleb(-self.quote_precision))
+
+    def validate(self, quantity=None, price=None, market=False, quote_quantity=None):
+        """
+        校验订单参数，不满足时抛出 OrderValidationError
+
+        Args:
+            quantity (Decimal): 已取整的数量，quoteOrderQty 市价单可为空
+            price (Decimal): 限价单价格，市价单传当前价格用于估算名义价值
+            market (bool): 是否为市价单
+            quote_quantity (Decimal): quoteOrderQty 市价单的计价金额
+        """
+        if self.status != 'TRADING':
+            raise OrderValidationError(f"{self.symbol} is not trading (status {self.status})")
+
+        if price is not None and not market:
+            if price <= 0 or price < self.min_price or (self.max_price and price > self.max_price):
+                raise OrderValidationError(f"Price {format_decimal(price)} is outside [{format_decimal(self.min_price)}, {format_decimal(self.max_price)}]")
+
+        if quantity is not None:
+            min_qty, max_qty = self.min_qty, self.max_qty
+            if market and self.market_min_qty is not None:
+                min_qty = max(min_qty, self.market_min_qty)
+                max_qty = self.market_max_qty or max_qty
+            if quantity <= 0 or quantity < min_qty:
+                raise OrderValidationError(f"Quantity {format_decimal(quantity)} is below the minimum {format_decimal(min_qty)}")
+            if max_qty and quantity > max_qty:
+                raise OrderValidationError(f"Quantity {format_decimal(quantity)} is above the maximum {format_decimal(max_qty)}")
+
+        if quote_quantity is not None:
+            notional = quote_quantity
+        elif quantity is not None and price is not None:
+            notional = quantity * price
+        else:
+            return
+        if (not market or self.min_notional_market) and notional < self.min_notional:
+            raise OrderValidationError(f"Notional {format_decimal(notional)} is below the minimum {format_decimal(self.min_notional)}")
+        if self.max_notional and (not market or self.max_notional_market) and notional > self.max_notional:
+            raise OrderValidationError(f"Notional {format_decimal(notional)} is above the maximum {format_decimal(self.max_notional)}")
+
+    def prepare_order(self, quantity, price=None, market=False):
+        """
+        按交易规则取整并校验，返回可直接提交的 (quantity, price) 字符串
+
+        市价单的 price 只用于估算名义价值，返回的 price 为 None
+        """
+        quantity = self.round_quantity(quantity, market=market)
+        if price is not None:
+            price = _to_decimal(price) if market else self.round_price(price)
+        self.validate(quantity=quantity, price=price, market=market)
+        return format_decimal(quantity), (None if market or price is None else format_decimal(price))
+
+    def prepare_quote_order(self, amount):
+        """quoteOrderQty 市价单：取整计价金额并校验名义价值"""
+        amount = self.round_quote_quantity(amount)
+        self.validate(market=True, quote_quantity=amount)
+        return format_decimal(amount)
+
+class ExchangeInfoCache:
+    """
+    交易规则缓存
+
+    启动时加载一次 exchangeInfo，之后由后台任务定期刷新；下单前的取整和校验都在本地完成。
+    """
+
+    def __init__(self, refresh_interval=EXCHANGE_INFO_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._filters = {}
+        self._client = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def start(self, client):
+        if self._task and not self._task.done():
+            return
+        self._client = client
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Initial exchange info load failed: {str(e)}")
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Error refreshing exchange info: {str(e)}")
+
+    async def refresh(self):
+        async with self._lock:
+            async with rate_limiter.budget(EXCHANGE_INFO_WEIGHT, PRIORITY_BULK):
+                info = await self._client.get_exchange_info()
+            self._filters = {symbol['symbol']: SymbolFilters(symbol) for symbol in info['symbols']}
+            logger.info(f"Loaded exchange info for {len(self._filters)} symbols")
+
+    def get(self, symbol):
+        """返回缓存中的交易规则，没有时返回 None"""
+        return self._filters.get(symbol)
+
+    async def get_filters(self, symbol):
+        """返回交易规则，缓存中没有时（例如启动时加载失败）刷新一次"""
+        filters = self._filters.get(symbol)
+        if filters is None and self._client is not None:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Error loading exchange info: {str(e)}")
+            filters = self._filters.get(symbol)
+        if filters is None:
+            raise OrderValidationError(f"No exchange info for {symbol}")
+        return filters
+
+exchange_info = ExchangeInfoCache()
@@ -0,0 +1,187 @@
+import logging
+import asyncio
+import itertools
+import time
+from .exchange_info import exchange_info
+from .ticker_book import ticker_book
+
+logger = logging.getLogger(__name__)
+
+# TWAP 默认参数：拆成 5 笔，在 5 分钟内完成
+TWAP_SLICES = 5
+TWAP_DURATION = 300
+# 冰山单每笔最多吃掉对手方一档挂单量的比例，以及两笔之间等待盘口恢复的时间（秒）
+ICEBERG_BOOK_FRACTION = 0.5
+ICEBERG_INTERVAL = 2
+# 子单金额至少为最小名义价值的倍数，避免被交易所拒绝
+MIN_CHILD_NOTIONAL_MULTIPLIER = 1.1
+# 盘口不可用时冰山单按总额的这个比例下单
+ICEBERG_FALLBACK_FRACTION = 0.2
+# 剩余金额低于母单的这个比例（或低于最小子单金额）时视为完成
+COMPLETION_TOLERANCE = 0.001
+# 冰山单累计失败这么多笔后停止
+MAX_CHILD_FAILURES = 3
+
+class ExecutionJob:
+    """一个母单的执行状态"""
+
+    def __init__(self, job_id, symbol, side, amount, strategy):
+        self.job_id = job_id
+        self.symbol = symbol
+        self.side = side
+        self.amount = amount            # 母单金额（USDT）
+        self.strategy = strategy        # 'TWAP' 或 'ICEBERG'
+        self.status = 'running'         # running / completed / cancelled / failed
+        self.children = []              # 子单的下单响应
+        self.filled_quote = 0.0
+        self.filled_qty = 0.0
+        self.failed_children = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def remaining(self):
+        return max(self.amount - self.filled_quote, 0.0)
+
+    @property
+    def avg_price(self):
+        return self.filled_quote / self.filled_qty if self.filled_qty else None
+
+    @property
+    def progress(self):
+        return self.filled_quote / self.amount * 100 if self.amount else 100.0
+
+    def record_child(self, order):
+        self.children.append(order)
+        self.filled_quote += float(order.get('cummulativeQuoteQty') or 0)
+        self.filled_qty += float(order.get('executedQty') or 0)
+
+class ExecutionEngine:
+    """
+    拆单执行引擎
+
+    把大额母单拆成多笔市价子单：TWAP 在固定时长内等额下单，冰山单按对手方一档挂单量决定每笔大小。
+    每个母单在后台任务中执行，子单成交后通过回调报告进度，不阻塞机器人。
+    """
+
+    def __init__(self, trading_api):
+        self.trading_api = trading_api
+        self.jobs = {}
+        self._tasks = {}
+        self._ids = itertools.count(1)
+
+    def start_twap(self, symbol, side, amount, slices=TWAP_SLICES, duration=TWAP_DURATION, on_progress=None):
+        """启动 TWAP 执行，立即返回 ExecutionJob"""
+        job = self._new_job(symbol, side, amount, 'TWAP')
+        self._spawn(job, self._run_twap(job, slices, duration, on_progress), on_progress)
+        return job
+
+    def start_iceberg(self, symbol, side, amount, book_fraction=ICEBERG_BOOK_FRACTION,
+                      interval=ICEBERG_INTERVAL, on_progress=None):
+        """启动冰山执行，立即返回 ExecutionJob"""
+        job = self._new_job(symbol, side, amount, 'ICEBERG')
+        self._spawn(job, self._run_iceberg(job, book_fraction, interval, on_progress), on_progress)
+        return job
+
+    def cancel(self, job_id):
+        """取消尚未完成的母单，已成交的子单不受影响"""
+        task = self._tasks.get(job_id)
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _new_job(self, symbol, side, amount, strategy):
+        job = ExecutionJob(next(self._ids), symbol, side, float(amount), strategy)
+        self.jobs[job.job_id] = job
+        logger.info(f"Execution job {job.job_id} started: {strategy} {side} {amount} USDT {symbol}")
+        return job
+
+    def _spawn(self, job, coro, on_progress):
+        task = asyncio.create_task(self._supervise(job, coro, on_progress))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+
+    async def _supervise(self, job, coro, on_progress):
+        try:
+            await coro
+            job.status = 'completed' if self._is_done(job) else 'failed'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            logger.error(f"Execution job {job.job_id} failed: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            logger.info(f"Execution job {job.job_id} {job.status}: filled {job.filled_quote:.2f}/{job.amount} USDT, "
+                        f"avg price {job.avg_price}")
+            await self._report(job, on_progress)
+
+    async def _report(self, job, on_progress):
+        if on_progress is None:
+            return
+        try:
+            await on_progress(job)
+        except Exception as e:
+            logger.error(f"Error in execution progress callback: {str(e)}")
+
+    def _min_child_amount(self, symbol):
+        filters = exchange_info.get(symbol)
+        if filters is None or not filters.min_notional:
+            return 0.0
+        return float(filters.min_notional) * MIN_CHILD_NOTIONAL_MULTIPLIER
+
+    def _is_done(self, job):
+        return job.remaining < max(self._min_child_amount(job.symbol), job.amount * COMPLETION_TOLERANCE)
+
+    async def _place_child(self, job, amount, on_progress):
+        order = await self.trading_api.place_market_order(job.symbol, job.side, amount)
+        if order:
+            job.record_child(order)
+        else:
+            job.failed_children += 1
+        await self._report(job, on_progress)
+        return order
+
+    def _next_amount(self, job, amount):
+        """子单金额：不足最小金额的剩余部分并入本笔"""
+        min_amount = self._min_child_amount(job.symbol)
+        amount = max(amount, min_amount)
+        if job.remaining - amount < min_amount:
+            amount = job.remaining
+        return amount
+
+    async def _run_twap(self, job, slices, duration, on_progress):
+        min_amount = self._min_child_amount(job.symbol)
+        if min_amount:
+            # 每笔子单都要满足最小名义价值
+            slices = max(1, min(slices, int(job.amount // min_amount)))
+        interval = duration / slices if slices > 1 else 0
+        child_amount = job.amount / slices
+
+        for i in range(slices):
+            if self._is_done(job):
+                break
+            amount = job.remaining if i == slices - 1 else self._next_amount(job, child_amount)
+            await self._place_child(job, amount, on_progress)
+            if i < slices - 1:
+                await asyncio.sleep(interval)
+
+    async def _run_iceberg(self, job, book_fraction, interval, on_progress):
+        while not self._is_done(job) and job.failed_children < MAX_CHILD_FAILURES:
+            book = ticker_book.get_book(job.symbol)
+            if book is not None:
+                bid, bid_qty, ask, ask_qty = book
+                # 买单吃卖一，卖单吃买一
+                visible = ask * ask_qty if job.side == 'BUY' else bid * bid_qty
+                amount = visible * book_fraction
+            else:
+                amount = job.amount * ICEBERG_FALLBACK_FRACTION
+            await self._place_child(job, self._next_amount(job, min(amount, job.remaining)), on_progress)
+            if not self._is_done(job):
+                await asyncio.sleep(interval)
@@ -1,25 +1,77 @@
 import logging
-from binance.client import AsyncClient
+import json
+import time
 import asyncio
 from datetime import datetime
+from .client_manager import client_manager
+from .ticker_book import ticker_book
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 TOP_CRYPTOS = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'XRPUSDT', 'ADAUSDT', 
                 'DOGEUSDT', 'SOLUSDT', 'TRXUSDT', 'DOTUSDT', 'SHIBUSDT',
                 'SUIUSDT', 'POLUSDT']
 
+# 行情缓存的有效期（秒）
+MARKET_DATA_TTL = 10
+
+class MarketDataCache:
+    """24小时行情缓存
+
+    所有调用方共享同一份数据：缓存过期后只发起一次批量 24hr ticker 请求，
+    刷新期间到达的并发调用会等待同一个请求的结果。
+    """
+
+    def __init__(self, symbols=None, ttl=MARKET_DATA_TTL):
+        self.symbols = list(symbols or TOP_CRYPTOS)
+        self.ttl = ttl
+        self._data = None
+        self._updated_at = 0.0
+        self._refresh_task = None
+
+    def is_fresh(self):
+        return self._data is not None and time.monotonic() - self._updated_at < self.ttl
+
+    async def get(self):
+        """返回缓存的行情，过期时刷新"""
+        if self.is_fresh():
+            return self._data
+
+        # 合并并发请求：只有第一个调用方发起刷新，其余调用方等待同一个任务
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        # shield 防止某个调用方被取消时连带取消共享的刷新任务
+        return await asyncio.shield(self._refresh_task)
+
+    def invalidate(self):
+        """使缓存失效，下次调用时重新获取"""
+        self._updated_at = 0.0
+
+    async def _refresh(self):
+        client = await client_manager.get_client()
+        # 一次批量请求获取所有交易对的24小时行情
+        tickers = await client.get_ticker(symbols=json.dumps(self.symbols, separators=(',', ':')))
+
+        # 按 symbols 的顺序返回结果
+        by_symbol = {ticker['symbol']: ticker for ticker in tickers}
+        results = [by_symbol[symbol] for symbol in self.symbols if symbol in by_symbol]
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for result in results:
+                logger.debug("Raw API response for %s: %s", result['symbol'], result)
+
+        self._data = results
+        self._updated_at = time.monotonic()
+        return results
+
+market_data_cache = MarketDataCache()
+
 async def get_top_crypto_data():
-    client = await AsyncClient.create()
-    tasks = [client.get_ticker(symbol=symbol) for symbol in TOP_CRYPTOS]
-    results = await asyncio.gather(*tasks)
-    await client.close_connection()
-    
-    for result in results:
-        logger.info(f"Raw API response for {result['symbol']}: {result}")
-    
-    return results
+    # 优先使用 websocket 行情表，数据不完整时回退到 REST 缓存
+    tickers = ticker_book.get_tickers(TOP_CRYPTOS)
+    if tickers is not None:
+        return tickers
+    return await market_data_cache.get()
 
 async def format_crypto_data(data):
     formatted_data = []
@@ -31,12 +83,10 @@ async def format_crypto_data(data):
             price_change_percent = float(item['priceChangePercent'])
             volume_usdt = volume * price  # Convert volume to USDT
             
-            logger.info(f"Data for {item['symbol']}:")
-            logger.info(f"  Price: {price}")
-            logger.info(f"  Price Change: {price_change}")
-            logger.info(f"  Price Change Percent: {price_change_percent}%")
-            logger.info(f"  Volume: {volume}")
-            logger.info(f"  Volume in USDT: {volume_usdt}")
+            logger.debug(
+                "Data for %s: price=%s change=%s change_percent=%s%% volume=%s volume_usdt=%s",
+                item['symbol'], price, price_change, price_change_percent, volume, volume_usdt
+            )
             
             formatted_item = {
                 'symbol': item['symbol'],
@@ -51,5 +101,5 @@ async def format_crypto_data(data):
             logger.error(f"Error formatting data for {item.get('symbol', 'Unknown')}: {e}")
             logger.error(f"Raw item data: {item}")  # 添加这行来记录原始数据
     
-    logger.info(f"Formatted data: {formatted_data}")  # 添加这行来记录所有格式化后的数据
+    logger.debug("Formatted data: %s", formatted_data)
     return formatted_data
@@ -0,0 +1,255 @@
+import logging
+import asyncio
+from collections import deque
+import numpy as np
+from binance.streams import BinanceSocketManager
+from .client_manager import client_manager
+from .rate_limiter import rate_limiter, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# 深度快照档数及其请求权重（limit=1000 时为 50）
+SNAPSHOT_LIMIT = 1000
+SNAPSHOT_WEIGHT = 50
+# 断线重连的最长等待时间（秒）
+MAX_RECONNECT_WAIT = 60
+# 快照加载失败后的重试间隔（秒）
+SNAPSHOT_RETRY_WAIT = 5
+# 等待快照期间最多缓存的增量条数（更早的增量反正会被快照覆盖）
+MAX_BUFFERED_EVENTS = 2000
+
+def _merge_levels(prices, qtys, updates):
+    """
+    把增量档位合并进按价格升序排列的数组
+
+    updates 为 [[price, qty], ...]，同价位以增量为准，数量为 0 的档位删除
+    """
+    if not len(updates):
+        return prices, qtys
+    levels = np.asarray(updates, dtype=float)
+    all_prices = np.concatenate([prices, levels[:, 0]])
+    all_qtys = np.concatenate([qtys, levels[:, 1]])
+    # 稳定排序保证同价位时增量排在原数据之后
+    order = np.argsort(all_prices, kind='stable')
+    all_prices = all_prices[order]
+    all_qtys = all_qtys[order]
+    last = np.ones(len(all_prices), dtype=bool)
+    last[:-1] = all_prices[1:] != all_prices[:-1]
+    keep = last & (all_qtys > 0)
+    return all_prices[keep], all_qtys[keep]
+
+class LocalOrderBook:
+    """
+    单个交易对的本地订单簿
+
+    买卖盘各用两个按价格升序的数组保存（买一在买盘数组末尾，卖一在卖盘数组开头），
+    按 Binance 文档的 U/u 规则用深度快照和增量流保持同步。
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bid_prices = np.empty(0)
+        self.bid_qtys = np.empty(0)
+        self.ask_prices = np.empty(0)
+        self.ask_qtys = np.empty(0)
+        self.last_update_id = None
+        self.synced = False
+        self._buffer = deque(maxlen=MAX_BUFFERED_EVENTS)
+
+    def reset(self):
+        """丢弃数据，等待新的快照"""
+        self.last_update_id = None
+        self.synced = False
+        self._buffer = deque(maxlen=MAX_BUFFERED_EVENTS)
+
+    def apply_snapshot(self, snapshot):
+        """应用 REST 深度快照并回放期间缓存的增量，返回是否同步成功"""
+        bids = np.asarray(snapshot['bids'], dtype=float).reshape(-1, 2)
+        asks = np.asarray(snapshot['asks'], dtype=float).reshape(-1, 2)
+        # 快照中买盘按价格降序，翻转为升序
+        self.bid_prices, self.bid_qtys = bids[::-1, 0].copy(), bids[::-1, 1].copy()
+        self.ask_prices, self.ask_qtys = asks[:, 0].copy(), asks[:, 1].copy()
+        self.last_update_id = snapshot['lastUpdateId']
+
+        buffered, self._buffer = self._buffer, deque(maxlen=MAX_BUFFERED_EVENTS)
+        self.synced = True
+        for event in buffered:
+            if not self.apply_event(event):
+                return False
+        return True
+
+    def apply_event(self, event):
+        """
+        应用一条增量，返回 False 表示序号不连续需要重新同步
+
+        未同步时增量先缓存，等快照到达后回放
+        """
+        if self.last_update_id is None:
+            self._buffer.append(event)
+            return True
+        if event['u'] <= self.last_update_id:
+            return True
+        if event['U'] > self.last_update_id + 1:
+            logger.warning(f"Order book gap for {self.symbol}: expected {self.last_update_id + 1}, got {event['U']}")
+            self.reset()
+            self._buffer.append(event)
+            return False
+        self.bid_prices, self.bid_qtys = _merge_levels(self.bid_prices, self.bid_qtys, event['b'])
+        self.ask_prices, self.ask_qtys = _merge_levels(self.ask_prices, self.ask_qtys, event['a'])
+        self.last_update_id = event['u']
+        return True
+
+    def best_bid(self):
+        return self.bid_prices[-1] if len(self.bid_prices) else None
+
+    def best_ask(self):
+        return self.ask_prices[0] if len(self.ask_prices) else None
+
+    def estimate_fill(self, side, quote_amount):
+        """
+        估算市价单按当前盘口逐档成交的结果
+
+        Args:
+            side (str): 'BUY' 吃卖盘，'SELL' 吃买盘
+            quote_amount (float): 成交金额（USDT）
+
+        Returns:
+            dict: vwap、best_price、mid_price、slippage_pct（相对最优价，正数表示不利）、qty、
+                  filled_quote、levels（吃掉的档数）、complete（盘口深度是否足够），盘口为空时返回 None
+        """
+        if side == 'BUY':
+            prices, qtys = self.ask_prices, self.ask_qtys
+        else:
+            prices, qtys = self.bid_prices[::-1], self.bid_qtys[::-1]
+        if not len(prices) or not len(self.bid_prices) or not len(self.ask_prices):
+            return None
+
+        cumulative_quote = np.cumsum(prices * qtys)
+        # 第一个累计金额达到目标的档位
+        idx = int(np.searchsorted(cumulative_quote, quote_amount))
+        complete = idx < len(prices)
+        if complete:
+            filled_before = cumulative_quote[idx - 1] if idx > 0 else 0.0
+            qty_before = qtys[:idx].sum()
+            qty = qty_before + (quote_amount - filled_before) / prices[idx]
+            filled_quote = quote_amount
+            levels = idx + 1
+        else:
+            qty = qtys.sum()
+            filled_quote = cumulative_quote[-1]
+            levels = len(prices)
+
+        best_price = prices[0]
+        vwap = filled_quote / qty
+        slippage = (vwap - best_price) / best_price * 100
+        return {
+            'vwap': float(vwap),
+            'best_price': float(best_price),
+            'mid_price': float((self.best_bid() + self.best_ask()) / 2),
+            'slippage_pct': float(slippage if side == 'BUY' else -slippage),
+            'qty': float(qty),
+            'filled_quote': float(filled_quote),
+            'levels': levels,
+            'complete': complete
+        }
+
+class OrderBookManager:
+    """为一组交易对维护本地订单簿：一个多路复用的增量流，加上按需拉取的深度快照"""
+
+    def __init__(self):
+        self.books = {}
+        self._client = None
+        self._task = None
+        self._running = False
+        self._snapshot_tasks = {}
+
+    async def start(self, symbols):
+        if self._task and not self._task.done():
+            return
+        self.books = {symbol.upper(): LocalOrderBook(symbol.upper()) for symbol in symbols}
+        self._client = await client_manager.get_client()
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Order books started for {len(self.books)} symbols")
+
+    async def stop(self):
+        self._running = False
+        for task in list(self._snapshot_tasks.values()):
+            task.cancel()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._snapshot_tasks.values(), return_exceptions=True)
+            self._task = None
+        self._snapshot_tasks = {}
+        self._client = None
+
+    def get_book(self, symbol):
+        """返回已同步的订单簿，未同步时返回 None"""
+        book = self.books.get(symbol)
+        return book if book is not None and book.synced else None
+
+    def estimate_fill(self, symbol, side, quote_amount):
+        """本地估算市价单成交均价和滑点，订单簿不可用时返回 None"""
+        book = self.get_book(symbol)
+        return book.estimate_fill(side, quote_amount) if book is not None else None
+
+    async def _run(self):
+        streams = [f"{symbol.lower()}@depth@100ms" for symbol in sorted(self.books)]
+        attempts = 0
+        while self._running:
+            try:
+                socket_manager = BinanceSocketManager(self._client)
+                async with socket_manager.multiplex_socket(streams) as stream:
+                    logger.info("Order book depth stream connected")
+                    attempts = 0
+                    # 流建立后再拉快照，期间的增量先缓存
+                    for book in self.books.values():
+                        book.reset()
+                        self._schedule_snapshot(book)
+                    while self._running:
+                        message = await stream.recv()
+                        if message.get('e') == 'error':
+                            raise ConnectionError(message.get('m'))
+                        data = message.get('data', message)
+                        book = self.books.get(data.get('s'))
+                        if book is not None and not book.apply_event(data):
+                            self._schedule_snapshot(book)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                for book in self.books.values():
+                    book.reset()
+                wait = min(MAX_RECONNECT_WAIT, 2 ** attempts)
+                attempts += 1
+                logger.warning(f"Order book stream error: {e}, reconnecting in {wait}s")
+                await asyncio.sleep(wait)
+
+    def _schedule_snapshot(self, book):
+        task = self._snapshot_tasks.get(book.symbol)
+        if task is None or task.done():
+            self._snapshot_tasks[book.symbol] = asyncio.create_task(self._load_snapshot(book))
+
+    async def _load_snapshot(self, book):
+        try:
+            async with rate_limiter.budget(SNAPSHOT_WEIGHT, PRIORITY_INTERACTIVE):
+                snapshot = await self._client.get_order_book(symbol=book.symbol, limit=SNAPSHOT_LIMIT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error loading order book snapshot for {book.symbol}: {str(e)}")
+            await asyncio.sleep(SNAPSHOT_RETRY_WAIT)
+            self._retry_snapshot(book)
+            return
+
+        if book.apply_snapshot(snapshot):
+            logger.info(f"Order book for {book.symbol} synced at {book.last_update_id}")
+        else:
+            # 回放时发现缺口，重新拉取
+            self._retry_snapshot(book)
+
+    def _retry_snapshot(self, book):
+        if self._running:
+            self._snapshot_tasks.pop(book.symbol, None)
+            self._schedule_snapshot(book)
+
+order_books = OrderBookManager()
@@ -1,7 +1,10 @@
 import logging
-from binance.client import AsyncClient
+import asyncio
 from binance.exceptions import BinanceAPIException
 from datetime import datetime, timedelta
+from data_storage.trade_history import trade_ledger
+from .client_manager import client_manager
+from .rate_limiter import rate_limiter, PRIORITY_INTERACTIVE
 
 logger = logging.getLogger(__name__)
 
@@ -12,15 +15,45 @@ TOP_CRYPTOS = [
     'SUIUSDT', 'POLUSDT'
 ]
 
+# allOrders 接口的请求权重
+ALL_ORDERS_WEIGHT = 20
+# 订单历史并发请求可同时占用的权重
+HISTORY_WEIGHT_BUDGET = 100
+# 仍可能发生变化的订单状态，增量刷新时需要重新获取
+OPEN_ORDER_STATUSES = ('NEW', 'PARTIALLY_FILLED', 'PENDING_NEW')
+
+class WeightedSemaphore:
+    """按请求权重限制并发的信号量"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._available = capacity
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, weight):
+        weight = min(weight, self.capacity)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._available >= weight)
+            self._available -= weight
+
+    async def release(self, weight):
+        weight = min(weight, self.capacity)
+        async with self._condition:
+            self._available += weight
+            self._condition.notify_all()
+
 class OrderManagement:
-    def __init__(self, api_key, api_secret):
-        self.client = AsyncClient(api_key, api_secret)
+    def __init__(self):
+        self.client = None   # 首次使用时借用共享客户端
+        self._semaphore = WeightedSemaphore(HISTORY_WEIGHT_BUDGET)
+        self._order_cache = {}   # symbol -> {orderId: order}
+        self._symbol_locks = {}
 
     async def get_order_history(self, symbol=None):
         try:
             logger.info("Starting to fetch order history")
-            all_orders = {}  # 使用字典来按币种组织订单
-            current_time = int(datetime.now().timestamp() * 1000)
+            if self.client is None:
+                self.client = await client_manager.get_client()
             start_time = int((datetime.now() - timedelta(hours=24)).timestamp() * 1000)
 
             # 如果指定了交易对，只获取该交易对的订单
@@ -29,29 +62,15 @@ class OrderManagement:
             else:
                 symbols_to_check = TOP_CRYPTOS  # 使用 TOP_CRYPTOS
 
-            # 遍历每个交易对
-            for sym in symbols_to_check:
-                try:
-                    logger.info(f"Fetching orders for {sym}")
-                    # 获取过去24小时的订单
-                    orders = await self.client.get_all_orders(
-                        symbol=sym,
-                        startTime=start_time,
-                        endTime=current_time
-                    )
-                    
-                    if orders:  # 只添加有订单的交易对
-                        # 按时间排序，最新的订单在前
-                        orders.sort(key=lambda x: x['time'], reverse=True)
-                        all_orders[sym] = orders
-                        logger.info(f"Successfully fetched {len(orders)} orders for {sym}")
-                    
-                except BinanceAPIException as e:
-                    logger.warning(f"Error fetching orders for {sym}: {e}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Unexpected error fetching orders for {sym}: {e}")
-                    continue
+            # 并发获取每个交易对的订单，单个交易对失败不影响其他交易对
+            results = await asyncio.gather(
+                *(self._refresh_symbol(sym, start_time) for sym in symbols_to_check)
+            )
+
+            all_orders = {}  # 使用字典来按币种组织订单
+            for sym, orders in zip(symbols_to_check, results):
+                if orders:  # 只添加有订单的交易对
+                    all_orders[sym] = orders
 
             if all_orders:
                 logger.info(f"Successfully fetched orders for {len(all_orders)} symbols")
@@ -60,11 +79,55 @@ class OrderManagement:
                 logger.info("No orders found in the last 24 hours")
                 return {}
 
-        except BinanceAPIException as e:
-            logger.error(f"Error fetching order history: {e}")
-            logger.error(f"Error type: {type(e)}")
-            logger.error(f"Error details: {str(e)}")
-            return {}
         except Exception as e:
             logger.error(f"Unexpected error in get_order_history: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+    async def _refresh_symbol(self, sym, start_time):
+        """增量刷新单个交易对的订单缓存，返回过去24小时的订单（最新的在前）"""
+        lock = self._symbol_locks.setdefault(sym, asyncio.Lock())
+        async with lock:
+            cache = self._order_cache.get(sym)
+            try:
+                if cache is None:
+                    # 首次获取：过去24小时的全部订单
+                    params = {'symbol': sym, 'startTime': start_time}
+                else:
+                    # 增量获取：从最早的未完成订单或上次见到的最后一个订单之后开始
+                    from_id = max(cache) + 1 if cache else None
+                    open_ids = [order_id for order_id, order in cache.items()
+                                if order['status'] in OPEN_ORDER_STATUSES]
+                    if open_ids:
+                        from_id = min(open_ids) if from_id is None else min(min(open_ids), from_id)
+                    params = {'symbol': sym, 'orderId': from_id} if from_id else {'symbol': sym, 'startTime': start_time}
+
+                logger.debug("Fetching orders for %s with %s", sym, params)
+                await self._semaphore.acquire(ALL_ORDERS_WEIGHT)
+                try:
+                    async with rate_limiter.budget(ALL_ORDERS_WEIGHT, PRIORITY_INTERACTIVE):
+                        orders = await self.client.get_all_orders(**params)
+                finally:
+                    await self._semaphore.release(ALL_ORDERS_WEIGHT)
+
+                cache = {} if cache is None else cache
+                for order in orders:
+                    cache[order['orderId']] = order
+                # 只保留24小时内的订单和仍未完成的订单
+                cache = {order_id: order for order_id, order in cache.items()
+                         if order['time'] >= start_time or order['status'] in OPEN_ORDER_STATUSES}
+                self._order_cache[sym] = cache
+                if orders:
+                    logger.info(f"Fetched {len(orders)} new or updated orders for {sym}")
+                    trade_ledger.record_orders(orders, source='order_management')
+
+            except BinanceAPIException as e:
+                logger.warning(f"Error fetching orders for {sym}: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected error fetching orders for {sym}: {e}")
+
+            if not cache:
+                return []
+            # 按时间排序，最新的订单在前
+            recent = [order for order in cache.values() if order['time'] >= start_time]
+            recent.sort(key=lambda x: x['time'], reverse=True)
+            return recent
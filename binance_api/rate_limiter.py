@@ -0,0 +1,200 @@
+import logging
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只能使用进程内限流
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道：数值越小越优先
+PRIORITY_ORDER = 0          # 下单/撤单
+PRIORITY_INTERACTIVE = 1    # 机器人交互查询
+PRIORITY_BULK = 2           # 历史数据回补
+
+# 各通道不能动用的保留额度（占容量的比例），保证高优先级请求总有余量
+LANE_RESERVE = {
+    PRIORITY_ORDER: 0.0,
+    PRIORITY_INTERACTIVE: 0.1,
+    PRIORITY_BULK: 0.3,
+}
+
+# 现货与合约的 REQUEST_WEIGHT 限制（每分钟），两者是独立的额度
+SPOT_WEIGHT_LIMIT = 6000
+FUTURES_WEIGHT_LIMIT = 2400
+# 未声明权重的请求按该权重计算
+DEFAULT_REQUEST_WEIGHT = 1
+
+class _Budget:
+    """当前上下文中的请求预算：已预付的权重和后续请求使用的通道"""
+
+    def __init__(self, priority, prepaid, per_request):
+        self.priority = priority
+        self.prepaid = prepaid
+        self.per_request = per_request
+
+_current_budget = contextvars.ContextVar('rate_limit_budget', default=None)
+
+class WeightRateLimiter:
+    """
+    按请求权重的令牌桶限流器
+
+    桶容量为每分钟权重上限，按容量/60 每秒匀速补充；每次响应用 x-mbx-used-weight-1m 校正剩余令牌。
+    等待的请求按优先级排队，低优先级通道还要给高优先级留出 LANE_RESERVE 的余量，
+    因此回补任务再多也不会挤占下单。设置 state_path 时令牌状态保存在文件中并用 fcntl 加锁，
+    同一台机器上的多个进程（机器人和数据脚本）共享同一份额度。
+    """
+
+    def __init__(self, capacity=SPOT_WEIGHT_LIMIT, state_path=None, name='spot'):
+        self.capacity = capacity
+        self.refill_rate = capacity / 60.0
+        self.name = name
+        self.state_path = state_path
+        if state_path and fcntl is None:
+            logger.warning("fcntl is not available, rate limit state is not shared between processes")
+            self.state_path = None
+        self._tokens = float(capacity)
+        self._updated = time.time()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, weight, priority=PRIORITY_INTERACTIVE):
+        """等待直到可以消耗 weight 个令牌"""
+        weight = min(weight, self.capacity)
+        entry = (priority, next(self._counter))
+        async with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    # 只有队首（优先级最高、最早到达）的请求可以取令牌
+                    if self._waiters[0] == entry:
+                        wait = await self._take(weight, priority)
+                        if wait <= 0:
+                            heapq.heappop(self._waiters)
+                            self._condition.notify_all()
+                            return
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                self._condition.notify_all()
+                raise
+
+    @asynccontextmanager
+    async def budget(self, weight, priority=PRIORITY_INTERACTIVE, per_request=DEFAULT_REQUEST_WEIGHT):
+        """
+        为一段代码中的请求预付权重
+
+        第一个请求使用预付的 weight，之后的请求（例如分页获取K线）按 per_request 在同一通道排队。
+        """
+        await self.acquire(weight, priority)
+        token = _current_budget.set(_Budget(priority, True, per_request))
+        try:
+            yield
+        finally:
+            _current_budget.reset(token)
+
+    async def before_request(self):
+        """由客户端在每个请求前调用"""
+        budget = _current_budget.get()
+        if budget is None:
+            await self.acquire(DEFAULT_REQUEST_WEIGHT, PRIORITY_INTERACTIVE)
+        elif budget.prepaid:
+            budget.prepaid = False
+        else:
+            await self.acquire(budget.per_request, budget.priority)
+
+    async def update_from_headers(self, headers):
+        """用响应头中的已用权重校正剩余令牌（交易所的计数是准确值）"""
+        value = headers.get('x-mbx-used-weight-1m') or headers.get('X-MBX-USED-WEIGHT-1M')
+        if value is None:
+            return
+        remaining = self.capacity - int(value)
+        await self._with_state_async(lambda: self._sync(remaining))
+
+    @property
+    def available(self):
+        """当前可用令牌数"""
+        return self._with_state(lambda: self._tokens)
+
+    async def _take(self, weight, priority):
+        """尝试取令牌，成功返回 0，否则返回需要等待的秒数"""
+        return await self._with_state_async(lambda: self._take_tokens(weight, priority))
+
+    def _take_tokens(self, weight, priority):
+        reserve = self.capacity * LANE_RESERVE.get(priority, 0.0)
+        if self._tokens - weight >= reserve:
+            self._tokens -= weight
+            return 0
+        return (weight + reserve - self._tokens) / self.refill_rate
+
+    def _sync(self, remaining):
+        if remaining < self._tokens:
+            self._tokens = float(max(remaining, 0))
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    async def _with_state_async(self, func):
+        """
+        在事件循环中使用的 _with_state
+
+        共享状态文件的 flock 可能被其他进程长时间持有，加锁和文件读写放到线程中执行，
+        避免阻塞事件循环；不共享状态时直接在当前线程计算。
+        """
+        if not self.state_path:
+            return self._with_state(func)
+        return await asyncio.to_thread(self._with_state, func)
+
+    def _with_state(self, func):
+        """在（可能跨进程共享的）令牌状态上执行 func"""
+        if not self.state_path:
+            self._refill()
+            return func()
+
+        with open(self.state_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                if content:
+                    state = json.loads(content)
+                    self._tokens, self._updated = state['tokens'], state['updated']
+                self._refill()
+                result = func()
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({'tokens': self._tokens, 'updated': self._updated}))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _state_path(suffix):
+    path = os.getenv('RATE_LIMIT_STATE_FILE')
+    return f"{path}.{suffix}" if path else None
+
+rate_limiter = WeightRateLimiter(SPOT_WEIGHT_LIMIT, _state_path('spot'), name='spot')
+futures_rate_limiter = WeightRateLimiter(FUTURES_WEIGHT_LIMIT, _state_path('futures'), name='futures')
+
+def limiter_for_uri(uri):
+    """合约接口（fapi/dapi）使用独立的额度"""
+    if '//fapi.' in uri or '//dapi.' in uri:
+        return futures_rate_limiter
+    return rate_limiter
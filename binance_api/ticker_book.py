@@ -0,0 +1,159 @@
+import logging
+import asyncio
+import time
+from binance.streams import BinanceSocketManager
+from .client_manager import client_manager
+
+logger = logging.getLogger(__name__)
+
+# 超过这个时间（秒）没有更新的行情视为过期，调用方应回退到 REST
+STALE_AFTER = 60
+# 断线重连的最长等待时间（秒）
+MAX_RECONNECT_WAIT = 60
+
+class TickerBook:
+    """由 websocket 推送维护的本地行情表
+
+    订阅全市场 mini ticker 和各交易对的 book ticker 流，
+    在内存中保存最新价格、买卖一档和24小时统计，价格读取变为本地查询。
+    """
+
+    def __init__(self, stale_after=STALE_AFTER):
+        self.stale_after = stale_after
+        self.symbols = set()
+        self._tickers = {}
+        self._client = None
+        self._task = None
+        self._running = False
+        self._price_listeners = []
+
+    def add_price_listener(self, callback):
+        """
+        注册价格回调，callback(symbol, price) 为普通函数
+
+        每次成交价或买卖一档变化时在消费循环内同步调用（book ticker 推送时传买卖一中间价），
+        回调必须是快速的本地计算，耗时操作应自行放到任务中。
+        """
+        self._price_listeners.append(callback)
+
+    def _notify_price(self, symbol, price):
+        for callback in self._price_listeners:
+            try:
+                callback(symbol, price)
+            except Exception as e:
+                logger.error(f"Error in price listener: {str(e)}")
+
+    async def start(self, symbols):
+        """启动后台 websocket 消费任务"""
+        if self._task and not self._task.done():
+            return
+        self.symbols = {symbol.upper() for symbol in symbols}
+        self._running = True
+        self._client = await client_manager.get_client()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Ticker book started for {len(self.symbols)} symbols")
+
+    async def stop(self):
+        """停止后台任务（共享客户端由 client_manager 关闭）"""
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._client = None
+
+    async def _run(self):
+        """消费行情流，断开后按指数退避自动重连"""
+        streams = ['!miniTicker@arr'] + [f"{symbol.lower()}@bookTicker" for symbol in sorted(self.symbols)]
+        attempts = 0
+        while self._running:
+            try:
+                socket_manager = BinanceSocketManager(self._client)
+                async with socket_manager.multiplex_socket(streams) as stream:
+                    logger.info("Ticker book websocket connected")
+                    attempts = 0
+                    while self._running:
+                        message = await stream.recv()
+                        if message.get('e') == 'error':
+                            raise ConnectionError(message.get('m'))
+                        self._handle_message(message.get('data'))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                wait = min(MAX_RECONNECT_WAIT, 2 ** attempts)
+                attempts += 1
+                logger.warning(f"Ticker book stream error: {e}, reconnecting in {wait}s")
+                await asyncio.sleep(wait)
+
+    def _handle_message(self, data):
+        if isinstance(data, list):
+            # 全市场 mini ticker：只保留配置的交易对
+            for item in data:
+                if item.get('s') in self.symbols:
+                    self._update_mini_ticker(item)
+        elif isinstance(data, dict) and 'b' in data and 'a' in data:
+            if data.get('s') in self.symbols:
+                self._update_book_ticker(data)
+
+    def _update_mini_ticker(self, item):
+        ticker = self._tickers.setdefault(item['s'], {'symbol': item['s']})
+        close_price = float(item['c'])
+        open_price = float(item['o'])
+        ticker['lastPrice'] = close_price
+        ticker['openPrice'] = open_price
+        ticker['highPrice'] = float(item['h'])
+        ticker['lowPrice'] = float(item['l'])
+        ticker['volume'] = float(item['v'])
+        ticker['quoteVolume'] = float(item['q'])
+        ticker['priceChange'] = close_price - open_price
+        ticker['priceChangePercent'] = (close_price - open_price) / open_price * 100 if open_price else 0.0
+        ticker['updated'] = time.monotonic()
+        if self._price_listeners:
+            self._notify_price(item['s'], close_price)
+
+    def _update_book_ticker(self, item):
+        ticker = self._tickers.setdefault(item['s'], {'symbol': item['s']})
+        ticker['bidPrice'] = float(item['b'])
+        ticker['bidQty'] = float(item['B'])
+        ticker['askPrice'] = float(item['a'])
+        ticker['askQty'] = float(item['A'])
+        ticker['bookUpdated'] = time.monotonic()
+        if self._price_listeners:
+            self._notify_price(item['s'], (ticker['bidPrice'] + ticker['askPrice']) / 2)
+
+    def _is_fresh(self, ticker, key='updated'):
+        updated = ticker.get(key)
+        return updated is not None and time.monotonic() - updated < self.stale_after
+
+    def get_price(self, symbol):
+        """返回最新成交价，没有数据或数据过期时返回 None"""
+        ticker = self._tickers.get(symbol)
+        if ticker is None or not self._is_fresh(ticker):
+            return None
+        return ticker['lastPrice']
+
+    def get_book(self, symbol):
+        """返回 (买一价, 买一量, 卖一价, 卖一量)，没有数据或数据过期时返回 None"""
+        ticker = self._tickers.get(symbol)
+        if ticker is None or not self._is_fresh(ticker, 'bookUpdated'):
+            return None
+        return ticker['bidPrice'], ticker['bidQty'], ticker['askPrice'], ticker['askQty']
+
+    def get_ticker(self, symbol):
+        """返回与 REST 24hr ticker 字段一致的行情字典"""
+        ticker = self._tickers.get(symbol)
+        if ticker is None or not self._is_fresh(ticker):
+            return None
+        return dict(ticker)
+
+    def get_tickers(self, symbols):
+        """批量读取行情，任一交易对缺失时返回 None"""
+        tickers = []
+        for symbol in symbols:
+            ticker = self.get_ticker(symbol)
+            if ticker is None:
+                return None
+            tickers.append(ticker)
+        return tickers
+
+ticker_book = TickerBook()
@@ -1,73 +1,158 @@
-from binance.client import AsyncClient
-import os
 from dotenv import load_dotenv
 import logging
 import time
+import asyncio
+from .client_manager import client_manager
+from .rate_limiter import rate_limiter, PRIORITY_ORDER, PRIORITY_INTERACTIVE
+from .ticker_book import ticker_book
+from .exchange_info import exchange_info, OrderValidationError
+from data_storage.trade_history import trade_ledger
 
 # 加载环境变量
 load_dotenv()
 
+# 批量下单时同时在途的请求数上限
+MAX_CONCURRENT_ORDERS = 10
+# 请求权重：下单 1，不指定交易对的 openOrders 80
+ORDER_WEIGHT = 1
+OPEN_ORDERS_WEIGHT = 80
+
 class TradingAPI:
     def __init__(self):
         self.client = None
 
     async def init(self):
-        api_key = os.getenv('BINANCE_API_KEY')
-        api_secret = os.getenv('BINANCE_SECRET_KEY')
-        self.client = await AsyncClient.create(api_key, api_secret)
+        # 借用共享客户端，连接和权重预算与其他模块共用
+        self.client = await client_manager.get_client()
+        await exchange_info.start(self.client)
         print("Binance trading API initialized")
 
     async def close(self):
-        if self.client:
-            await self.client.close_connection()
+        await exchange_info.stop()
+        # 共享客户端由 client_manager 统一关闭
+        self.client = None
 
-    async def place_market_order(self, symbol, side, amount):
+    async def get_current_price(self, symbol):
+        """获取当前价格：优先读取本地行情表，没有数据时才请求 REST"""
+        price = ticker_book.get_price(symbol)
+        if price is not None:
+            return price
+        ticker = await self.client.get_symbol_ticker(symbol=symbol)
+        return float(ticker['price'])
+
+    def _record_order(self, order):
+        """把下单结果写入本地账本，账本出错不影响下单结果"""
         try:
+            trade_ledger.record_orders([order], source='trading_api')
+        except Exception as e:
+            logging.error(f"Error recording order in ledger: {str(e)}")
+
+    async def _prepare_order(self, symbol, side, order_type, amount, price=None):
+        """按交易规则取整并校验，返回 create_order 的参数；校验失败抛出 OrderValidationError"""
+        filters = await exchange_info.get_filters(symbol)
+        if order_type == 'MARKET':
             if side == 'BUY':
-                order = await self.client.order_market_buy(
-                    symbol=symbol,
-                    quoteOrderQty=amount  # 使用 quoteOrderQty 来指定 USDT 金额
-                )
-            else:  # SELL
-                # 对于卖出，我们需要先获取当前价格来计算数量
-                ticker = await self.client.get_symbol_ticker(symbol=symbol)
-                current_price = float(ticker['price'])
-                quantity = amount / current_price
-                order = await self.client.order_market_sell(
-                    symbol=symbol,
-                    quantity=quantity
-                )
+                # 使用 quoteOrderQty 来指定 USDT 金额
+                return {'symbol': symbol, 'side': side, 'type': 'MARKET',
+                        'quoteOrderQty': filters.prepare_quote_order(amount)}
+            # 对于卖出，我们需要先获取当前价格来计算数量
+            current_price = await self.get_current_price(symbol)
+            quantity, _ = filters.prepare_order(amount / current_price, current_price, market=True)
+            return {'symbol': symbol, 'side': side, 'type': 'MARKET', 'quantity': quantity}
+
+        current_price = await self.get_current_price(symbol)
+        quantity, price = filters.prepare_order(amount / current_price, price)
+        return {'symbol': symbol, 'side': side, 'type': 'LIMIT', 'timeInForce': 'GTC',
+                'quantity': quantity, 'price': price}
+
+    async def place_market_order(self, symbol, side, amount):
+        try:
+            params = await self._prepare_order(symbol, side, 'MARKET', amount)
+            async with rate_limiter.budget(ORDER_WEIGHT, PRIORITY_ORDER):
+                order = await self.client.create_order(**params)
+            self._record_order(order)
             return order
+        except OrderValidationError as e:
+            logging.error(f"Market order rejected locally for {symbol}: {str(e)}")
+            return None
         except Exception as e:
             print(f"Error placing market order: {e}")
             return None
 
     async def place_limit_order(self, symbol, side, amount, price):
         try:
-            ticker = await self.client.get_symbol_ticker(symbol=symbol)
-            current_price = float(ticker['price'])
-            quantity = amount / current_price
-
-            if side == 'BUY':
-                order = await self.client.order_limit_buy(
-                    symbol=symbol,
-                    quantity=quantity,
-                    price=price
-                )
-            else:  # SELL
-                order = await self.client.order_limit_sell(
-                    symbol=symbol,
-                    quantity=quantity,
-                    price=price
-                )
+            params = await self._prepare_order(symbol, side, 'LIMIT', amount, price)
+            async with rate_limiter.budget(ORDER_WEIGHT, PRIORITY_ORDER):
+                order = await self.client.create_order(**params)
+            self._record_order(order)
             return order
+        except OrderValidationError as e:
+            logging.error(f"Limit order rejected locally for {symbol}: {str(e)}")
+            return None
         except Exception as e:
             print(f"Error placing limit order: {e}")
             return None
 
+    async def place_batch_orders(self, orders, max_concurrency=MAX_CONCURRENT_ORDERS):
+        """
+        批量下单（例如按 TOP_CRYPTOS 调仓）
+
+        现货没有批量下单接口，因此先在本地校验全部订单，再在并发上限内同时提交，
+        总耗时约为一次往返。单个订单失败不影响其他订单。
+
+        Args:
+            orders (list): 字典列表，字段为 symbol, side, type ('MARKET'/'LIMIT'), amount（USDT 金额），限价单需要 price
+            max_concurrency (int): 同时在途的下单请求数
+
+        Returns:
+            list: 与 orders 一一对应的结果 {'symbol', 'side', 'status', 'order', 'error'}，
+                  status 为 'placed'、'rejected'（本地校验失败）或 'failed'（交易所返回错误）
+        """
+        results = [{'symbol': o['symbol'], 'side': o['side'], 'status': None, 'order': None, 'error': None}
+                   for o in orders]
+
+        # 先全部校验，无效订单不占用请求
+        prepared = await asyncio.gather(
+            *(self._prepare_order(o['symbol'], o['side'], o.get('type', 'MARKET'), o['amount'], o.get('price'))
+              for o in orders),
+            return_exceptions=True
+        )
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def submit(result, params):
+            async with semaphore:
+                try:
+                    async with rate_limiter.budget(ORDER_WEIGHT, PRIORITY_ORDER):
+                        order = await self.client.create_order(**params)
+                except Exception as e:
+                    result['status'] = 'failed'
+                    result['error'] = str(e)
+                    return
+            result['status'] = 'placed'
+            result['order'] = order
+            self._record_order(order)
+
+        submissions = []
+        for result, params in zip(results, prepared):
+            if isinstance(params, Exception):
+                result['status'] = 'rejected' if isinstance(params, OrderValidationError) else 'failed'
+                result['error'] = str(params)
+            else:
+                submissions.append(submit(result, params))
+        await asyncio.gather(*submissions)
+
+        placed = sum(1 for result in results if result['status'] == 'placed')
+        logging.info(f"Batch order: {placed}/{len(orders)} placed")
+        for result in results:
+            if result['error']:
+                logging.error(f"Batch order {result['side']} {result['symbol']} {result['status']}: {result['error']}")
+        return results
+
     async def get_open_orders(self):
         try:
-            orders = await self.client.get_open_orders()
+            async with rate_limiter.budget(OPEN_ORDERS_WEIGHT, PRIORITY_INTERACTIVE):
+                orders = await self.client.get_open_orders()
             return orders
         except Exception as e:
             logging.error(f"Error fetching open orders: {str(e)}")
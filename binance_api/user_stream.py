@@ -0,0 +1,182 @@
+import logging
+import asyncio
+from binance.streams import BinanceSocketManager
+from data_storage.trade_history import trade_ledger
+from .rate_limiter import rate_limiter, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# 断线重连的最长等待时间（秒）
+MAX_RECONNECT_WAIT = 60
+# 快照请求的权重：不指定交易对的 openOrders 80，account 20
+SNAPSHOT_WEIGHT = 100
+# 订单进入这些状态后从未完成订单表中移除
+FINAL_STATUSES = ('FILLED', 'CANCELED', 'REJECTED', 'EXPIRED', 'EXPIRED_IN_MATCH')
+
+class UserDataStream:
+    """
+    用户数据流消费者
+
+    python-binance 的 user_socket 负责创建 listenKey 并定时续期；本类在每次（重新）连接后
+    用 REST 同步一次未完成订单和余额，之后完全由 executionReport / outboundAccountPosition
+    事件增量维护，查询订单状态不再消耗请求权重。成交事件会通知已注册的回调。
+    """
+
+    def __init__(self):
+        self.open_orders = {}    # orderId -> order（字段与 REST 订单接口一致）
+        self.balances = {}       # asset -> {'free': float, 'locked': float}
+        self.ready = False
+        self._client = None
+        self._task = None
+        self._running = False
+        self._fill_listeners = []
+        self._balance_listeners = []
+
+    def add_fill_listener(self, callback):
+        """注册成交回调，callback(fill) 为协程函数，fill 为字典"""
+        self._fill_listeners.append(callback)
+
+    def add_balance_listener(self, callback):
+        """注册余额回调，callback(balances) 为普通函数，balances 只包含变化的资产（清零的资产数量为 0）"""
+        self._balance_listeners.append(callback)
+
+    def _notify_balances(self, balances):
+        for callback in self._balance_listeners:
+            try:
+                callback(balances)
+            except Exception as e:
+                logger.error(f"Error in balance listener: {str(e)}")
+
+    async def start(self, client):
+        """使用已认证的 AsyncClient 启动用户数据流"""
+        if self._task and not self._task.done():
+            return
+        self._client = client
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._running = False
+        self.ready = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        attempts = 0
+        while self._running:
+            try:
+                socket_manager = BinanceSocketManager(self._client)
+                async with socket_manager.user_socket() as stream:
+                    # 连接建立后同步一次快照，断线期间错过的事件由快照补齐
+                    await self._sync_snapshot()
+                    logger.info("User data stream connected")
+                    attempts = 0
+                    while self._running:
+                        event = await stream.recv()
+                        if event.get('e') == 'error':
+                            raise ConnectionError(event.get('m'))
+                        await self._handle_event(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.ready = False
+                wait = min(MAX_RECONNECT_WAIT, 2 ** attempts)
+                attempts += 1
+                logger.warning(f"User data stream error: {e}, reconnecting in {wait}s")
+                await asyncio.sleep(wait)
+
+    async def _sync_snapshot(self):
+        async with rate_limiter.budget(SNAPSHOT_WEIGHT, PRIORITY_INTERACTIVE, per_request=0):
+            orders = await self._client.get_open_orders()
+            account = await self._client.get_account()
+        self.open_orders = {order['orderId']: order for order in orders}
+        balances = {
+            balance['asset']: {'free': float(balance['free']), 'locked': float(balance['locked'])}
+            for balance in account['balances']
+            if float(balance['free']) or float(balance['locked'])
+        }
+        changed = {asset: {'free': 0.0, 'locked': 0.0} for asset in self.balances if asset not in balances}
+        changed.update(balances)
+        self.balances = balances
+        self.ready = True
+        self._notify_balances(changed)
+
+    async def _handle_event(self, event):
+        event_type = event.get('e')
+        if event_type == 'executionReport':
+            await self._handle_execution_report(event)
+        elif event_type == 'outboundAccountPosition':
+            changed = {}
+            for balance in event.get('B', []):
+                free, locked = float(balance['f']), float(balance['l'])
+                changed[balance['a']] = {'free': free, 'locked': locked}
+                if free or locked:
+                    self.balances[balance['a']] = {'free': free, 'locked': locked}
+                else:
+                    self.balances.pop(balance['a'], None)
+            self._notify_balances(changed)
+
+    async def _handle_execution_report(self, event):
+        order = {
+            'symbol': event['s'],
+            'orderId': event['i'],
+            'clientOrderId': event['c'],
+            'side': event['S'],
+            'type': event['o'],
+            'status': event['X'],
+            'price': event['p'],
+            'origQty': event['q'],
+            'executedQty': event['z'],
+            'cummulativeQuoteQty': event['Z'],
+            'time': event['O'],
+            'updateTime': event['T']
+        }
+        if order['status'] in FINAL_STATUSES:
+            self.open_orders.pop(order['orderId'], None)
+        else:
+            self.open_orders[order['orderId']] = order
+
+        fill = None
+        if event['x'] == 'TRADE':
+            fill = {
+                'symbol': event['s'],
+                'trade_id': event['t'],
+                'order_id': event['i'],
+                'side': event['S'],
+                'price': float(event['L']),
+                'qty': float(event['l']),
+                'commission': float(event['n'] or 0),
+                'commission_asset': event['N'],
+                'time': event['T'],
+                'status': event['X'],
+                'executed_qty': float(event['z']),
+                'orig_qty': float(event['q'])
+            }
+
+        try:
+            trade_ledger.record_orders([order], source='user_stream')
+            if fill:
+                trade_ledger.record_fills([fill])
+        except Exception as e:
+            logger.error(f"Error recording user stream event in ledger: {str(e)}")
+
+        if fill:
+            for callback in self._fill_listeners:
+                try:
+                    await callback(fill)
+                except Exception as e:
+                    logger.error(f"Error in fill listener: {str(e)}")
+
+    def get_open_orders(self, symbol=None):
+        """返回本地维护的未完成订单"""
+        orders = self.open_orders.values()
+        if symbol:
+            orders = [order for order in orders if order['symbol'] == symbol]
+        return sorted(orders, key=lambda order: order['time'], reverse=True)
+
+    def get_balance(self, asset):
+        return self.balances.get(asset, {'free': 0.0, 'locked': 0.0})
+
+user_stream = UserDataStream()
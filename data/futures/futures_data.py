@@ -1,12 +1,26 @@
 import logging
 import os
+import sys
 import pandas as pd
-from binance.client import AsyncClient
 from binance.exceptions import BinanceAPIException
 from datetime import datetime
 import asyncio
 from dotenv import load_dotenv
 
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(project_root)
+
+from binance_api.client_manager import ManagedAsyncClient
+from binance_api.rate_limiter import futures_rate_limiter, PRIORITY_BULK
+from data_storage.data_quality import (check_funding_rates, check_klines, dataset_key, is_resampled_funding,
+                                       issues_index, log_report, merge_repaired)
+
+# 合约 klines（limit 1000-1500）和 fundingRate 请求的权重
+FUTURES_KLINES_WEIGHT = 10
+FUNDING_RATE_WEIGHT = 1
+
 # 加载环境变量
 load_dotenv()
 
@@ -22,7 +36,8 @@ class BinanceFuturesData:
     async def initialize(self):
         """初始化 Binance 客户端"""
         try:
-            self.client = await AsyncClient.create(self.api_key, self.api_secret)
+            # 合约接口使用独立额度的限流器，回补请求走低优先级通道
+            self.client = await ManagedAsyncClient.create(self.api_key, self.api_secret)
             logger.info("Binance client initialized successfully")
             
             # 创建数据文件夹（如果不存在）
@@ -39,32 +54,11 @@ class BinanceFuturesData:
         """获取所有合约K线数据，从指定日期开始"""
         try:
             logger.info(f"Fetching all futures klines for {symbol} from {start_str}")
-            all_klines = []
             
             # 转换开始时间为时间戳
             start_ts = int(datetime.strptime(start_str, "%Y-%m-%d").timestamp() * 1000)
             end_ts = int(datetime.now().timestamp() * 1000)
-            
-            while start_ts < end_ts:
-                # 获取一批数据
-                klines = await self.client.futures_klines(
-                    symbol=symbol,
-                    interval=interval,
-                    startTime=start_ts,
-                    limit=1500
-                )
-                
-                if not klines:
-                    break
-                    
-                all_klines.extend(klines)
-                logger.info(f"Fetched {len(klines)} klines, total: {len(all_klines)}")
-                
-                # 更新开始时间戳为最后一条数据的时间
-                start_ts = klines[-1][0] + 1
-                
-                # 添加延迟避免触发频率限制
-                await asyncio.sleep(0.5)
+            all_klines = await self._fetch_klines_range(symbol, interval, start_ts, end_ts)
             
             if all_klines:
                 self.save_klines_to_hdf5(all_klines, symbol, interval)
@@ -79,35 +73,73 @@ class BinanceFuturesData:
             logger.error(f"Unexpected error: {e}")
             return []
 
+    async def _fetch_klines_range(self, symbol, interval, start_ts, end_ts):
+        """分页获取 [start_ts, end_ts] 内的合约K线"""
+        all_klines = []
+        while start_ts <= end_ts:
+            # 获取一批数据
+            async with futures_rate_limiter.budget(FUTURES_KLINES_WEIGHT, PRIORITY_BULK):
+                klines = await self.client.futures_klines(
+                    symbol=symbol,
+                    interval=interval,
+                    startTime=start_ts,
+                    endTime=end_ts,
+                    limit=1500
+                )
+            
+            if not klines:
+                break
+                
+            all_klines.extend(klines)
+            logger.info(f"Fetched {len(klines)} klines, total: {len(all_klines)}")
+            
+            # 更新开始时间戳为最后一条数据的时间（请求频率由限流器控制）
+            start_ts = klines[-1][0] + 1
+        return all_klines
+
+    def klines_path(self, symbol, interval):
+        return os.path.join(self.data_folder, f"{symbol}_{interval}_futures.h5")
+
+    def funding_path(self, symbol):
+        return os.path.join(self.data_folder, f"{symbol}_funding_rates.h5")
+
+    def klines_to_frame(self, klines):
+        """把接口返回的合约K线转换为DataFrame"""
+        df = pd.DataFrame(klines, columns=[
+            'timestamp', 'open', 'high', 'low', 'close', 
+            'volume', 'close_time', 'quote_volume',
+            'trades_count', 'taker_buy_volume',
+            'taker_buy_quote_volume', 'ignore'
+        ])
+        
+        # 转换时间戳
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        df['close_time'] = pd.to_datetime(df['close_time'], unit='ms')
+        
+        # 转换数值类型
+        numeric_columns = ['open', 'high', 'low', 'close', 'volume', 
+                         'quote_volume', 'taker_buy_volume',
+                         'taker_buy_quote_volume']
+        
+        for col in numeric_columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
     def save_klines_to_hdf5(self, klines, symbol, interval):
         """保存K线数据到HDF5文件"""
         try:
-            filename = f"{symbol}_{interval}_futures.h5"
-            filepath = os.path.join(self.data_folder, filename)
-            
-            # 转换为DataFrame
-            df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 
-                'volume', 'close_time', 'quote_volume',
-                'trades_count', 'taker_buy_volume',
-                'taker_buy_quote_volume', 'ignore'
-            ])
-            
-            # 转换时间戳
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df['close_time'] = pd.to_datetime(df['close_time'], unit='ms')
-            
-            # 转换数值类型
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume', 
-                             'quote_volume', 'taker_buy_volume',
-                             'taker_buy_quote_volume']
-            
-            for col in numeric_columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+            filepath = self.klines_path(symbol, interval)
+            df = klines if isinstance(klines, pd.DataFrame) else self.klines_to_frame(klines)
             
             # 保存到HDF5
             df.to_hdf(filepath, key='futures_klines', mode='w')
             logger.info(f"Saved {len(df)} klines to {filepath}")
+
+            # 保存后重新检查，问题索引只保留仍未修复的区间
+            key = dataset_key('futures_klines', symbol, interval)
+            report = check_klines(df, interval)
+            log_report(key, report)
+            issues_index.update(key, report)
             
         except Exception as e:
             logger.error(f"Error saving klines to HDF5: {e}")
@@ -116,49 +148,140 @@ class BinanceFuturesData:
         """获取所有历史资金费率数据"""
         try:
             logger.info(f"Fetching all funding rates for {symbol} from {start_str}")
-            all_rates = []
             
             # 转换开始时间为时间戳
             start_ts = int(datetime.strptime(start_str, "%Y-%m-%d").timestamp() * 1000)
             end_ts = int(datetime.now().timestamp() * 1000)
+            all_rates = await self._fetch_funding_range(symbol, start_ts, end_ts)
             
-            while start_ts < end_ts:
-                # 获取一批数据
+            if all_rates:
+                self.save_funding_rates_to_hdf5(self.funding_to_frame(all_rates), symbol)
+                
+            return all_rates
+                
+        except BinanceAPIException as e:
+            logger.error(f"Binance API error: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return []
+
+    async def _fetch_funding_range(self, symbol, start_ts, end_ts):
+        """分页获取 [start_ts, end_ts] 内的资金费率记录"""
+        all_rates = []
+        while start_ts <= end_ts:
+            # 获取一批数据
+            async with futures_rate_limiter.budget(FUNDING_RATE_WEIGHT, PRIORITY_BULK):
                 rates = await self.client.futures_funding_rate(
                     symbol=symbol,
                     startTime=start_ts,
+                    endTime=end_ts,
                     limit=1000  # API限制每次最多1000条
                 )
-                
-                if not rates:
-                    break
-                    
-                all_rates.extend(rates)
-                logger.info(f"Fetched {len(rates)} funding rates, total: {len(all_rates)}")
-                
-                # 更新开始时间戳为最后一条数据的时间
-                start_ts = rates[-1]['fundingTime'] + 1
-                
-                # 添加延迟避免触发频率限制
-                await asyncio.sleep(0.5)
             
-            if all_rates:
-                # 转换为DataFrame并保存
-                df = pd.DataFrame(all_rates)
-                df['fundingTime'] = pd.to_datetime(df['fundingTime'], unit='ms')
-                df.set_index('fundingTime', inplace=True)
-                
-                # 重采样到4小时
-                df = df.resample('4H').ffill()  # 使用前值填充
-                
-                # 保存到HDF5
-                filename = f"{symbol}_funding_rates.h5"
-                filepath = os.path.join(self.data_folder, filename)
-                df.to_hdf(filepath, key='funding_rates', mode='w')
-                logger.info(f"Saved {len(df)} funding rates to {filepath}")
-                
-            return all_rates
+            if not rates:
+                break
                 
+            all_rates.extend(rates)
+            logger.info(f"Fetched {len(rates)} funding rates, total: {len(all_rates)}")
+            
+            # 更新开始时间戳为最后一条数据的时间（请求频率由限流器控制）
+            start_ts = rates[-1]['fundingTime'] + 1
+        return all_rates
+
+    def funding_to_frame(self, rates):
+        """把接口返回的资金费率记录转换为DataFrame"""
+        df = pd.DataFrame(rates)
+        df['fundingTime'] = pd.to_datetime(df['fundingTime'], unit='ms')
+        df['fundingRate'] = pd.to_numeric(df['fundingRate'], errors='coerce')
+        if 'markPrice' in df:
+            df['markPrice'] = pd.to_numeric(df['markPrice'], errors='coerce')
+        return df
+
+    def save_funding_rates_to_hdf5(self, df, symbol):
+        """
+        保存资金费率记录到HDF5文件
+
+        保存的是每次结算的原始记录（以 fundingTime 为索引），不再重采样填充，
+        缺口才能被检测出来；回测时由对齐步骤按时间取最近一次结算的费率。
+        """
+        try:
+            filepath = self.funding_path(symbol)
+            if 'fundingTime' in df:
+                df = df.set_index('fundingTime')
+            df.to_hdf(filepath, key='funding_rates', mode='w')
+            logger.info(f"Saved {len(df)} funding rates to {filepath}")
+
+            key = dataset_key('funding_rates', symbol)
+            report = check_funding_rates(df)
+            log_report(key, report)
+            issues_index.update(key, report)
+        except Exception as e:
+            logger.error(f"Error saving funding rates to HDF5: {e}")
+
+    async def update_futures_klines(self, symbol, interval, start_str="2019-09-01"):
+        """
+        增量更新合约K线：只重新获取问题索引中记录的缺口和异常K线，再从已保存的最后一根开始补上新数据
+
+        本地文件不存在时获取全部历史。
+        """
+        try:
+            filepath = self.klines_path(symbol, interval)
+            if not os.path.exists(filepath):
+                return await self.fetch_all_futures_klines(symbol, interval, start_str)
+            existing = pd.read_hdf(filepath, key='futures_klines')
+            end_ts = int(datetime.now().timestamp() * 1000)
+            ranges = issues_index.get_ranges(dataset_key('futures_klines', symbol, interval))
+            if len(existing):
+                # 上次保存的最后一根可能是当时尚未收盘的K线，从它开始重新获取，merge_repaired 用新数据覆盖
+                ranges.append((int(existing['timestamp'].max().value // 1_000_000), end_ts))
+            logger.info(f"Refetching {len(ranges)} ranges of {interval} futures klines for {symbol}")
+
+            fetched = []
+            for start_ts, range_end in ranges:
+                fetched.extend(await self._fetch_klines_range(symbol, interval, start_ts, range_end))
+            if fetched:
+                self.save_klines_to_hdf5(merge_repaired(existing, self.klines_to_frame(fetched), 'timestamp'),
+                                         symbol, interval)
+            return fetched
+
+        except BinanceAPIException as e:
+            logger.error(f"Binance API error: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return []
+
+    async def update_funding_rates(self, symbol, start_str="2019-09-01"):
+        """
+        增量更新资金费率：只重新获取问题索引中记录的缺口，再补上最后一次结算之后的记录
+
+        本地文件不存在，或是旧格式的 4H 重采样填充数据（缺口无法识别，不能与原始记录合并）时，重新获取全部原始记录。
+        """
+        try:
+            filepath = self.funding_path(symbol)
+            if not os.path.exists(filepath):
+                return await self.fetch_all_funding_rates(symbol, start_str)
+            existing = pd.read_hdf(filepath, key='funding_rates')
+            if is_resampled_funding(existing):
+                logger.warning(f"{filepath} is resampled funding data, refetching the full raw history")
+                return await self.fetch_all_funding_rates(symbol, start_str)
+            if 'fundingTime' not in existing:
+                existing = existing.rename_axis('fundingTime').reset_index()
+            end_ts = int(datetime.now().timestamp() * 1000)
+            ranges = issues_index.get_ranges(dataset_key('funding_rates', symbol))
+            if len(existing):
+                ranges.append((int(existing['fundingTime'].max().value // 1_000_000) + 1, end_ts))
+            logger.info(f"Refetching {len(ranges)} ranges of funding rates for {symbol}")
+
+            fetched = []
+            for start_ts, range_end in ranges:
+                fetched.extend(await self._fetch_funding_range(symbol, start_ts, range_end))
+            if fetched:
+                self.save_funding_rates_to_hdf5(merge_repaired(existing, self.funding_to_frame(fetched), 'fundingTime'),
+                                                symbol)
+            return fetched
+
         except BinanceAPIException as e:
             logger.error(f"Binance API error: {e}")
             return []
@@ -179,15 +302,15 @@ async def main():
         symbol = 'BTCUSDT'
         interval = '4h'
         
-        # 获取K线数据
-        await futures_data.fetch_all_futures_klines(
+        # 获取K线数据（本地已有数据时只补缺口和新数据）
+        await futures_data.update_futures_klines(
             symbol=symbol, 
             interval=interval,
             start_str="2019-09-01"
         )
         
-        # 获取所有资金费率数据
-        await futures_data.fetch_all_funding_rates(
+        # 获取资金费率数据
+        await futures_data.update_funding_rates(
             symbol=symbol,
             start_str="2019-09-01"
         )
@@ -0,0 +1,498 @@
+"""
+行情数据质量检查
+
+对 kline_data / futures_data / tick_data 中保存的 K 线、资金费率和逐笔成交做向量化检查：
+时间戳缺口、重复、乱序、OHLC 不一致、非有限值，以及逐笔成交 ID 的连续性。
+
+检查结果写入一个紧凑的问题索引（JSON）：每个数据集只保存各类问题的计数和需要重新下载的闭区间
+（K 线和资金费率为毫秒时间戳，逐笔成交为成交 ID），相邻区间合并。各个回补脚本读取索引后只重新获取这些区间。
+重复和乱序可以在本地修复（去重、排序，逐笔成交见 compact_trades），只计数，不进入待下载区间。
+"""
+import json
+import logging
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 问题索引文件
+ISSUES_FILE = os.getenv('DATA_QUALITY_ISSUES_FILE', os.path.join(project_root, 'data', 'data_quality_issues.json'))
+# 逐笔成交每次读取的行数
+TICK_CHUNK_SIZE = 1_000_000
+# 资金费率的结算间隔，以及 fundingTime 允许的抖动（接口返回的时间带有毫秒级偏差）
+FUNDING_INTERVAL = '8h'
+FUNDING_TOLERANCE = '1min'
+
+def dataset_key(kind, symbol, interval=None):
+    """问题索引中的数据集名，例如 klines:BTCUSDT:4h、funding_rates:BTCUSDT、trades:BTCUSDT"""
+    return f"{kind}:{symbol}:{interval}" if interval else f"{kind}:{symbol}"
+
+def interval_ms(interval):
+    """K 线间隔（'4h'、'1d' 等）对应的毫秒数"""
+    return pd.Timedelta(interval).value // 1_000_000
+
+def to_ms(values):
+    """datetime 或毫秒时间戳转换为 int64 毫秒数组"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return np.asarray(values).astype('datetime64[ms]').view(np.int64)
+    return pd.to_numeric(pd.Series(values), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+
+def merge_ranges(starts, ends, step=1):
+    """
+    合并重叠或相邻（间隔不超过 step）的闭区间
+
+    Returns:
+        tuple: 按起点排序的 (starts, ends) 数组
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+    running_end = np.maximum.accumulate(ends)
+    new_group = np.concatenate([[True], starts[1:] > running_end[:-1] + step])
+    group_starts = np.flatnonzero(new_group)
+    return starts[group_starts], np.maximum.reduceat(ends, group_starts)
+
+def _ranges_to_list(starts, ends):
+    return [[int(start), int(end)] for start, end in zip(starts, ends)]
+
+def _numeric(df, column):
+    if column not in df:
+        return None
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+
+def _time_order(times):
+    """
+    乱序行数、排序后的时间和相邻差值
+
+    Returns:
+        tuple: (乱序行数, 排序后的时间, 相邻差值)
+    """
+    out_of_order = int(np.count_nonzero(times[1:] < times[:-1]))
+    sorted_times = np.sort(times, kind='stable') if out_of_order else times
+    return out_of_order, sorted_times, np.diff(sorted_times)
+
+def check_klines(df, interval):
+    """
+    检查一组 K 线
+
+    Args:
+        df (DataFrame): 含 timestamp 列（或时间索引）和 open/high/low/close/volume 列
+        interval (str): K 线间隔
+
+    Returns:
+        dict: rows、start、end（毫秒）、duplicates、out_of_order、gaps（缺口数）、missing（缺失的 K 线数）、
+              invalid（OHLC 不一致、非正或非有限的行数）、ranges（需要重新下载的 [起始, 结束] 开盘时间）
+    """
+    times = to_ms(df['timestamp'] if 'timestamp' in df else df.index)
+    step = interval_ms(interval)
+    report = {'rows': len(times), 'start': None, 'end': None, 'duplicates': 0, 'out_of_order': 0,
+              'gaps': 0, 'missing': 0, 'invalid': 0, 'ranges': []}
+    if len(times) == 0:
+        return report
+
+    out_of_order, sorted_times, diffs = _time_order(times)
+    gap_positions = np.flatnonzero(diffs > step)
+    missing_starts = sorted_times[gap_positions] + step
+    missing_ends = sorted_times[gap_positions + 1] - step
+
+    open_, high, low, close = (_numeric(df, column) for column in ('open', 'high', 'low', 'close'))
+    prices = np.vstack([open_, high, low, close])
+    invalid = ~np.isfinite(prices).all(axis=0) | (prices <= 0).any(axis=0)
+    with np.errstate(invalid='ignore'):
+        invalid |= (high < np.maximum(open_, close)) | (low > np.minimum(open_, close))
+        volume = _numeric(df, 'volume')
+        if volume is not None:
+            invalid |= ~np.isfinite(volume) | (volume < 0)
+    bad_times = times[invalid]
+
+    starts, ends = merge_ranges(np.concatenate([missing_starts, bad_times]),
+                                np.concatenate([missing_ends, bad_times]), step)
+    report.update({
+        'start': int(sorted_times[0]),
+        'end': int(sorted_times[-1]),
+        'duplicates': int(np.count_nonzero(diffs == 0)),
+        'out_of_order': out_of_order,
+        'gaps': len(gap_positions),
+        'missing': int((diffs[gap_positions] // step - 1).sum()),
+        'invalid': int(np.count_nonzero(invalid)),
+        'ranges': _ranges_to_list(starts, ends)
+    })
+    return report
+
+def _funding_times(df):
+    return to_ms(df['fundingTime'] if 'fundingTime' in df else df.index)
+
+def is_resampled_funding(df, interval=FUNDING_INTERVAL, tolerance=FUNDING_TOLERANCE):
+    """记录间隔的中位数小于结算间隔，说明是旧格式的重采样填充数据（缺口已被掩盖）"""
+    times = np.sort(_funding_times(df))
+    return len(times) > 1 and np.median(np.diff(times)) < interval_ms(interval) - interval_ms(tolerance)
+
+def check_funding_rates(df, interval=FUNDING_INTERVAL, tolerance=FUNDING_TOLERANCE):
+    """
+    检查资金费率记录
+
+    Args:
+        df (DataFrame): 含 fundingTime 列（或时间索引）和 fundingRate 列
+        interval (str): 结算间隔
+        tolerance (str): 判断缺口和重复时允许的时间偏差
+
+    Returns:
+        dict: 字段同 check_klines；ranges 为两次有效记录之间需要重新下载的时间区间
+    """
+    times = _funding_times(df)
+    step = interval_ms(interval)
+    slack = interval_ms(tolerance)
+    report = {'rows': len(times), 'start': None, 'end': None, 'duplicates': 0, 'out_of_order': 0,
+              'gaps': 0, 'missing': 0, 'invalid': 0, 'ranges': []}
+    if len(times) == 0:
+        return report
+
+    out_of_order, sorted_times, diffs = _time_order(times)
+    if is_resampled_funding(df, interval, tolerance):
+        logger.warning("资金费率记录的间隔小于结算间隔，数据可能经过重采样填充，缺口无法检测，建议重新下载原始记录")
+    gap_positions = np.flatnonzero(diffs > step + slack)
+
+    rates = _numeric(df, 'fundingRate')
+    invalid = ~np.isfinite(rates)
+    bad_times = times[invalid]
+
+    starts, ends = merge_ranges(np.concatenate([sorted_times[gap_positions] + 1, bad_times]),
+                                np.concatenate([sorted_times[gap_positions + 1] - 1, bad_times]), step)
+    report.update({
+        'start': int(sorted_times[0]),
+        'end': int(sorted_times[-1]),
+        'duplicates': int(np.count_nonzero(diffs <= slack)),
+        'out_of_order': out_of_order,
+        'gaps': len(gap_positions),
+        'missing': int(np.round(diffs[gap_positions] / step).astype(np.int64).sum() - len(gap_positions)),
+        'invalid': int(np.count_nonzero(invalid)),
+        'ranges': _ranges_to_list(starts, ends)
+    })
+    return report
+
+def _valid_trades(chunk):
+    price = _numeric(chunk, 'price')
+    qty = _numeric(chunk, 'qty')
+    return np.isfinite(price) & np.isfinite(qty) & (price > 0) & (qty > 0)
+
+def check_trades(file_path, key='trades', chunk_size=TICK_CHUNK_SIZE):
+    """
+    分块检查 HDF5 中的逐笔成交
+
+    成交 ID 是交易所按成交顺序分配的连续整数。每块内把 ID 排序后压缩成连续段，与之前各块的已覆盖区间合并，
+    内存占用只与区间（即缺口）数量有关；ID 缺口和价格/数量无效的成交作为待下载区间。
+
+    Returns:
+        dict: rows、start、end（成交 ID）、duplicates（重复的 ID 数）、out_of_order（存储顺序中 ID 变小的次数）、
+              gaps、missing（缺失的 ID 数）、invalid、ranges（需要重新下载的 [起始 ID, 结束 ID]）
+    """
+    from strategies.analyze_tick_data import iter_tick_chunks
+
+    covered_starts = np.empty(0, dtype=np.int64)
+    covered_ends = np.empty(0, dtype=np.int64)
+    rows = duplicates = out_of_order = 0
+    bad_ids = []
+    last_id = None
+    for chunk in iter_tick_chunks(file_path, chunk_size=chunk_size, key=key, columns=['id', 'price', 'qty']):
+        ids = chunk['id'].to_numpy(dtype=np.int64)
+        if len(ids) == 0:
+            continue
+        rows += len(ids)
+        out_of_order += int(np.count_nonzero(ids[1:] < ids[:-1]))
+        if last_id is not None and ids[0] < last_id:
+            out_of_order += 1
+        last_id = ids[-1]
+
+        invalid = ~_valid_trades(chunk)
+        if invalid.any():
+            bad_ids.append(ids[invalid])
+
+        unique_ids = np.unique(ids)
+        duplicates += len(ids) - len(unique_ids)
+        breaks = np.flatnonzero(np.diff(unique_ids) > 1)
+        run_starts = unique_ids[np.concatenate([[0], breaks + 1])]
+        run_ends = unique_ids[np.concatenate([breaks, [len(unique_ids) - 1]])]
+
+        # 与之前各块重叠的 ID 数 = 两部分长度之和 - 合并后的长度
+        before = (covered_ends - covered_starts + 1).sum() + len(unique_ids)
+        covered_starts, covered_ends = merge_ranges(np.concatenate([covered_starts, run_starts]),
+                                                    np.concatenate([covered_ends, run_ends]))
+        duplicates += int(before - (covered_ends - covered_starts + 1).sum())
+
+    report = {'rows': rows, 'start': None, 'end': None, 'duplicates': duplicates, 'out_of_order': out_of_order,
+              'gaps': 0, 'missing': 0, 'invalid': 0, 'ranges': []}
+    if len(covered_starts) == 0:
+        return report
+
+    missing_starts = covered_ends[:-1] + 1
+    missing_ends = covered_starts[1:] - 1
+    bad_ids = np.unique(np.concatenate(bad_ids)) if bad_ids else np.empty(0, dtype=np.int64)
+    if len(bad_ids):
+        # 修复后的成交是追加保存的，同一 ID 另有有效记录时不再算作问题（只在存在无效行时多读一遍）
+        repaired = []
+        for chunk in iter_tick_chunks(file_path, chunk_size=chunk_size, key=key, columns=['id', 'price', 'qty']):
+            ids = chunk['id'].to_numpy(dtype=np.int64)
+            repaired.append(ids[_valid_trades(chunk) & np.isin(ids, bad_ids)])
+        bad_ids = np.setdiff1d(bad_ids, np.concatenate(repaired))
+    starts, ends = merge_ranges(np.concatenate([missing_starts, bad_ids]), np.concatenate([missing_ends, bad_ids]))
+    report.update({
+        'start': int(covered_starts[0]),
+        'end': int(covered_ends[-1]),
+        'gaps': len(missing_starts),
+        'missing': int((missing_ends - missing_starts + 1).sum()),
+        'invalid': len(bad_ids),
+        'ranges': _ranges_to_list(starts, ends)
+    })
+    return report
+
+def merge_repaired(existing, fetched, column):
+    """把重新下载的数据并入已有数据：按 column 去重（保留新数据）并排序"""
+    merged = pd.concat([existing, fetched], ignore_index=True)
+    merged = merged.drop_duplicates(subset=column, keep='last')
+    return merged.sort_values(column).reset_index(drop=True)
+
+def _late_rows(ids, running_max):
+    """存储顺序中 ID 不大于之前最大 ID 的行（追加保存的补数据、乱序批次和重复）"""
+    prefix_max = np.maximum(np.maximum.accumulate(ids), running_max)
+    previous = np.concatenate([[running_max], prefix_max[:-1]])
+    return ids <= previous, max(running_max, int(prefix_max[-1]))
+
+def compact_trades(file_path, key='trades', chunk_size=TICK_CHUNK_SIZE):
+    """
+    把逐笔成交文件按成交 ID 排序并去重（同一 ID 保留最后保存的一行），写入临时文件后替换原文件
+
+    repair_trades 补下载的成交追加在文件末尾，乱序的批次也会打乱存储顺序。第一遍找出存储顺序中
+    ID 不大于之前最大 ID 的行（通常只有补下载的部分）放在内存中排序；第二遍把其余已经有序的行
+    按块与这些行归并写出，内存占用只与乱序行的数量有关。
+
+    Returns:
+        int: 被移动或去除的行数，文件已经有序时为 0（不重写）
+    """
+    from strategies.analyze_tick_data import iter_tick_chunks
+
+    late_parts = []
+    lengths = {}
+    rows = 0
+    running_max = np.iinfo(np.int64).min
+    for chunk in iter_tick_chunks(file_path, chunk_size=chunk_size, key=key):
+        if len(chunk) == 0:
+            continue
+        rows += len(chunk)
+        late, running_max = _late_rows(chunk['id'].to_numpy(dtype=np.int64), running_max)
+        if late.any():
+            late_parts.append(chunk[late])
+        # 字符串列按最长值设置列宽，避免后续块写入时超出第一块确定的宽度
+        for column in chunk.columns:
+            if chunk[column].dtype == object:
+                lengths[column] = max(lengths.get(column, 0), int(chunk[column].astype(str).str.len().max()))
+    if not late_parts:
+        return 0
+
+    late = pd.concat(late_parts)
+    moved = len(late)
+    late = late.sort_values('id', kind='mergesort').drop_duplicates(subset='id', keep='last')
+    late_ids = late['id'].to_numpy(dtype=np.int64)
+
+    tmp_path = f"{file_path}.compact"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    running_max = np.iinfo(np.int64).min
+    position = 0
+    written = 0
+    for chunk in iter_tick_chunks(file_path, chunk_size=chunk_size, key=key):
+        if len(chunk) == 0:
+            continue
+        in_order, running_max = _late_rows(chunk['id'].to_numpy(dtype=np.int64), running_max)
+        main = chunk[~in_order]
+        # 归并 ID 不超过本块最大 ID 的乱序行；同一 ID 以后保存的（乱序行）为准
+        end = int(np.searchsorted(late_ids, running_max, side='right'))
+        merged = late.iloc[position:end]
+        main = main[~np.isin(main['id'].to_numpy(dtype=np.int64), late_ids[position:end])]
+        position = end
+        out = pd.concat([main, merged]).sort_values('id', kind='mergesort')
+        written += len(out)
+        if len(out):
+            out.to_hdf(tmp_path, key=key, mode='a', format='table', append=True,
+                       index=False, min_itemsize=lengths or None)
+    written += len(late) - position
+    if position < len(late):
+        late.iloc[position:].to_hdf(tmp_path, key=key, mode='a', format='table', append=True,
+                                    index=False, min_itemsize=lengths or None)
+    os.replace(tmp_path, file_path)
+    logger.info(f"Compacted {file_path}: {moved} out-of-order rows merged, "
+                f"{rows - written} duplicate rows removed")
+    return moved
+
+def log_report(name, report):
+    """输出检查结果摘要"""
+    problems = {field: report[field] for field in ('duplicates', 'out_of_order', 'gaps', 'missing', 'invalid')
+                if report[field]}
+    if not problems:
+        logger.info(f"{name}: {report['rows']} rows, no issues")
+        return
+    logger.warning(f"{name}: {report['rows']} rows, "
+                   + ", ".join(f"{field}={count}" for field, count in problems.items())
+                   + f", {len(report['ranges'])} ranges to refetch")
+
+class IssuesIndex:
+    """
+    数据质量问题索引
+
+    JSON 文件，按数据集保存最近一次检查的时间、各类问题的计数和待下载区间，首次访问时加载。
+    """
+
+    def __init__(self, path=ISSUES_FILE):
+        self.path = path
+        self._data = None
+
+    def _entries(self):
+        if self._data is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+            except FileNotFoundError:
+                self._data = {}
+            except Exception as e:
+                logger.error(f"Error loading data quality index {self.path}: {e}")
+                self._data = {}
+        return self._data
+
+    def save(self):
+        """先写临时文件再替换，中断时不会留下损坏的索引"""
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries(), f, separators=(',', ':'), sort_keys=True)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving data quality index {self.path}: {e}")
+
+    def update(self, key, report):
+        """记录一次检查的结果（覆盖该数据集之前的记录）"""
+        entry = {field: value for field, value in report.items() if field != 'ranges'}
+        entry['checked_at'] = datetime.now().isoformat(timespec='seconds')
+        entry['ranges'] = report['ranges']
+        self._entries()[key] = entry
+        self.save()
+
+    def get(self, key):
+        return self._entries().get(key)
+
+    def get_ranges(self, key):
+        """待下载区间 [(start, end), ...]"""
+        entry = self._entries().get(key)
+        return [tuple(item) for item in entry['ranges']] if entry else []
+
+    def resolve(self, key, start, end):
+        """从数据集的待下载区间中移除已修复的 [start, end]"""
+        entry = self._entries().get(key)
+        if not entry:
+            return
+        remaining = []
+        for range_start, range_end in entry['ranges']:
+            if range_end < start or range_start > end:
+                remaining.append([range_start, range_end])
+                continue
+            if range_start < start:
+                remaining.append([range_start, start - 1])
+            if range_end > end:
+                remaining.append([end + 1, range_end])
+        entry['ranges'] = remaining
+        self.save()
+
+    def keys(self):
+        return list(self._entries())
+
+issues_index = IssuesIndex()
+
+def validate_klines_file(filepath, symbol, interval, key='klines', kind='klines'):
+    """检查 K 线文件并更新问题索引，文件无法读取时返回 None"""
+    try:
+        df = pd.read_hdf(filepath, key=key)
+    except Exception as e:
+        logger.error(f"Error reading {filepath}: {e}")
+        return None
+    report = check_klines(df, interval)
+    name = dataset_key(kind, symbol, interval)
+    log_report(name, report)
+    issues_index.update(name, report)
+    return report
+
+def validate_funding_file(filepath, symbol, key='funding_rates'):
+    """检查资金费率文件并更新问题索引，文件无法读取时返回 None"""
+    try:
+        df = pd.read_hdf(filepath, key=key)
+    except Exception as e:
+        logger.error(f"Error reading {filepath}: {e}")
+        return None
+    report = check_funding_rates(df)
+    name = dataset_key('funding_rates', symbol)
+    log_report(name, report)
+    issues_index.update(name, report)
+    return report
+
+def validate_trades_file(filepath, symbol, key='trades', chunk_size=TICK_CHUNK_SIZE):
+    """检查逐笔成交文件并更新问题索引，文件无法读取时返回 None"""
+    try:
+        report = check_trades(filepath, key=key, chunk_size=chunk_size)
+    except Exception as e:
+        logger.error(f"Error reading {filepath}: {e}")
+        return None
+    name = dataset_key('trades', symbol)
+    log_report(name, report)
+    issues_index.update(name, report)
+    return report
+
+def validate_all(root=project_root):
+    """
+    检查 kline_data、futures_data 和 tick_data 下的全部数据文件
+
+    文件名沿用各回补脚本的格式：{symbol}_{interval}_klines.h5、{symbol}_{interval}_futures.h5、
+    {symbol}_funding_rates.h5、{symbol}_all_tick_data.h5
+    """
+    reports = {}
+    patterns = [
+        ('kline_data', '_klines.h5', 'klines', 'klines'),
+        ('futures_data', '_futures.h5', 'futures_klines', 'futures_klines'),
+    ]
+    for folder, suffix, key, kind in patterns:
+        path = os.path.join(root, folder)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            if name.endswith(suffix) and name.count('_') >= 2:
+                symbol, interval = name[:-len(suffix)].rsplit('_', 1)
+                reports[dataset_key(kind, symbol, interval)] = validate_klines_file(
+                    os.path.join(path, name), symbol, interval, key=key, kind=kind)
+
+    futures_folder = os.path.join(root, 'futures_data')
+    if os.path.isdir(futures_folder):
+        for name in sorted(os.listdir(futures_folder)):
+            if name.endswith('_funding_rates.h5'):
+                symbol = name[:-len('_funding_rates.h5')]
+                reports[dataset_key('funding_rates', symbol)] = validate_funding_file(
+                    os.path.join(futures_folder, name), symbol)
+
+    tick_folder = os.path.join(root, 'tick_data')
+    if os.path.isdir(tick_folder):
+        for name in sorted(os.listdir(tick_folder)):
+            if name.endswith('_all_tick_data.h5'):
+                symbol = name[:-len('_all_tick_data.h5')]
+                reports[dataset_key('trades', symbol)] = validate_trades_file(
+                    os.path.join(tick_folder, name), symbol)
+    return reports
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    validate_all()
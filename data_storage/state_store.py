@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_USERS = 10000
+DEFAULT_TTL = 30 * 60           # 未完成的下单流程保留30分钟
+DEFAULT_FLUSH_INTERVAL = 1.0    # 后写入间隔（秒）
+
+class MemoryStateStore:
+    """
+    用户会话状态存储（内存 LRU + TTL）
+
+    每个用户对应一个小字典（state、order_type、symbol 等）。
+    超过 ttl 秒未更新的状态视为已放弃的流程并被丢弃，用户数超过 max_users 时淘汰最久未访问的。
+    所有修改都必须通过 update/clear，以便持久化实现记录变更。
+    get/update 是协程：内存中的状态直接返回，持久化实现只有缓存未命中时才在线程中读取数据库。
+    """
+
+    def __init__(self, max_users=DEFAULT_MAX_USERS, ttl=DEFAULT_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (data, updated_at)，data 为 None 表示已清除
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get(self, user_id):
+        """返回用户状态的副本，不存在或已过期时返回空字典"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            loaded = await self._load(user_id)
+            # 加载期间可能已有新的修改或清除，以缓存为准
+            entry = self._entries.get(user_id, loaded)
+            if entry is None:
+                return {}
+            self._entries[user_id] = entry
+        data, updated_at = entry
+        if data is None:
+            return {}
+        if time.monotonic() - updated_at > self.ttl:
+            self._remove(user_id)
+            return {}
+        self._entries.move_to_end(user_id)
+        return dict(data)
+
+    async def update(self, user_id, **fields):
+        """合并字段到用户状态"""
+        data = await self.get(user_id)
+        data.update(fields)
+        self._entries[user_id] = (data, time.monotonic())
+        self._entries.move_to_end(user_id)
+        self._mark_dirty(user_id)
+        while len(self._entries) > self.max_users:
+            evicted = next(iter(self._entries))
+            self._on_evict(evicted)
+            self._entries.popitem(last=False)
+
+    def clear(self, user_id):
+        """清除用户的全部状态"""
+        self._remove(user_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, user_id):
+        self._entries.pop(user_id, None)
+        self._mark_deleted(user_id)
+
+    # 以下钩子由持久化实现覆盖
+    async def _load(self, user_id):
+        return None
+
+    def _mark_dirty(self, user_id):
+        pass
+
+    def _mark_deleted(self, user_id):
+        pass
+
+    def _on_evict(self, user_id):
+        pass
+
+class SQLiteStateStore(MemoryStateStore):
+    """
+    SQLite 持久化的用户状态存储
+
+    读取走内存缓存；修改先记在内存中，由后台任务按 flush_interval 批量写入数据库（后写入），
+    重启后可从数据库文件恢复状态。事件循环上不执行 SQLite 操作：缓存未命中时的读取和批量写入都在线程中进行。
+
+    clear 在缓存中留下删除标记，删除写入数据库之前不会再读到旧的记录；被淘汰但尚未写入的状态
+    保留在 _evicted 中，由后台任务写入。
+
+    已缓存的状态不会再从数据库重新读取，只支持单个进程使用一个数据库文件（重启恢复），
+    不支持多个进程共享状态。
+    """
+
+    def __init__(self, path, max_users=DEFAULT_MAX_USERS, ttl=DEFAULT_TTL,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(max_users=max_users, ttl=ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._dirty = set()
+        self._deleted = set()
+        self._evicted = {}    # 已从缓存淘汰、尚未写入数据库的状态
+        self._inflight = {}   # 正在写入数据库的状态（删除为 (None, ...)）
+        self._epoch = 0       # 每次写入完成加一，用于发现读取期间完成的写入
+        self._flush_task = None
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS user_state ('
+            'user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    async def start(self):
+        """删除过期状态并启动后台写入任务"""
+        await asyncio.to_thread(self._purge_expired)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """停止后台任务并写入剩余的修改"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        with self._lock:
+            self._conn.close()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing user state: {str(e)}")
+
+    async def flush(self):
+        """把积累的修改一次性写入数据库"""
+        if not (self._dirty or self._deleted):
+            return
+        # 快照在事件循环线程中生成，工作线程只执行 SQLite 写入，不访问 _dirty / _entries
+        rows, deleted = self._snapshot()
+        written = False
+        try:
+            await asyncio.to_thread(self._write, rows, deleted)
+            written = True
+        finally:
+            self._finish(deleted, written)
+
+    def _snapshot(self):
+        """取出修改标记并序列化对应的状态，返回 (待写入的行, 删除的用户)"""
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted, set()
+        # 把单调时钟换算为墙上时间，便于重启后判断过期
+        offset = time.time() - time.monotonic()
+        rows = []
+        inflight = {}
+        for user_id in dirty:
+            entry = self._entries.get(user_id) or self._evicted.get(user_id)
+            self._evicted.pop(user_id, None)
+            if entry is not None and entry[0] is not None:
+                data, updated_at = entry
+                rows.append((user_id, json.dumps(data), updated_at + offset))
+                inflight[user_id] = entry
+        for user_id in deleted:
+            self._evicted.pop(user_id, None)
+            inflight[user_id] = (None, time.monotonic())
+        self._inflight = inflight
+        return rows, deleted
+
+    def _finish(self, deleted, written):
+        """写入结束后在事件循环线程中更新标记"""
+        inflight, self._inflight = self._inflight, {}
+        if written:
+            self._epoch += 1
+            # 删除已写入数据库，缓存中的删除标记不再需要
+            for user_id in deleted:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] is None:
+                    del self._entries[user_id]
+            return
+        # 写入失败时恢复修改标记，下次重试（期间又有新修改的以新标记为准）
+        for user_id, entry in inflight.items():
+            if user_id in self._dirty or user_id in self._deleted:
+                continue
+            if entry[0] is None:
+                self._deleted.add(user_id)
+            else:
+                self._dirty.add(user_id)
+            if user_id not in self._entries:
+                self._evicted[user_id] = entry
+
+    def _write(self, rows, deleted):
+        with self._lock, self._conn:
+            if rows:
+                self._conn.executemany('REPLACE INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?)', rows)
+            if deleted:
+                self._conn.executemany('DELETE FROM user_state WHERE user_id = ?', [(user_id,) for user_id in deleted])
+
+    def _purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM user_state WHERE updated_at < ?', (time.time() - self.ttl,))
+
+    def _read(self, user_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT data, updated_at FROM user_state WHERE user_id = ?', (user_id,)
+            ).fetchone()
+
+    def _pending(self, user_id):
+        """尚未写入或正在写入数据库的状态，比数据库中的记录新"""
+        return self._evicted.get(user_id) or self._inflight.get(user_id)
+
+    async def _load(self, user_id):
+        while True:
+            entry = self._pending(user_id)
+            if entry is not None:
+                return entry
+            epoch = self._epoch
+            row = await asyncio.to_thread(self._read, user_id)
+            entry = self._pending(user_id)
+            if entry is not None:
+                return entry
+            # 读取期间有写入完成时重新读取，避免拿到已被覆盖或删除的记录
+            if self._epoch == epoch:
+                break
+        if row is None:
+            return None
+        data, updated_at = row
+        return json.loads(data), updated_at - (time.time() - time.monotonic())
+
+    def _mark_dirty(self, user_id):
+        self._deleted.discard(user_id)
+        self._dirty.add(user_id)
+
+    def _mark_deleted(self, user_id):
+        self._dirty.discard(user_id)
+        self._deleted.add(user_id)
+        # 删除写入数据库之前保留删除标记，get 不会再读到数据库中的旧记录
+        self._entries[user_id] = (None, time.monotonic())
+
+    def _on_evict(self, user_id):
+        # 被淘汰的状态仍保留在数据库中，下次访问时重新加载；尚未写入的交给后台任务写入
+        if user_id in self._dirty or user_id in self._deleted:
+            self._evicted[user_id] = self._entries[user_id]
+
+def create_state_store():
+    """根据环境变量创建状态存储：STATE_STORE=memory（默认）或 sqlite"""
+    backend = os.getenv('STATE_STORE', 'memory')
+    ttl = int(os.getenv('STATE_TTL', DEFAULT_TTL))
+    if backend == 'sqlite':
+        path = os.getenv('STATE_DB_PATH', os.path.join('data', 'bot_state.db'))
+        return SQLiteStateStore(path, ttl=ttl)
+    return MemoryStateStore(ttl=ttl)
@@ -0,0 +1,290 @@
+import asyncio
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEDGER_PATH = os.path.join('data', 'trade_history.db')
+DEFAULT_FLUSH_INTERVAL = 1.0    # 后写入间隔（秒）
+
+INSERT_ORDER_EVENTS = (
+    'INSERT OR IGNORE INTO order_events (symbol, order_id, client_order_id, side, type, status, '
+    'price, orig_qty, executed_qty, quote_qty, time, update_time, source) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+INSERT_FILLS = (
+    'INSERT OR IGNORE INTO fills (symbol, trade_id, order_id, side, price, qty, quote_qty, '
+    'commission, commission_asset, time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL,
+    order_id INTEGER NOT NULL,
+    client_order_id TEXT,
+    side TEXT,
+    type TEXT,
+    status TEXT,
+    price REAL,
+    orig_qty REAL,
+    executed_qty REAL,
+    quote_qty REAL,
+    time INTEGER NOT NULL,
+    update_time INTEGER NOT NULL,
+    source TEXT,
+    UNIQUE (symbol, order_id, status, executed_qty, update_time)
+);
+CREATE INDEX IF NOT EXISTS idx_order_events_symbol_time ON order_events (symbol, time);
+CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (symbol, order_id);
+
+CREATE TABLE IF NOT EXISTS fills (
+    symbol TEXT NOT NULL,
+    trade_id INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    side TEXT NOT NULL,
+    price REAL NOT NULL,
+    qty REAL NOT NULL,
+    quote_qty REAL NOT NULL,
+    commission REAL NOT NULL,
+    commission_asset TEXT,
+    time INTEGER NOT NULL,
+    PRIMARY KEY (symbol, trade_id)
+);
+CREATE INDEX IF NOT EXISTS idx_fills_symbol_time ON fills (symbol, time);
+CREATE INDEX IF NOT EXISTS idx_fills_order ON fills (symbol, order_id);
+"""
+
+class TradeLedger:
+    """
+    本地订单与成交账本（只追加）
+
+    订单的每个状态变化记录为一条 order_events，成交记录在 fills 中，按交易对、时间和 orderId 建索引。
+    重复写入同一事件/成交会被忽略，因此可以放心地把每次从交易所获取的数据整批写入。
+
+    record_* 只把行放进内存队列：在事件循环中调用时由后台任务按 flush_interval 批量写入（在线程中执行），
+    下单和用户数据流回调不等待 SQLite 提交；没有事件循环时（脚本）直接写入。查询前先写入队列中的行。
+    """
+
+    def __init__(self, path=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path or os.getenv('TRADE_LEDGER_PATH', DEFAULT_LEDGER_PATH)
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending_events = []
+        self._pending_fills = []
+        self._flush_task = None
+        # 进程退出时写入队列中剩余的行
+        atexit.register(self.flush)
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def close(self):
+        """停止后台任务，写入剩余的行并关闭数据库"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await asyncio.to_thread(self.flush)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _enqueue(self, event_rows, fill_rows):
+        with self._pending_lock:
+            self._pending_events.extend(event_rows)
+            self._pending_fills.extend(fill_rows)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中，直接写入
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending_events or self._pending_fills:
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    logger.error(f"Error writing trade ledger: {str(e)}")
+
+    def flush(self):
+        """把队列中的行一次性写入数据库（可在任意线程中调用），失败时放回队列"""
+        with self._pending_lock:
+            event_rows, self._pending_events = self._pending_events, []
+            fill_rows, self._pending_fills = self._pending_fills, []
+        if not event_rows and not fill_rows:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    if event_rows:
+                        conn.executemany(INSERT_ORDER_EVENTS, event_rows)
+                    if fill_rows:
+                        conn.executemany(INSERT_FILLS, fill_rows)
+        except Exception:
+            with self._pending_lock:
+                self._pending_events[:0] = event_rows
+                self._pending_fills[:0] = fill_rows
+            raise
+
+    def record_orders(self, orders, source=None):
+        """批量记录订单（下单响应或 allOrders/openOrders 返回的订单），包括下单响应中的成交明细"""
+        event_rows = []
+        fill_rows = []
+        for order in orders:
+            order_time = order.get('time') or order.get('transactTime')
+            update_time = order.get('updateTime') or order.get('transactTime') or order_time
+            event_rows.append((
+                order['symbol'], order['orderId'], order.get('clientOrderId'),
+                order.get('side'), order.get('type'), order.get('status'),
+                float(order.get('price') or 0), float(order.get('origQty') or 0),
+                float(order.get('executedQty') or 0), float(order.get('cummulativeQuoteQty') or 0),
+                order_time, update_time, source
+            ))
+            for fill in order.get('fills') or []:
+                price = float(fill['price'])
+                qty = float(fill['qty'])
+                fill_rows.append((
+                    order['symbol'], fill['tradeId'], order['orderId'], order.get('side'),
+                    price, qty, price * qty,
+                    float(fill.get('commission') or 0), fill.get('commissionAsset'), order_time
+                ))
+
+        self._enqueue(event_rows, fill_rows)
+        return len(event_rows)
+
+    def record_fills(self, fills):
+        """
+        批量记录成交
+
+        Args:
+            fills (list): 字典列表，字段为 symbol, trade_id, order_id, side, price, qty, commission, commission_asset, time
+        """
+        rows = [(
+            fill['symbol'], fill['trade_id'], fill['order_id'], fill['side'],
+            float(fill['price']), float(fill['qty']), float(fill['price']) * float(fill['qty']),
+            float(fill.get('commission') or 0), fill.get('commission_asset'), fill['time']
+        ) for fill in fills]
+        self._enqueue([], rows)
+        return len(rows)
+
+    def _query(self, sql, params):
+        self.flush()
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _filters(symbol, start_time, end_time):
+        clauses, params = [], []
+        if symbol:
+            clauses.append('symbol = ?')
+            params.append(symbol)
+        if start_time is not None:
+            clauses.append('time >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            clauses.append('time <= ?')
+            params.append(end_time)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def get_order_history(self, symbol=None, start_time=None, end_time=None, limit=None):
+        """
+        返回每个订单的最新状态，字段与 Binance 订单接口一致，最新的订单在前
+
+        Args:
+            symbol (str): 交易对，为空时返回所有交易对
+            start_time, end_time (int): 毫秒时间戳范围
+            limit (int): 最多返回的订单数
+        """
+        where, params = self._filters(symbol, start_time, end_time)
+        sql = (
+            'SELECT symbol, order_id, client_order_id, side, type, status, price, orig_qty, executed_qty, '
+            'quote_qty, time, MAX(update_time) AS update_time FROM order_events' + where +
+            ' GROUP BY symbol, order_id ORDER BY time DESC'
+        )
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [{
+            'symbol': row['symbol'],
+            'orderId': row['order_id'],
+            'clientOrderId': row['client_order_id'],
+            'side': row['side'],
+            'type': row['type'],
+            'status': row['status'],
+            'price': row['price'],
+            'origQty': row['orig_qty'],
+            'executedQty': row['executed_qty'],
+            'cummulativeQuoteQty': row['quote_qty'],
+            'time': row['time'],
+            'updateTime': row['update_time']
+        } for row in self._query(sql, params)]
+
+    def get_fees(self, symbol=None, start_time=None, end_time=None):
+        """按手续费资产汇总手续费"""
+        where, params = self._filters(symbol, start_time, end_time)
+        rows = self._query(
+            'SELECT commission_asset, SUM(commission) AS total FROM fills' + where + ' GROUP BY commission_asset',
+            params
+        )
+        return {row['commission_asset']: row['total'] for row in rows}
+
+    def get_pnl(self, symbol=None, start_time=None, end_time=None, prices=None):
+        """
+        按平均成本法计算每个交易对的持仓和盈亏
+
+        Args:
+            prices (dict): 可选的最新价格 {symbol: price}，用于计算未实现盈亏
+
+        Returns:
+            dict: {symbol: {'position', 'avg_cost', 'realized_pnl', 'unrealized_pnl', 'volume'}}
+        """
+        where, params = self._filters(symbol, start_time, end_time)
+        rows = self._query(
+            'SELECT symbol, side, price, qty, quote_qty FROM fills' + where + ' ORDER BY time, trade_id',
+            params
+        )
+        result = defaultdict(lambda: {'position': 0.0, 'avg_cost': 0.0, 'realized_pnl': 0.0,
+                                      'unrealized_pnl': 0.0, 'volume': 0.0})
+        for row in rows:
+            stats = result[row['symbol']]
+            qty = row['qty']
+            stats['volume'] += row['quote_qty']
+            if row['side'] == 'BUY':
+                new_position = stats['position'] + qty
+                stats['avg_cost'] = (stats['avg_cost'] * stats['position'] + row['price'] * qty) / new_position
+                stats['position'] = new_position
+            else:
+                closed = min(qty, stats['position'])
+                stats['realized_pnl'] += (row['price'] - stats['avg_cost']) * closed
+                stats['position'] -= closed
+                if stats['position'] <= 0:
+                    stats['position'] = 0.0
+                    stats['avg_cost'] = 0.0
+
+        for sym, stats in result.items():
+            if prices and sym in prices and stats['position'] > 0:
+                stats['unrealized_pnl'] = (prices[sym] - stats['avg_cost']) * stats['position']
+        return dict(result)
+
+trade_ledger = TradeLedger()
@@ -1,13 +1,12 @@
 import os
 import sys
 import logging
-from telegram_bot import run_bot
+from utils.logging_setup import setup_logging
 
 # 设置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
+
+from telegram_bot import run_bot
 
 logger = logging.getLogger(__name__)
 
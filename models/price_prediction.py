@@ -16,17 +16,15 @@ root_dir = os.path.dirname(current_dir)
 sys.path.insert(0, root_dir)
 
 import config
-from binance.client import Client
 from dotenv import load_dotenv
 import asyncio
 from binance import AsyncClient
+from binance_api.client_manager import client_manager
+from binance_api.ticker_book import ticker_book
 
 # 加载环境变量
 load_dotenv()
 
-# 初始化Binance客户端
-client = Client(os.getenv('BINANCE_API_KEY'), os.getenv('BINANCE_SECRET_KEY'))
-
 def load_parameters():
     params_df = pd.read_json(config.PARAMS_FILE, encoding='utf-8')
     return params_df.set_index('parameter')['value'].to_dict()
@@ -38,9 +36,13 @@ def predict_price(days_since_start):
     return config.X_M / (1 + (config.X_M/X0 - 1) * np.exp(-r * days_since_start))
 
 async def get_current_price():
-    client = await AsyncClient.create()
+    # 优先读取 websocket 行情表
+    price = ticker_book.get_price("BTCUSDT")
+    if price is not None:
+        return price
+
+    client = await client_manager.get_client()
     ticker = await client.get_symbol_ticker(symbol="BTCUSDT")
-    await client.close_connection()
     return float(ticker['price'])
 
 async def calculate_ahr999():
@@ -53,7 +55,7 @@ async def calculate_ahr999():
     print(f"当前价格: {current_price}")
     
     # 获取历史价格数据
-    df = get_historical_prices()
+    df = await get_historical_prices()
     print(f"历史数据形状: {df.shape}")
     
     last_fit_date = datetime.strptime(params['last_fit_date'], '%Y-%m-%d')
@@ -76,18 +78,25 @@ async def calculate_ahr999():
     
     return ahr999, datetime.now()
 
-def get_historical_prices():
+async def get_historical_prices():
     end_time = datetime.now()
     start_time = end_time - timedelta(days=200)
-    klines = client.get_historical_klines("BTCUSDT", Client.KLINE_INTERVAL_1DAY, start_time.strftime("%d %b %Y %H:%M:%S"), end_time.strftime("%d %b %Y %H:%M:%S"))
+    client = await client_manager.get_client()
+    klines = await client.get_historical_klines("BTCUSDT", AsyncClient.KLINE_INTERVAL_1DAY, start_time.strftime("%d %b %Y %H:%M:%S"), end_time.strftime("%d %b %Y %H:%M:%S"))
     df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_asset_volume', 'number_of_trades', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'])
     df['close'] = df['close'].astype(float)
     df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
     df.set_index('timestamp', inplace=True)
     return df
 
+async def run_once():
+    try:
+        return await calculate_ahr999()
+    finally:
+        await client_manager.close()
+
 if __name__ == "__main__":
-    ahr999, timestamp = asyncio.run(calculate_ahr999())
+    ahr999, timestamp = asyncio.run(run_once())
     print(f"AHR999: {ahr999:.4f}")
     print(f"Timestamp: {timestamp}")
 
@@ -0,0 +1,85 @@
+"""
+头寸规模计算
+
+所有函数既接受标量也接受 numpy 数组（按元素广播），回测逐 bar 调用和整段向量化计算共用同一实现。
+波动率/止损距离为 0 或无效时返回 0，不会抛出除零错误。
+"""
+import numpy as np
+
+def _result(value):
+    """标量输入返回 float，数组输入返回数组"""
+    return float(value) if np.ndim(value) == 0 else value
+
+def _safe_divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = numerator / denominator
+    return np.where(np.isfinite(result) & (denominator > 0), result, 0.0)
+
+def round_to_lot(size, lot_size=None, mode='nearest'):
+    """
+    按最小交易单位取整
+
+    Args:
+        size: 头寸数量（标量或数组）
+        lot_size (float): 最小交易单位，为空时不取整
+        mode (str): 'nearest' 四舍五入，'down' 向零取整（不超过风险预算）
+    """
+    if not lot_size:
+        return _result(np.asarray(size, dtype=float))
+    units = np.asarray(size, dtype=float) / lot_size
+    units = np.trunc(units) if mode == 'down' else np.round(units)
+    return _result(units * lot_size)
+
+def fixed_fractional_size(equity, price, fraction, lot_size=None):
+    """固定比例：把权益的 fraction 投入到该资产"""
+    return round_to_lot(_safe_divide(np.asarray(equity, dtype=float) * fraction, price), lot_size, mode='down')
+
+def atr_unit_size(equity, atr, risk_ratio, atr_multiple=1.0, allocation=1.0, lot_size=None,
+                  price=None, fallback_stop_pct=None):
+    """
+    海龟 N 单位：每单位在 atr_multiple 个 ATR 的波动下损失权益的 risk_ratio
+
+    Args:
+        equity: 账户权益
+        atr: ATR（N）
+        risk_ratio (float): 每单位承担的权益比例
+        atr_multiple (float): 止损距离对应的 ATR 倍数
+        allocation (float): 分配给该系统的资金比例
+        lot_size (float): 最小交易单位，四舍五入
+        price: 当前价格，仅在 fallback_stop_pct 生效时使用
+        fallback_stop_pct (float): ATR 为 0 时改用价格的该比例作为止损距离
+    """
+    risk_amount = np.asarray(equity, dtype=float) * allocation * risk_ratio
+    stop_distance = np.asarray(atr, dtype=float) * atr_multiple
+    if fallback_stop_pct is not None and price is not None:
+        stop_distance = np.where(stop_distance == 0, np.asarray(price, dtype=float) * fallback_stop_pct, stop_distance)
+    return round_to_lot(_safe_divide(risk_amount, stop_distance), lot_size)
+
+def volatility_target_size(equity, price, volatility, target_volatility, max_leverage=1.0, lot_size=None):
+    """
+    波动率目标：使持仓的年化波动率约为 target_volatility
+
+    Args:
+        volatility: 资产的年化波动率（与 target_volatility 同一口径）
+        max_leverage (float): 持仓市值占权益比例的上限
+    """
+    weight = np.minimum(_safe_divide(target_volatility, volatility), max_leverage)
+    return round_to_lot(_safe_divide(np.asarray(equity, dtype=float) * weight, price), lot_size, mode='down')
+
+def kelly_fraction(win_rate, win_loss_ratio, multiplier=0.5, cap=0.25):
+    """
+    截断 Kelly 比例
+
+    f* = W - (1 - W) / R，乘以 multiplier（半 Kelly 等）后限制在 [0, cap]
+    """
+    win_rate = np.asarray(win_rate, dtype=float)
+    full_kelly = win_rate - _safe_divide(1 - win_rate, win_loss_ratio)
+    full_kelly = np.where(np.asarray(win_loss_ratio, dtype=float) > 0, full_kelly, 0.0)
+    return _result(np.clip(full_kelly * multiplier, 0.0, cap))
+
+def kelly_size(equity, price, win_rate, win_loss_ratio, multiplier=0.5, cap=0.25, lot_size=None):
+    """按截断 Kelly 比例投入权益"""
+    fraction = kelly_fraction(win_rate, win_loss_ratio, multiplier, cap)
+    return round_to_lot(_safe_divide(np.asarray(equity, dtype=float) * fraction, price), lot_size, mode='down')
@@ -0,0 +1,283 @@
+import logging
+import asyncio
+import os
+import time
+from binance_api.ticker_book import ticker_book
+from binance_api.user_stream import user_stream
+from data_storage.trade_history import trade_ledger
+
+logger = logging.getLogger(__name__)
+
+QUOTE_ASSET = 'USDT'
+
+# 风险限制（可用环境变量覆盖）
+MAX_SYMBOL_EXPOSURE = float(os.getenv('RISK_MAX_SYMBOL_EXPOSURE', 5000))       # 单个交易对最大持仓市值（USDT）
+MAX_SYMBOL_LOSS_PCT = float(os.getenv('RISK_MAX_SYMBOL_LOSS_PCT', 0.10))       # 单个交易对未实现亏损占成本的比例
+MAX_PORTFOLIO_DRAWDOWN = float(os.getenv('RISK_MAX_PORTFOLIO_DRAWDOWN', 0.10)) # 组合权益回撤比例
+MIN_HEDGE_RATIO = float(os.getenv('RISK_MIN_HEDGE_RATIO', 0.5))                # 有对冲腿时的最低对冲比例
+# 同一条告警的最短间隔（秒）
+ALERT_COOLDOWN = int(os.getenv('RISK_ALERT_COOLDOWN', 900))
+
+class SymbolRisk:
+    """单个交易对的持仓和风险状态"""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.qty = 0.0             # 现货持仓
+        self.futures_qty = 0.0     # 合约对冲腿（空头为负）
+        self.avg_cost = 0.0
+        self.realized_pnl = 0.0
+        self.price = None
+        self.peak_pnl = 0.0
+        self.updated = None
+
+    @property
+    def exposure(self):
+        """净敞口市值（现货加合约）"""
+        return (self.qty + self.futures_qty) * self.price if self.price else 0.0
+
+    @property
+    def unrealized_pnl(self):
+        return (self.price - self.avg_cost) * self.qty if self.price and self.qty else 0.0
+
+    @property
+    def hedge_ratio(self):
+        if not self.qty:
+            return None
+        return -self.futures_qty / self.qty if self.futures_qty else 0.0
+
+    @property
+    def drawdown(self):
+        """总盈亏相对其峰值的回撤（USDT）"""
+        return self.peak_pnl - (self.realized_pnl + self.unrealized_pnl)
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'qty': self.qty,
+            'futures_qty': self.futures_qty,
+            'price': self.price,
+            'avg_cost': self.avg_cost,
+            'exposure': self.exposure,
+            'hedge_ratio': self.hedge_ratio,
+            'unrealized_pnl': self.unrealized_pnl,
+            'realized_pnl': self.realized_pnl,
+            'drawdown': self.drawdown
+        }
+
+class RiskMonitor:
+    """
+    实时风险监控
+
+    由行情表的价格回调和用户数据流的成交/余额回调驱动，每个事件只更新受影响的交易对
+    和组合权益的增量，是 O(1) 的本地计算。超过限制时通过 on_alert 发送告警，同一告警有冷却时间。
+    """
+
+    def __init__(self, max_symbol_exposure=MAX_SYMBOL_EXPOSURE, max_symbol_loss_pct=MAX_SYMBOL_LOSS_PCT,
+                 max_portfolio_drawdown=MAX_PORTFOLIO_DRAWDOWN, min_hedge_ratio=MIN_HEDGE_RATIO,
+                 alert_cooldown=ALERT_COOLDOWN):
+        self.symbols = {}
+        self._by_asset = {}
+        self.on_alert = None
+        self.max_symbol_exposure = max_symbol_exposure
+        self.max_symbol_loss_pct = max_symbol_loss_pct
+        self.max_portfolio_drawdown = max_portfolio_drawdown
+        self.min_hedge_ratio = min_hedge_ratio
+        self.alert_cooldown = alert_cooldown
+        self.cash = 0.0
+        self.equity = 0.0
+        self.peak_equity = 0.0
+        self._last_alert = {}
+        self._running = False
+        self._subscribed = False
+
+    async def start(self, symbols, on_alert=None):
+        """
+        开始监控：订阅行情表和用户数据流的回调，用账本初始化成本
+
+        on_alert(message) 为协程函数。应在 user_stream.start 之前调用，
+        这样连接后的余额快照也会经过 on_balances。
+        """
+        self.symbols = {symbol.upper(): SymbolRisk(symbol.upper()) for symbol in symbols}
+        self._by_asset = {symbol[:-len(QUOTE_ASSET)]: symbol for symbol in self.symbols if symbol.endswith(QUOTE_ASSET)}
+        self.on_alert = on_alert
+        self.cash = self.equity = self.peak_equity = 0.0
+        self._last_alert = {}
+        try:
+            self.seed_costs(trade_ledger.get_pnl())
+        except Exception as e:
+            logger.error(f"Error loading cost basis from trade ledger: {str(e)}")
+        # 用户数据流已经就绪时直接用当前余额初始化
+        if user_stream.ready:
+            self.on_balances(user_stream.balances)
+        if not self._subscribed:
+            ticker_book.add_price_listener(self.on_price)
+            user_stream.add_balance_listener(self.on_balances)
+            user_stream.add_fill_listener(self.on_fill)
+            self._subscribed = True
+        self._running = True
+        logger.info(f"Risk monitor started for {len(self.symbols)} symbols")
+
+    async def stop(self):
+        """停止处理事件（回调仍保留注册，但直接返回）"""
+        self._running = False
+        self.on_alert = None
+
+    def seed_costs(self, pnl_by_symbol):
+        """用账本的平均成本和已实现盈亏初始化（trade_ledger.get_pnl() 的结果）"""
+        for symbol, stats in pnl_by_symbol.items():
+            risk = self.symbols.get(symbol)
+            if risk is not None:
+                risk.avg_cost = stats['avg_cost']
+                risk.realized_pnl = stats['realized_pnl']
+                risk.peak_pnl = max(risk.peak_pnl, risk.realized_pnl)
+
+    @property
+    def drawdown(self):
+        """组合权益相对峰值的回撤比例"""
+        return (self.peak_equity - self.equity) / self.peak_equity if self.peak_equity > 0 else 0.0
+
+    # ---- 事件入口 ----
+
+    def on_price(self, symbol, price):
+        """行情表价格回调"""
+        risk = self.symbols.get(symbol)
+        if not self._running or risk is None or price == risk.price:
+            return
+        old_price = risk.price
+        risk.price = price
+        risk.updated = time.monotonic()
+        if old_price is not None:
+            self._add_equity((risk.qty + risk.futures_qty) * (price - old_price))
+        else:
+            self._add_equity(risk.qty * price)
+            if not risk.avg_cost and risk.qty:
+                # 没有成本记录的存量持仓以首个价格为成本
+                risk.avg_cost = price
+        self._check_symbol(risk)
+
+    def on_balances(self, balances):
+        """用户数据流余额回调，balances 为 {asset: {'free', 'locked'}}（只包含变化的资产）"""
+        if not self._running:
+            return
+        # 同一事件里 USDT 和币的变化一起计入权益，避免成交的中间状态被当成回撤
+        delta = 0.0
+        changed = []
+        for asset, balance in balances.items():
+            total = balance['free'] + balance['locked']
+            if asset == QUOTE_ASSET:
+                delta += total - self.cash
+                self.cash = total
+                continue
+            symbol = self._by_asset.get(asset)
+            if symbol is None:
+                continue
+            risk = self.symbols[symbol]
+            if risk.price is not None:
+                delta += (total - risk.qty) * risk.price
+            risk.qty = total
+            changed.append(risk)
+        self._add_equity(delta)
+        for risk in changed:
+            self._check_symbol(risk)
+
+    async def on_fill(self, fill):
+        """用户数据流成交回调：按平均成本法更新成本和已实现盈亏（数量以余额事件为准）"""
+        risk = self.symbols.get(fill['symbol'])
+        if not self._running or risk is None:
+            return
+        qty, price = fill['qty'], fill['price']
+        if fill['side'] == 'BUY':
+            position = max(risk.qty, 0.0)
+            new_position = position + qty
+            risk.avg_cost = (risk.avg_cost * position + price * qty) / new_position if new_position else price
+        else:
+            risk.realized_pnl += (price - risk.avg_cost) * min(qty, max(risk.qty, 0.0))
+        self._check_symbol(risk)
+
+    def set_futures_position(self, symbol, qty):
+        """
+        更新合约对冲腿的持仓（空头为负数）
+
+        现货用户数据流不包含合约持仓，由合约账户的调用方同步；开仓本身不改变权益，
+        之后的价格变动按现货加合约的净数量计入权益。
+        """
+        risk = self.symbols.get(symbol)
+        if risk is None:
+            return
+        risk.futures_qty = qty
+        self._check_symbol(risk)
+
+    # ---- 查询 ----
+
+    def get_symbol_risk(self, symbol):
+        risk = self.symbols.get(symbol)
+        return risk.to_dict() if risk is not None else None
+
+    def get_portfolio(self):
+        return {
+            'equity': self.equity,
+            'cash': self.cash,
+            'peak_equity': self.peak_equity,
+            'drawdown': self.drawdown,
+            'net_exposure': sum(risk.exposure for risk in self.symbols.values()),
+            'unrealized_pnl': sum(risk.unrealized_pnl for risk in self.symbols.values())
+        }
+
+    # ---- 内部 ----
+
+    def _add_equity(self, delta):
+        if not delta:
+            return
+        self.equity += delta
+        if self.equity > self.peak_equity:
+            self.peak_equity = self.equity
+        elif self.drawdown > self.max_portfolio_drawdown:
+            self._alert('portfolio_drawdown',
+                        f"Portfolio drawdown {self.drawdown:.1%} exceeds {self.max_portfolio_drawdown:.0%} "
+                        f"(equity {self.equity:,.2f} USDT, peak {self.peak_equity:,.2f})")
+
+    def _check_symbol(self, risk):
+        if risk.price is None:
+            return
+        pnl = risk.realized_pnl + risk.unrealized_pnl
+        if pnl > risk.peak_pnl:
+            risk.peak_pnl = pnl
+
+        exposure = abs(risk.exposure)
+        if exposure > self.max_symbol_exposure:
+            self._alert(f'exposure_{risk.symbol}',
+                        f"{risk.symbol} exposure {exposure:,.2f} USDT exceeds {self.max_symbol_exposure:,.0f} USDT")
+
+        cost = risk.avg_cost * risk.qty
+        if cost > 0 and -risk.unrealized_pnl / cost > self.max_symbol_loss_pct:
+            self._alert(f'loss_{risk.symbol}',
+                        f"{risk.symbol} unrealized loss {risk.unrealized_pnl:,.2f} USDT "
+                        f"({-risk.unrealized_pnl / cost:.1%} of cost) exceeds {self.max_symbol_loss_pct:.0%}")
+
+        hedge_ratio = risk.hedge_ratio
+        if risk.futures_qty and hedge_ratio is not None and hedge_ratio < self.min_hedge_ratio:
+            self._alert(f'hedge_{risk.symbol}',
+                        f"{risk.symbol} hedge ratio {hedge_ratio:.2f} is below {self.min_hedge_ratio:.2f}")
+
+    def _alert(self, key, message):
+        now = time.monotonic()
+        last = self._last_alert.get(key)
+        if last is not None and now - last < self.alert_cooldown:
+            return
+        self._last_alert[key] = now
+        logger.warning(f"Risk alert: {message}")
+        if self.on_alert is not None:
+            try:
+                asyncio.get_running_loop().create_task(self._send_alert(message))
+            except RuntimeError:
+                # 不在事件循环中（例如离线计算），只记录日志
+                pass
+
+    async def _send_alert(self, message):
+        try:
+            await self.on_alert(message)
+        except Exception as e:
+            logger.error(f"Error sending risk alert: {str(e)}")
+
+risk_monitor = RiskMonitor()
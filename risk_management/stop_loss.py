@@ -0,0 +1,173 @@
+"""
+止损计算
+
+向量化函数用于回测，对整段价格序列一次算出止损线；StopBook 用于实盘/逐 bar 监控，
+每个持仓单位的止损以数组保存，每个价格只做一次向量化比较，上千个单位也能在一次 tick 内评估完。
+side 为 1 表示多头，-1 表示空头。
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+LONG = 1
+SHORT = -1
+
+def _result(value):
+    return float(value) if np.ndim(value) == 0 else value
+
+def fixed_stop(entry_price, stop_pct, side=LONG):
+    """固定比例止损：入场价下方（空头为上方）stop_pct"""
+    entry_price = np.asarray(entry_price, dtype=float)
+    return _result(entry_price * (1 - np.asarray(side) * stop_pct))
+
+def atr_stop(entry_price, atr, multiple=2.0, side=LONG):
+    """ATR 止损：入场价下方（空头为上方）multiple 个 ATR，海龟默认 2N"""
+    entry_price = np.asarray(entry_price, dtype=float)
+    return _result(entry_price - np.asarray(side) * multiple * np.asarray(atr, dtype=float))
+
+def trailing_stop(close, distance, side=LONG):
+    """
+    跟踪止损：止损线只朝有利方向移动
+
+    Args:
+        close (array): 入场后的收盘价序列
+        distance: 止损距离（标量或与 close 等长的数组，例如 multiple * ATR）
+    """
+    close = np.asarray(close, dtype=float)
+    if side == LONG:
+        return np.maximum.accumulate(close - distance)
+    return np.minimum.accumulate(close + distance)
+
+def trailing_pct_stop(close, stop_pct, side=LONG):
+    """按比例的跟踪止损"""
+    close = np.asarray(close, dtype=float)
+    return trailing_stop(close, close * stop_pct, side)
+
+def _rolling(values, period, func):
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if len(values) >= period:
+        result[period - 1:] = func(sliding_window_view(values, period), axis=1)
+    return result
+
+def chandelier_stop(high, low, atr, period=22, multiple=3.0, side=LONG):
+    """吊灯止损：多头为 period 内最高价减 multiple 个 ATR，空头为最低价加 multiple 个 ATR，前 period-1 个值为 NaN"""
+    atr = np.asarray(atr, dtype=float)
+    if side == LONG:
+        return _rolling(high, period, np.max) - multiple * atr
+    return _rolling(low, period, np.min) + multiple * atr
+
+def first_stop_hit(prices, stops, side=LONG):
+    """
+    返回价格第一次触及止损的位置，没有触及时返回 -1
+
+    Args:
+        prices (array): 用于判断的价格（多头传最低价或收盘价，空头传最高价或收盘价）
+        stops: 止损线（标量或等长数组）
+    """
+    prices = np.asarray(prices, dtype=float)
+    hit = prices <= stops if side == LONG else prices >= stops
+    return int(np.argmax(hit)) if hit.any() else -1
+
+class StopBook:
+    """
+    流式止损簿
+
+    每个持仓单位（例如 ('sys1', 3)）占一个槽位，止损价、方向和跟踪距离保存在数组中。
+    添加、删除、修改都是 O(1)；update(price) 对全部单位做一次向量化比较，返回被触发的单位。
+    """
+
+    def __init__(self, capacity=64):
+        self._stops = np.zeros(capacity)
+        self._sides = np.zeros(capacity, dtype=np.int8)
+        self._trails = np.zeros(capacity)
+        self._active = np.zeros(capacity, dtype=bool)
+        self._keys = [None] * capacity
+        self._slots = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def keys(self):
+        return list(self._slots)
+
+    def add(self, key, side, stop, trail_distance=0.0):
+        """
+        添加一个持仓单位的止损
+
+        Args:
+            key: 单位标识（可哈希）
+            side (int): LONG 或 SHORT
+            stop (float): 初始止损价
+            trail_distance (float): 大于 0 时为跟踪止损，止损价随价格按该距离移动
+        """
+        if key in self._slots:
+            self.remove(key)
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self._stops[slot] = stop
+        self._sides[slot] = side
+        self._trails[slot] = trail_distance
+        self._active[slot] = True
+        self._keys[slot] = key
+        self._slots[key] = slot
+
+    def remove(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._active[slot] = False
+            self._keys[slot] = None
+            self._free.append(slot)
+
+    def clear(self, predicate=None):
+        """删除全部单位，或 predicate(key) 为真的单位"""
+        for key in list(self._slots):
+            if predicate is None or predicate(key):
+                self.remove(key)
+
+    def get_stop(self, key):
+        slot = self._slots.get(key)
+        return float(self._stops[slot]) if slot is not None else None
+
+    def set_stop(self, key, stop):
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._stops[slot] = stop
+
+    def update(self, price):
+        """
+        用最新价格推进跟踪止损并检查触发
+
+        Returns:
+            list: 被触发的单位 key（已从止损簿中删除）
+        """
+        if not self._slots:
+            return []
+        sides = self._sides
+        trailing = self._active & (self._trails > 0)
+        if trailing.any():
+            candidate = price - sides * self._trails
+            # 多头止损只上移，空头止损只下移
+            moved = np.where(sides > 0, np.maximum(self._stops, candidate), np.minimum(self._stops, candidate))
+            self._stops = np.where(trailing, moved, self._stops)
+
+        hit = self._active & (((sides > 0) & (price <= self._stops)) | ((sides < 0) & (price >= self._stops)))
+        if not hit.any():
+            return []
+        keys = [self._keys[slot] for slot in np.flatnonzero(hit)]
+        for key in keys:
+            self.remove(key)
+        return keys
+
+    def _grow(self):
+        capacity = len(self._stops)
+        self._stops = np.concatenate([self._stops, np.zeros(capacity)])
+        self._sides = np.concatenate([self._sides, np.zeros(capacity, dtype=np.int8)])
+        self._trails = np.concatenate([self._trails, np.zeros(capacity)])
+        self._active = np.concatenate([self._active, np.zeros(capacity, dtype=bool)])
+        self._keys.extend([None] * capacity)
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
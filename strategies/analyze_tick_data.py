@@ -1,6 +1,8 @@
 import pandas as pd
+import numpy as np
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # 设置日志
@@ -10,39 +12,229 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 每次从 HDF5 读取的行数，决定单个进程的内存上限
+CHUNK_SIZE = 1_000_000
+# 时间聚合的粒度（VWAP、主动买卖量按这个粒度汇总）
+BAR_INTERVAL = '1min'
+# 滚动 VWAP 的窗口
+VWAP_WINDOW = '1h'
+# 成交量分布的价格档位宽度（USDT）
+PRICE_BUCKET = 10.0
+# 单笔成交量直方图的分档（对数等距，超出范围的计入两端）
+SIZE_EDGES = np.logspace(-6, 3, 37)
+
+def tick_row_count(file_path, key='trades'):
+    """HDF5 table 格式的总行数（只读元数据）"""
+    with pd.HDFStore(file_path, mode='r') as store:
+        return store.get_storer(key).nrows
+
+def iter_tick_chunks(file_path, start=0, stop=None, chunk_size=CHUNK_SIZE, key='trades', columns=None):
+    """按行区间分块读取 HDF5 中的成交数据，每块为一个 DataFrame"""
+    if stop is None:
+        stop = tick_row_count(file_path, key)
+    for chunk_start in range(start, stop, chunk_size):
+        yield pd.read_hdf(file_path, key=key, start=chunk_start, stop=min(chunk_start + chunk_size, stop), columns=columns)
+
+def prepare_ticks(df):
+    """
+    把一块成交数据转换为数值数组
+
+    历史成交接口返回的 price/qty/quoteQty 是字符串，这里统一转换为 float；
+    time 为 datetime 或毫秒时间戳，统一为纳秒整数。无效行被剔除。
+
+    Returns:
+        dict: time（int64 纳秒）、price、qty、quote、buyer_maker（bool）数组
+    """
+    price = pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype=float)
+    qty = pd.to_numeric(df['qty'], errors='coerce').to_numpy(dtype=float)
+    if 'quoteQty' in df:
+        quote = pd.to_numeric(df['quoteQty'], errors='coerce').to_numpy(dtype=float)
+        quote = np.where(np.isfinite(quote), quote, price * qty)
+    else:
+        quote = price * qty
+
+    times = df['time']
+    if pd.api.types.is_datetime64_any_dtype(times):
+        time_ns = times.to_numpy().astype('datetime64[ns]').view(np.int64)
+    else:
+        time_ns = pd.to_numeric(times, errors='coerce').to_numpy(dtype=float) * 1_000_000
+        time_ns = np.where(np.isfinite(time_ns), time_ns, -1).astype(np.int64)
+
+    maker = df['isBuyerMaker']
+    if maker.dtype == object:
+        maker = maker.astype(str).str.lower() == 'true'
+    buyer_maker = maker.to_numpy(dtype=bool)
+
+    valid = np.isfinite(price) & np.isfinite(qty) & (price > 0) & (qty > 0) & (time_ns >= 0)
+    return {
+        'time': time_ns[valid],
+        'price': price[valid],
+        'qty': qty[valid],
+        'quote': quote[valid],
+        'buyer_maker': buyer_maker[valid]
+    }
+
+def _group_sums(keys, *weights):
+    """按整数键求和，返回 (唯一键, 每个权重的和...)"""
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return (unique_keys,) + tuple(np.bincount(inverse, weights=w, minlength=len(unique_keys)) for w in weights)
+
+def _aggregate_ticks(ticks, bar_ns, price_bucket, size_edges):
+    """单块成交的可合并汇总"""
+    qty = ticks['qty']
+    # isBuyerMaker 为真表示买方挂单、卖方主动成交
+    taker_buy_qty = np.where(ticks['buyer_maker'], 0.0, qty)
+    bar_keys, bar_qty, bar_quote, bar_buy, bar_trades = _group_sums(
+        ticks['time'] // bar_ns, qty, ticks['quote'], taker_buy_qty, np.ones(len(qty))
+    )
+    price_keys, price_qty, price_buy = _group_sums(
+        np.floor(ticks['price'] / price_bucket).astype(np.int64), qty, taker_buy_qty
+    )
+    size_hist, _ = np.histogram(np.clip(qty, size_edges[0], size_edges[-1]), size_edges)
+    return {
+        'rows': len(qty),
+        'start_time': ticks['time'].min() if len(qty) else None,
+        'end_time': ticks['time'].max() if len(qty) else None,
+        'bars': (bar_keys, bar_qty, bar_quote, bar_buy, bar_trades),
+        'profile': (price_keys, price_qty, price_buy),
+        'size_hist': size_hist
+    }
+
+def _merge_groups(groups):
+    """合并多组按键求和的结果：键拼接后只做一次分组求和"""
+    if len(groups) == 1:
+        return groups[0]
+    keys = np.concatenate([group[0] for group in groups])
+    return _group_sums(keys, *[np.concatenate(columns) for columns in zip(*[group[1:] for group in groups])])
+
+def _merge_aggregates(parts):
+    """
+    一次合并多个汇总结果
+
+    逐块两两合并时每块都要和全部已有的键一起重新分组，代价随块数平方增长；
+    这里收集全部部分结果后只分组一次，总代价与键的总数成正比（加一次排序）。
+    """
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    start_times = [part['start_time'] for part in parts if part['start_time'] is not None]
+    end_times = [part['end_time'] for part in parts if part['end_time'] is not None]
+    return {
+        'rows': sum(part['rows'] for part in parts),
+        'start_time': min(start_times) if start_times else None,
+        'end_time': max(end_times) if end_times else None,
+        'bars': _merge_groups([part['bars'] for part in parts]),
+        'profile': _merge_groups([part['profile'] for part in parts]),
+        'size_hist': np.sum([part['size_hist'] for part in parts], axis=0)
+    }
+
+def _analyze_rows(file_path, start, stop, chunk_size, bar_ns, price_bucket, size_edges):
+    """进程池任务：分块处理一段行区间，只保留各块的汇总结果，最后合并一次"""
+    return _merge_aggregates([
+        _aggregate_ticks(prepare_ticks(chunk), bar_ns, price_bucket, size_edges)
+        for chunk in iter_tick_chunks(file_path, start, stop, chunk_size)
+    ])
+
 class TickDataAnalyzer:
-    def __init__(self):
+    """
+    成交数据分析
+
+    按行区间把 HDF5 文件分给多个进程，每个进程分块读取并只保留可合并的汇总（按时间聚合的成交量/成交额/
+    主动买入量、按价格档位的成交量、单笔成交量直方图），内存占用与数据总量无关。
+    """
+
+    def __init__(self, file_path=None, chunk_size=CHUNK_SIZE, workers=None):
         self.data_folder = 'tick_data'
         self.file_name = 'BTCUSDT_all_tick_data.h5'
-        self.file_path = os.path.join(self.data_folder, self.file_name)
+        self.file_path = file_path or os.path.join(self.data_folder, self.file_name)
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count() or 1
+
+    def _aggregate(self, bar_interval, price_bucket, size_edges):
+        total_rows = tick_row_count(self.file_path)
+        bar_ns = pd.Timedelta(bar_interval).value
+        # 每个进程至少处理一整块，按块边界切分
+        n_chunks = max(1, -(-total_rows // self.chunk_size))
+        chunks_per_job = max(1, -(-n_chunks // self.workers))
+        ranges = [(start, min(start + chunks_per_job * self.chunk_size, total_rows))
+                  for start in range(0, total_rows, chunks_per_job * self.chunk_size)]
+        args = [(self.file_path, start, stop, self.chunk_size, bar_ns, price_bucket, size_edges) for start, stop in ranges]
+
+        if len(args) > 1:
+            with ProcessPoolExecutor(max_workers=len(args)) as executor:
+                partials = list(executor.map(_analyze_rows, *zip(*args)))
+        else:
+            partials = [_analyze_rows(*arg) for arg in args]
 
-    def analyze_data(self):
-        """分析HDF5文件中的交易数据"""
+        return total_rows, bar_ns, _merge_aggregates(partials)
+
+    def analyze_data(self, bar_interval=BAR_INTERVAL, vwap_window=VWAP_WINDOW, price_bucket=PRICE_BUCKET,
+                     size_edges=SIZE_EDGES):
+        """
+        分析HDF5文件中的交易数据
+
+        Returns:
+            dict: total_rows、start_time、end_time、time_span、vwap、buy_volume、sell_volume、imbalance，
+                  以及 bars（按 bar_interval 聚合的成交量、VWAP、滚动 VWAP、主动买卖量和不平衡度）、
+                  volume_profile（按价格档位的成交量和主动买卖量）、size_histogram（单笔成交量分布）
+        """
         try:
             logger.info(f"开始分析文件: {self.file_path}")
-            
-            # 读取HDF5文件
-            df = pd.read_hdf(self.file_path, key='trades')
-            
-            # 基本信息
-            total_rows = len(df)
-            start_time = df['time'].min()
-            end_time = df['time'].max()
-            time_span = end_time - start_time
-            
-            # 输出分析结果
-            logger.info("\n=== 数据分析报告 ===")
-            logger.info(f"总记录数: {total_rows:,} 条")
-            logger.info(f"数据时间范围: 从 {start_time} 到 {end_time}")
-            logger.info(f"总计时间跨度: {time_span}")
-            
-            return {
+
+            total_rows, bar_ns, result = self._aggregate(bar_interval, price_bucket, size_edges)
+            if result is None or result['rows'] == 0:
+                logger.warning("文件中没有有效的成交数据")
+                return None
+
+            bar_keys, bar_qty, bar_quote, bar_buy, bar_trades = result['bars']
+            bars = pd.DataFrame({
+                'trades': bar_trades.astype(np.int64),
+                'volume': bar_qty,
+                'quote_volume': bar_quote,
+                'buy_volume': bar_buy,
+                'sell_volume': bar_qty - bar_buy
+            }, index=pd.to_datetime(bar_keys * bar_ns))
+            bars['vwap'] = bars['quote_volume'] / bars['volume']
+            rolling = bars[['quote_volume', 'volume']].rolling(vwap_window).sum()
+            bars['rolling_vwap'] = rolling['quote_volume'] / rolling['volume']
+            bars['imbalance'] = (bars['buy_volume'] - bars['sell_volume']) / bars['volume']
+
+            price_keys, price_qty, price_buy = result['profile']
+            volume_profile = pd.DataFrame({
+                'volume': price_qty,
+                'buy_volume': price_buy,
+                'sell_volume': price_qty - price_buy
+            }, index=pd.Index(price_keys * price_bucket, name='price'))
+            size_histogram = pd.Series(
+                result['size_hist'],
+                index=pd.IntervalIndex.from_breaks(size_edges, closed='left'),
+                name='trades'
+            )
+
+            start_time = pd.Timestamp(result['start_time'])
+            end_time = pd.Timestamp(result['end_time'])
+            volume = bar_qty.sum()
+            buy_volume = bar_buy.sum()
+            sell_volume = volume - buy_volume
+            analysis = {
                 'total_rows': total_rows,
+                'valid_rows': result['rows'],
                 'start_time': start_time,
                 'end_time': end_time,
-                'time_span': time_span
+                'time_span': end_time - start_time,
+                'vwap': bar_quote.sum() / volume,
+                'buy_volume': buy_volume,
+                'sell_volume': sell_volume,
+                'imbalance': (buy_volume - sell_volume) / volume,
+                'bars': bars,
+                'volume_profile': volume_profile,
+                'size_histogram': size_histogram
             }
-            
+            self._log_report(analysis)
+            return analysis
+
         except FileNotFoundError:
             logger.error(f"文件未找到: {self.file_path}")
             return None
@@ -50,9 +242,28 @@ class TickDataAnalyzer:
             logger.error(f"分析过程中出错: {str(e)}")
             return None
 
+    def _log_report(self, analysis):
+        logger.info("\n=== 数据分析报告 ===")
+        logger.info(f"总记录数: {analysis['total_rows']:,} 条（有效 {analysis['valid_rows']:,} 条）")
+        logger.info(f"数据时间范围: 从 {analysis['start_time']} 到 {analysis['end_time']}")
+        logger.info(f"总计时间跨度: {analysis['time_span']}")
+        logger.info(f"成交量加权均价: {analysis['vwap']:.2f}")
+        logger.info(f"主动买入量: {analysis['buy_volume']:.4f}, 主动卖出量: {analysis['sell_volume']:.4f}, "
+                    f"不平衡度: {analysis['imbalance']:.2%}")
+
+        profile = analysis['volume_profile']
+        point_of_control = profile['volume'].idxmax()
+        logger.info(f"成交最密集的价格档位: {point_of_control:.2f}（{profile['volume'].max():.4f}）")
+
+        histogram = analysis['size_histogram']
+        histogram = histogram[histogram > 0]
+        logger.info("单笔成交量分布:")
+        for interval, count in histogram.items():
+            logger.info(f"  [{interval.left:.6g}, {interval.right:.6g}): {count:,}")
+
 if __name__ == "__main__":
     analyzer = TickDataAnalyzer()
     analysis_results = analyzer.analyze_data()
-    
+
     if analysis_results:
-        logger.info("\n分析完成!")
\ No newline at end of file
+        logger.info("\n分析完成!")
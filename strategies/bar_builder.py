@@ -0,0 +1,272 @@
+"""
+成交数据生成 K 线
+
+支持时间、笔数、成交量、成交额和主动买卖不平衡（tick imbalance）五种 bar。
+成交按块输入，每块内的归属计算和 OHLCV 汇总都是向量化的（cumsum / reduceat），
+未走完的最后一根 bar 作为状态带到下一块，所以同一个 BarBuilder 既可以离线处理整个 tick 库，
+也可以在实盘中逐批喂入成交、只取出已完成的 bar。输出的 DataFrame 可以直接作为 backtrader 的 PandasData。
+"""
+import logging
+import numpy as np
+import pandas as pd
+import backtrader as bt
+from strategies.analyze_tick_data import iter_tick_chunks, prepare_ticks, CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+BAR_KINDS = ('time', 'tick', 'volume', 'dollar', 'tick_imbalance')
+
+# 不平衡 bar 的默认参数：期望笔数和期望不平衡度的初值、期望笔数的上下限、EWMA 跨度（按 bar 数）、期望不平衡度的下限
+IMBALANCE_INITIAL_TICKS = 1000
+IMBALANCE_INITIAL_EXPECTED = 0.1
+IMBALANCE_MIN_TICKS = 100
+IMBALANCE_MAX_TICKS = 100_000
+IMBALANCE_EWMA_SPAN = 20
+IMBALANCE_MIN_EXPECTED = 0.05
+
+BAR_COLUMNS = ['open_time', 'close_time', 'open', 'high', 'low', 'close',
+               'volume', 'quote_volume', 'buy_volume', 'trades']
+
+def _aggregate(ticks, starts):
+    """按分组起点对成交做 OHLCV 汇总（分组内成交连续）"""
+    price = ticks['price']
+    qty = ticks['qty']
+    ends = np.concatenate([starts[1:], [len(price)]]) - 1
+    return {
+        'open_time': ticks['time'][starts],
+        'close_time': ticks['time'][ends],
+        'open': price[starts],
+        'high': np.maximum.reduceat(price, starts),
+        'low': np.minimum.reduceat(price, starts),
+        'close': price[ends],
+        'volume': np.add.reduceat(qty, starts),
+        'quote_volume': np.add.reduceat(ticks['quote'], starts),
+        # isBuyerMaker 为假表示买方主动成交
+        'buy_volume': np.add.reduceat(np.where(ticks['buyer_maker'], 0.0, qty), starts),
+        'trades': np.diff(np.concatenate([starts, [len(price)]]))
+    }
+
+class BarBuilder:
+    """
+    增量 bar 生成器
+
+    Args:
+        kind (str): 'time'、'tick'、'volume'、'dollar' 或 'tick_imbalance'
+        threshold: time 为时间间隔（如 '4h'），tick/volume/dollar 为每根 bar 的笔数/成交量/成交额，
+                   tick_imbalance 不使用
+        initial_ticks, initial_imbalance, min_ticks, max_ticks, ewma_span, min_expected_imbalance:
+                   不平衡 bar 的自适应阈值参数，阈值 = 期望笔数 × |期望主动方向|，两者都按已完成 bar 的 EWMA 更新
+
+    时间 bar 的索引为区间起点（与 Binance K 线一致），其他 bar 的索引为最后一笔成交的时间。
+    """
+
+    def __init__(self, kind='volume', threshold=None, initial_ticks=IMBALANCE_INITIAL_TICKS,
+                 initial_imbalance=IMBALANCE_INITIAL_EXPECTED, min_ticks=IMBALANCE_MIN_TICKS, max_ticks=IMBALANCE_MAX_TICKS, ewma_span=IMBALANCE_EWMA_SPAN,
+                 min_expected_imbalance=IMBALANCE_MIN_EXPECTED):
+        if kind not in BAR_KINDS:
+            raise ValueError(f"Unknown bar kind: {kind}")
+        if kind != 'tick_imbalance' and threshold is None:
+            raise ValueError(f"{kind} bars need a threshold")
+        self.kind = kind
+        self.interval_ns = pd.Timedelta(threshold).value if kind == 'time' else None
+        self.threshold = float(threshold) if kind in ('tick', 'volume', 'dollar') else None
+
+        # 跨块状态
+        self._partial = None       # 未完成的 bar（各字段为标量）及其 id
+        self._cumulative = 0.0     # tick/volume/dollar 的累计量
+        self._last_time = None
+        self._dropped = 0
+
+        # 不平衡 bar 状态
+        self._bar_index = 0
+        self._theta = 0            # 当前 bar 的主动方向累计
+        self._bar_ticks = 0        # 当前 bar 已有的笔数
+        self._expected_ticks = float(initial_ticks)
+        self._expected_imbalance = float(initial_imbalance)
+        self.min_ticks = min_ticks
+        self.max_ticks = max_ticks
+        self._alpha = 2.0 / (ewma_span + 1)
+        self.min_expected_imbalance = min_expected_imbalance
+
+    def update(self, ticks):
+        """
+        输入一批成交，返回其中已完成的 bar
+
+        Args:
+            ticks: prepare_ticks 的结果，或含 price/qty/time/isBuyerMaker 列的 DataFrame（实盘的成交推送）
+
+        Returns:
+            DataFrame: 已完成的 bar，没有时为空 DataFrame
+        """
+        if isinstance(ticks, pd.DataFrame):
+            ticks = prepare_ticks(ticks)
+        ticks = self._ordered(ticks)
+        if len(ticks['price']) == 0:
+            return self._to_frame(None)
+
+        ids, last_complete = self._assign_ids(ticks)
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(ids)) + 1])
+        bars = _aggregate(ticks, starts)
+        bars['id'] = ids[starts]
+
+        emitted = []
+        if self._partial is not None:
+            if bars['id'][0] == self._partial['id']:
+                # 第一组接在上一块未完成的 bar 后面
+                partial = self._partial
+                bars['open_time'][0] = partial['open_time']
+                bars['open'][0] = partial['open']
+                bars['high'][0] = max(bars['high'][0], partial['high'])
+                bars['low'][0] = min(bars['low'][0], partial['low'])
+                for key in ('volume', 'quote_volume', 'buy_volume', 'trades'):
+                    bars[key][0] += partial[key]
+            else:
+                emitted.append({key: np.asarray([value]) for key, value in self._partial.items()})
+            self._partial = None
+
+        if last_complete:
+            emitted.append(bars)
+        else:
+            emitted.append({key: values[:-1] for key, values in bars.items()})
+            self._partial = {key: values[-1] for key, values in bars.items()}
+
+        return self._to_frame({key: np.concatenate([part[key] for part in emitted]) for key in bars})
+
+    def flush(self):
+        """返回未完成的最后一根 bar（数据结束时调用）"""
+        if self._partial is None:
+            return self._to_frame(None)
+        bars = {key: np.asarray([value]) for key, value in self._partial.items()}
+        self._partial = None
+        return self._to_frame(bars)
+
+    def _ordered(self, ticks):
+        """块内按时间排序，丢弃早于已处理数据的成交"""
+        times = ticks['time']
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind='stable')
+            ticks = {key: values[order] for key, values in ticks.items()}
+            times = ticks['time']
+        if self._last_time is not None:
+            late = times < self._last_time
+            if late.any():
+                self._dropped += int(late.sum())
+                logger.warning(f"Dropped {int(late.sum())} out-of-order ticks ({self._dropped} in total)")
+                ticks = {key: values[~late] for key, values in ticks.items()}
+        if len(ticks['time']):
+            self._last_time = ticks['time'][-1]
+        return ticks
+
+    def _assign_ids(self, ticks):
+        """
+        每笔成交所属 bar 的 id（非递减）
+
+        Returns:
+            tuple: (ids, 最后一组是否已完成)
+        """
+        if self.kind == 'time':
+            return ticks['time'] // self.interval_ns, False
+        if self.kind == 'tick_imbalance':
+            return self._imbalance_ids(ticks)
+
+        if self.kind == 'tick':
+            measure = np.ones(len(ticks['price']))
+        elif self.kind == 'volume':
+            measure = ticks['qty']
+        else:
+            measure = ticks['quote']
+        cumulative = self._cumulative + np.cumsum(measure)
+        # 成交之前的累计量决定归属，越过阈值的那一笔计入当前 bar 并使其完成
+        ids = np.floor((cumulative - measure) / self.threshold).astype(np.int64)
+        self._cumulative = cumulative[-1]
+        return ids, cumulative[-1] >= (ids[-1] + 1) * self.threshold
+
+    def _imbalance_threshold(self):
+        expected_ticks = min(max(self._expected_ticks, self.min_ticks), self.max_ticks)
+        return expected_ticks * max(self._expected_imbalance, self.min_expected_imbalance)
+
+    def _imbalance_ids(self, ticks):
+        """
+        不平衡 bar：当前 bar 内主动方向累计 |θ| 达到阈值时结束
+
+        阈值随每根 bar 更新，只能逐根确定终点；每根 bar 的终点用逐步加倍的窗口向量化查找。
+        """
+        signs = np.where(ticks['buyer_maker'], -1, 1).astype(np.int64)
+        n = len(signs)
+        cumulative = np.cumsum(signs)
+        breaks = np.zeros(n, dtype=np.int64)
+        start = 0
+        last_complete = False
+        while start < n:
+            threshold = self._imbalance_threshold()
+            base = (cumulative[start - 1] if start else 0) - self._theta
+            end = -1
+            window = 256
+            position = start
+            while position < n:
+                stop = min(n, position + window)
+                hits = np.abs(cumulative[position:stop] - base) >= threshold
+                if hits.any():
+                    end = position + int(np.argmax(hits))
+                    break
+                position = stop
+                window *= 2
+            if end < 0:
+                self._theta = int(cumulative[-1] - base)
+                self._bar_ticks += n - start
+                break
+
+            bar_ticks = self._bar_ticks + end - start + 1
+            theta = cumulative[end] - base
+            self._expected_ticks += self._alpha * (bar_ticks - self._expected_ticks)
+            self._expected_imbalance += self._alpha * (abs(theta) / bar_ticks - self._expected_imbalance)
+            self._theta = 0
+            self._bar_ticks = 0
+            last_complete = end == n - 1
+            if end + 1 < n:
+                breaks[end + 1] = 1
+            start = end + 1
+
+        ids = self._bar_index + np.cumsum(breaks)
+        self._bar_index = int(ids[-1]) + (1 if last_complete else 0)
+        return ids, last_complete
+
+    def _to_frame(self, bars):
+        if bars is None or len(bars['open']) == 0:
+            return pd.DataFrame(columns=BAR_COLUMNS + ['vwap'], index=pd.DatetimeIndex([], name='timestamp'))
+        frame = pd.DataFrame({column: bars[column] for column in BAR_COLUMNS})
+        frame['open_time'] = pd.to_datetime(frame['open_time'])
+        frame['close_time'] = pd.to_datetime(frame['close_time'])
+        frame['vwap'] = frame['quote_volume'] / frame['volume']
+        if self.kind == 'time':
+            index = pd.to_datetime(bars['id'] * self.interval_ns)
+        else:
+            index = frame['close_time']
+        frame.index = pd.DatetimeIndex(index, name='timestamp')
+        return frame
+
+def build_bars(file_path, kind='volume', threshold=None, chunk_size=CHUNK_SIZE, **kwargs):
+    """从 HDF5 tick 库分块生成全部 bar（包括最后一根未完成的）"""
+    builder = BarBuilder(kind, threshold, **kwargs)
+    frames = [builder.update(prepare_ticks(chunk)) for chunk in iter_tick_chunks(file_path, chunk_size=chunk_size)]
+    frames.append(builder.flush())
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return builder.flush()
+    bars = pd.concat(frames)
+    logger.info(f"Built {len(bars)} {kind} bars from {file_path}")
+    return bars
+
+def to_feed(bars, **kwargs):
+    """把 bar 转换为 backtrader 数据源"""
+    return bt.feeds.PandasData(
+        dataname=bars,
+        datetime=None,  # 使用索引作为时间戳
+        open='open',
+        high='high',
+        low='low',
+        close='close',
+        volume='volume',
+        openinterest=-1,
+        **kwargs
+    )
@@ -1,12 +1,24 @@
 import logging
 import os
+import sys
 import pandas as pd
-from binance.client import AsyncClient
 from binance.exceptions import BinanceAPIException
 from datetime import datetime
 import asyncio
 from dotenv import load_dotenv
 
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from binance_api.client_manager import ManagedAsyncClient
+from binance_api.rate_limiter import rate_limiter, PRIORITY_BULK
+from data_storage.data_quality import check_klines, dataset_key, issues_index, log_report, merge_repaired
+
+# 每次 klines 请求的权重
+KLINES_WEIGHT = 2
+
 # 加载环境变量
 load_dotenv()
 
@@ -30,7 +42,8 @@ class BTCKlines:
     async def initialize(self):
         """初始化 Binance 客户端"""
         try:
-            self.client = await AsyncClient.create(self.api_key, self.api_secret)
+            # 回补请求走低优先级通道，不挤占机器人的下单额度
+            self.client = await ManagedAsyncClient.create(self.api_key, self.api_secret)
             logger.info("Binance client initialized successfully")
             
             # 创建数据文件夹（如果不存在）
@@ -54,11 +67,13 @@ class BTCKlines:
             logger.info(f"Fetching {self.interval} klines for {self.symbol}")
             
             # 获取最早的可用数据
-            klines = await self.client.get_historical_klines(
-                symbol=self.symbol,
-                interval=self.interval,
-                start_str="2017-08-17",  # BTCUSDT 在 Binance 上市的大致时间
-            )
+            # get_historical_klines 内部分页请求，每页都按 KLINES_WEIGHT 排队
+            async with rate_limiter.budget(KLINES_WEIGHT, PRIORITY_BULK, per_request=KLINES_WEIGHT):
+                klines = await self.client.get_historical_klines(
+                    symbol=self.symbol,
+                    interval=self.interval,
+                    start_str="2017-08-17",  # BTCUSDT 在 Binance 上市的大致时间
+                )
             
             if klines:
                 logger.info(f"Successfully fetched {len(klines)} klines")
@@ -75,45 +90,98 @@ class BTCKlines:
             logger.error(f"Unexpected error: {e}")
             return []
 
+    @property
+    def filepath(self):
+        # 文件名包含时间间隔
+        return os.path.join(self.data_folder, f"{self.symbol}_{self.interval}_klines.h5")
+
+    @property
+    def issues_key(self):
+        # 问题索引中的数据集名
+        return dataset_key('klines', self.symbol, self.interval)
+
+    def klines_to_frame(self, klines):
+        """把接口返回的K线转换为DataFrame"""
+        df = pd.DataFrame(klines, columns=[
+            'timestamp', 'open', 'high', 'low', 'close', 
+            'volume', 'close_time', 'quote_asset_volume',
+            'number_of_trades', 'taker_buy_base_asset_volume',
+            'taker_buy_quote_asset_volume', 'ignore'
+        ])
+        
+        # 转换时间戳
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        df['close_time'] = pd.to_datetime(df['close_time'], unit='ms')
+        
+        # 转换数值类型
+        numeric_columns = ['open', 'high', 'low', 'close', 'volume', 
+                         'quote_asset_volume', 'taker_buy_base_asset_volume',
+                         'taker_buy_quote_asset_volume']
+        
+        for col in numeric_columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
     def save_klines_to_hdf5(self, klines):
         """保存K线数据到HDF5文件"""
         try:
-            # 文件名包含时间间隔
-            filename = f"{self.symbol}_{self.interval}_klines.h5"
-            filepath = os.path.join(self.data_folder, filename)
-            
-            # 将数据转换为DataFrame
-            df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 
-                'volume', 'close_time', 'quote_asset_volume',
-                'number_of_trades', 'taker_buy_base_asset_volume',
-                'taker_buy_quote_asset_volume', 'ignore'
-            ])
-            
-            # 转换时间戳
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df['close_time'] = pd.to_datetime(df['close_time'], unit='ms')
-            
-            # 转换数值类型
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume', 
-                             'quote_asset_volume', 'taker_buy_base_asset_volume',
-                             'taker_buy_quote_asset_volume']
-            
-            for col in numeric_columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+            df = klines if isinstance(klines, pd.DataFrame) else self.klines_to_frame(klines)
             
             # 保存为HDF5格式
-            df.to_hdf(filepath, key='klines', mode='w')
+            df.to_hdf(self.filepath, key='klines', mode='w')
             
             # 打印数据统计信息
             logger.info(f"Data summary:")
             logger.info(f"Date range: from {df['timestamp'].min()} to {df['timestamp'].max()}")
             logger.info(f"Total periods: {len(df)}")
             logger.info(f"Price range: {df['low'].min():.2f} - {df['high'].max():.2f} USDT")
+
+            # 保存后重新检查，问题索引只保留仍未修复的区间
+            report = check_klines(df, self.interval)
+            log_report(self.issues_key, report)
+            issues_index.update(self.issues_key, report)
             
         except Exception as e:
             logger.error(f"Error saving klines to HDF5: {e}")
 
+    async def update_klines(self):
+        """
+        增量更新：只重新获取问题索引中记录的缺口和异常K线，再从已保存的最后一根开始补上新数据
+
+        本地文件不存在时获取全部历史。
+        """
+        try:
+            if not os.path.exists(self.filepath):
+                return await self.fetch_klines()
+            existing = pd.read_hdf(self.filepath, key='klines')
+            ranges = issues_index.get_ranges(self.issues_key)
+            # 上次保存的最后一根可能是当时尚未收盘的K线，从它开始重新获取，merge_repaired 用新数据覆盖
+            last_open = int(existing['timestamp'].max().value // 1_000_000) if len(existing) else None
+            ranges.append((last_open if last_open is not None else "2017-08-17", None))
+            logger.info(f"Refetching {len(ranges) - 1} broken ranges and new {self.interval} klines for {self.symbol}")
+
+            fetched = []
+            for start, end in ranges:
+                async with rate_limiter.budget(KLINES_WEIGHT, PRIORITY_BULK, per_request=KLINES_WEIGHT):
+                    klines = await self.client.get_historical_klines(
+                        symbol=self.symbol,
+                        interval=self.interval,
+                        start_str=start,
+                        end_str=end
+                    )
+                fetched.extend(klines)
+
+            if fetched:
+                self.save_klines_to_hdf5(merge_repaired(existing, self.klines_to_frame(fetched), 'timestamp'))
+            return fetched
+
+        except BinanceAPIException as e:
+            logger.error(f"Binance API error: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return []
+
 async def main():
     """主函数"""
     # 可以指定不同的时间间隔
@@ -122,8 +190,8 @@ async def main():
     for interval in intervals:
         klines = BTCKlines(interval=interval)
         if await klines.initialize():
-            logger.info(f"Fetching {interval} klines...")
-            await klines.fetch_klines()
+            logger.info(f"Updating {interval} klines...")
+            await klines.update_klines()
             await klines.close()
         else:
             logger.error(f"Failed to initialize for {interval} interval")
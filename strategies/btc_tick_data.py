@@ -1,27 +1,40 @@
 import logging
 import os
+import sys
 import pandas as pd
-from binance.client import AsyncClient
 from binance.exceptions import BinanceAPIException
 from datetime import datetime
 import asyncio
 
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from binance_api.client_manager import ManagedAsyncClient
+from binance_api.rate_limiter import rate_limiter, PRIORITY_BULK
+
+# historicalTrades 接口的请求权重
+HISTORICAL_TRADES_WEIGHT = 25
+
 logger = logging.getLogger(__name__)
 
 class BTCTickData:
     def __init__(self, api_key, api_secret):
-        self.client = AsyncClient(api_key, api_secret)
+        # 回补请求走低优先级通道，不挤占机器人的下单额度
+        self.client = ManagedAsyncClient(api_key, api_secret)
         self.symbol = 'BTCUSDT'
         self.data_folder = 'tick_data'
 
     async def fetch_and_save_trades(self, start_id, end_id, batch_size=1000):
         """获取并保存指定范围内的交易数据"""
         try:
-            trades = await self.client.get_historical_trades(
-                symbol=self.symbol,
-                fromId=start_id,
-                limit=batch_size
-            )
+            async with rate_limiter.budget(HISTORICAL_TRADES_WEIGHT, PRIORITY_BULK):
+                trades = await self.client.get_historical_trades(
+                    symbol=self.symbol,
+                    fromId=start_id,
+                    limit=batch_size
+                )
             if trades:
                 self.save_trades_to_hdf5(trades)
             return trades
@@ -1,13 +1,25 @@
 import logging
 import os
+import sys
 import pandas as pd
-from binance.client import AsyncClient
 from binance.exceptions import BinanceAPIException
 from datetime import datetime
 import asyncio
 import aiohttp
 from dotenv import load_dotenv
 
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from binance_api.client_manager import ManagedAsyncClient
+from binance_api.rate_limiter import rate_limiter, PRIORITY_BULK
+from data_storage.data_quality import compact_trades, dataset_key, issues_index
+
+# historicalTrades 接口的请求权重
+HISTORICAL_TRADES_WEIGHT = 25
+
 # 加载环境变量
 load_dotenv()
 
@@ -24,7 +36,8 @@ class BTCTickData:
     async def initialize(self):
         """初始化 Binance 客户端"""
         try:
-            self.client = await AsyncClient.create(self.api_key, self.api_secret)
+            # 回补请求走低优先级通道，不挤占机器人的下单额度
+            self.client = await ManagedAsyncClient.create(self.api_key, self.api_secret)
             logger.info("Binance client initialized successfully")
             return True
         except Exception as e:
@@ -42,11 +55,12 @@ class BTCTickData:
             logger.info(f"[fetch_and_save_trades] Starting fetch for ID range: {start_id} to {end_id}")
             logger.info(f"[fetch_and_save_trades] Batch size: {batch_size}")
             
-            trades = await self.client.get_historical_trades(
-                symbol=self.symbol,
-                fromId=start_id,
-                limit=batch_size
-            )
+            async with rate_limiter.budget(HISTORICAL_TRADES_WEIGHT, PRIORITY_BULK):
+                trades = await self.client.get_historical_trades(
+                    symbol=self.symbol,
+                    fromId=start_id,
+                    limit=batch_size
+                )
             
             if trades:
                 logger.info(f"[fetch_and_save_trades] Successfully fetched {len(trades)} trades")
@@ -152,6 +166,46 @@ class BTCTickData:
             await self.close()
             logger.info("[run] Client connection closed")
 
+    async def repair_trades(self, batch_size=1000):
+        """
+        只重新获取问题索引中记录的成交 ID 区间（缺失的 ID 和价格/数量无效的成交）
+
+        每个区间补齐后从索引中移除；仍有批次失败的区间保留，下次继续。
+        补下载的成交追加在文件末尾，最后用 compact_trades 按 ID 排序并去重，K 线构建器才能用上这些成交。
+        """
+        key = dataset_key('trades', self.symbol)
+        ranges = issues_index.get_ranges(key)
+        if not ranges:
+            logger.info(f"[repair_trades] No broken trade ID ranges recorded for {self.symbol}")
+            return True
+        if not await self.initialize():
+            logger.error("[repair_trades] Failed to initialize client")
+            return False
+
+        try:
+            logger.info(f"[repair_trades] Refetching {len(ranges)} trade ID ranges")
+            for range_start, range_end in ranges:
+                complete = True
+                for start in range(range_start, range_end + 1, batch_size):
+                    # 最后一批只取到区间结束，避免重复保存已有的成交
+                    limit = min(batch_size, range_end + 1 - start)
+                    if not await self.fetch_and_save_trades(start, start + limit, limit):
+                        complete = False
+                if complete:
+                    issues_index.resolve(key, range_start, range_end)
+                else:
+                    logger.warning(f"[repair_trades] ID range {range_start} to {range_end} is still incomplete")
+
+            filepath = os.path.join(self.data_folder, f"{self.symbol}_all_tick_data.h5")
+            try:
+                await asyncio.to_thread(compact_trades, filepath)
+            except Exception as e:
+                logger.error(f"[repair_trades] Error compacting {filepath}: {e}")
+                return False
+            return True
+        finally:
+            await self.close()
+
 async def main():
     """主函数"""
     api_key = os.getenv('BINANCE_API_KEY')
@@ -0,0 +1,251 @@
+"""
+回撤分析
+
+输入为按时间排序的价格 Series（任意交易对、任意周期），全部计算在 numpy 数组上一次完成：
+回撤序列、所有回撤区间（峰值、谷底、恢复、持续时间）、买入后的最大不利/有利波动、当前回撤，
+以及"距峰值下跌 x% 买入、上涨 y% 卖出"的阈值策略模拟。分钟级多年数据也在毫秒级完成。
+"""
+import numpy as np
+import pandas as pd
+
+def select_period(df, year=None, start=None, end=None):
+    """按年份或起止时间截取数据，参数都为空时返回原数据"""
+    if year is not None:
+        df = df[df.index.year == year]
+    if start is not None or end is not None:
+        df = df.loc[start:end]
+    return df
+
+def drawdown_series(prices):
+    """
+    相对历史峰值的回撤
+
+    Returns:
+        tuple: (回撤比例数组（<= 0）, 运行峰值数组)
+    """
+    values = np.asarray(prices, dtype=float)
+    peak = np.maximum.accumulate(values)
+    return values / peak - 1.0, peak
+
+def calculate_drawdowns(prices):
+    """回撤序列（保留原索引）"""
+    drawdowns, _ = drawdown_series(prices)
+    return pd.Series(drawdowns, index=prices.index)
+
+def max_drawdown(prices):
+    """
+    最大回撤及其峰值和谷底
+
+    Returns:
+        dict: max_drawdown、max_drawdown_date、max_drawdown_price、peak_date、peak_price，数据为空时返回 None
+    """
+    if len(prices) == 0:
+        return None
+    values = prices.to_numpy(dtype=float)
+    drawdowns, _ = drawdown_series(values)
+    trough = int(np.argmin(drawdowns))
+    peak = int(np.argmax(values[:trough + 1]))
+    return {
+        'max_drawdown': float(drawdowns[trough]),
+        'max_drawdown_date': prices.index[trough],
+        'max_drawdown_price': float(values[trough]),
+        'peak_date': prices.index[peak],
+        'peak_price': float(values[peak])
+    }
+
+def _segment_extremes(values, starts, ends, func):
+    """
+    对每个闭区间 [starts[i], ends[i]] 求最小值（func=np.minimum）或最大值（func=np.maximum）及其第一次出现的位置
+
+    区间可以重叠；所有区间的下标一次展开后用 reduceat 计算。
+    """
+    if len(starts) == 0:
+        return np.empty(0), np.empty(0, dtype=np.int64)
+    lengths = ends - starts + 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+    segment_values = values[positions]
+    extremes = func.reduceat(segment_values, offsets)
+    hits = np.flatnonzero(segment_values == np.repeat(extremes, lengths))
+    _, first = np.unique(segment[hits], return_index=True)
+    return extremes, positions[hits[first]]
+
+def drawdown_episodes(prices, min_depth=0.0):
+    """
+    所有回撤区间：从峰值开始跌破、到价格重新回到峰值为止
+
+    Args:
+        prices (Series): 价格序列
+        min_depth (float): 只保留最大跌幅不小于该比例的区间（例如 0.1）
+
+    Returns:
+        DataFrame: 每行一个区间，列为 peak_date、peak_price、trough_date、trough_price、recovery_date
+                   （未恢复为 NaT）、depth（<= 0）、decline_bars、recovery_bars（未恢复为 -1）、
+                   duration_bars 和 duration（峰值到恢复或数据结束的时间）
+    """
+    values = prices.to_numpy(dtype=float)
+    columns = ['peak_date', 'peak_price', 'trough_date', 'trough_price', 'recovery_date',
+               'depth', 'decline_bars', 'recovery_bars', 'duration_bars', 'duration']
+    if len(values) < 2:
+        return pd.DataFrame(columns=columns)
+
+    drawdowns, _ = drawdown_series(values)
+    underwater = drawdowns < 0
+    # 水下区间的起止（ends 为区间内最后一个位置）
+    edges = np.diff(np.concatenate([[False], underwater, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+
+    depths, troughs = _segment_extremes(drawdowns, starts, ends, np.minimum)
+    keep = depths <= -min_depth
+    starts, ends, depths, troughs = starts[keep], ends[keep], depths[keep], troughs[keep]
+
+    # 回撤从前一个位置的峰值开始；恢复点为区间结束后的下一个位置
+    peaks = starts - 1
+    recovered = ends + 1 < len(values)
+    recoveries = np.where(recovered, ends + 1, -1)
+    last = np.where(recovered, recoveries, len(values) - 1)
+
+    index = prices.index
+    recovery_dates = pd.Series(index[np.where(recovered, recoveries, 0)]).where(recovered)
+    return pd.DataFrame({
+        'peak_date': index[peaks],
+        'peak_price': values[peaks],
+        'trough_date': index[troughs],
+        'trough_price': values[troughs],
+        'recovery_date': recovery_dates.to_numpy(),
+        'depth': depths,
+        'decline_bars': troughs - peaks,
+        'recovery_bars': np.where(recovered, recoveries - troughs, -1),
+        'duration_bars': last - peaks,
+        'duration': index[last] - index[peaks]
+    }, columns=columns)
+
+def current_drawdown(prices, threshold=None):
+    """
+    最新价格相对峰值的回撤
+
+    Args:
+        threshold (float): 为空时峰值为整个序列的最高价；否则从最新价格往前回溯，
+                           第二次遇到比回溯到的最高价低 threshold 以上的价格时停止（即越过上一轮完整的下跌段），
+                           回溯范围内的最高价作为峰值
+
+    Returns:
+        dict: current_date、current_price、peak_date、peak_price、drawdown，数据为空时返回 None
+    """
+    if len(prices) == 0:
+        return None
+    values = prices.to_numpy(dtype=float)
+    reversed_values = values[::-1]
+    stop = len(values)
+    if threshold is not None:
+        # 从最新价格往前的回溯峰值和回撤
+        reversed_drawdowns = 1.0 - reversed_values / np.maximum.accumulate(reversed_values)
+        hits = np.flatnonzero(reversed_drawdowns > threshold)
+        if len(hits) > 1:
+            stop = hits[1]
+    # 反向数组里的第一个最高价即最近一次出现的峰值
+    peak = len(values) - 1 - int(np.argmax(reversed_values[:stop]))
+    return {
+        'current_date': prices.index[-1],
+        'current_price': float(values[-1]),
+        'peak_date': prices.index[peak],
+        'peak_price': float(values[peak]),
+        'drawdown': float(values[-1] / values[peak] - 1.0)
+    }
+
+def adverse_excursions(prices, entry_positions, exit_positions=None, entry_prices=None):
+    """
+    每笔买入后到卖出（含）为止的最大不利波动和最大有利波动
+
+    Args:
+        prices (Series): 价格序列
+        entry_positions (array): 买入位置（整数下标）
+        exit_positions (array): 卖出位置，-1 或缺省表示持有到数据结束
+        entry_prices (array): 买入价格，缺省为买入位置的价格
+
+    Returns:
+        DataFrame: entry_date、entry_price、max_drawdown（<= 0）、max_drawdown_date、max_drawdown_price、
+                   max_gain、max_gain_date、max_gain_price
+    """
+    values = prices.to_numpy(dtype=float)
+    entries = np.asarray(entry_positions, dtype=np.int64)
+    if exit_positions is None:
+        exits = np.full(len(entries), len(values) - 1)
+    else:
+        exits = np.asarray(exit_positions, dtype=np.int64)
+        exits = np.where(exits < 0, len(values) - 1, exits)
+    entry_prices = values[entries] if entry_prices is None else np.asarray(entry_prices, dtype=float)
+    columns = ['entry_date', 'entry_price', 'max_drawdown', 'max_drawdown_date', 'max_drawdown_price',
+               'max_gain', 'max_gain_date', 'max_gain_price']
+    if len(entries) == 0:
+        return pd.DataFrame(columns=columns)
+
+    lows, low_positions = _segment_extremes(values, entries, exits, np.minimum)
+    highs, high_positions = _segment_extremes(values, entries, exits, np.maximum)
+    index = prices.index
+    return pd.DataFrame({
+        'entry_date': index[entries],
+        'entry_price': entry_prices,
+        'max_drawdown': lows / entry_prices - 1.0,
+        'max_drawdown_date': index[low_positions],
+        'max_drawdown_price': lows,
+        'max_gain': highs / entry_prices - 1.0,
+        'max_gain_date': index[high_positions],
+        'max_gain_price': highs
+    }, columns=columns)
+
+def _first_true(mask_func, start, size, window=256):
+    """从 start 开始找第一个 mask_func(窗口) 为真的位置，窗口按倍数增长，只扫描到命中为止"""
+    while start < size:
+        stop = min(size, start + window)
+        hits = mask_func(start, stop)
+        if hits.any():
+            return start + int(np.argmax(hits))
+        start = stop
+        window *= 2
+    return -1
+
+def simulate_threshold_strategy(prices, buy_threshold=0.15, sell_threshold=0.15):
+    """
+    阈值策略模拟：空仓时价格跌到运行峰值的 (1 - buy_threshold) 以下买入，
+    持仓时涨到买入价的 (1 + sell_threshold) 以上卖出。运行峰值从序列开头起算，不受交易影响。
+
+    回撤序列一次算出，买点用 searchsorted 在候选位置中跳转，卖点只扫描到触发为止，
+    每笔交易的开销与持仓长度成正比，不逐行循环。
+
+    Returns:
+        tuple: (买入位置数组, 卖出位置数组（最后一笔未卖出时为 -1）)
+    """
+    values = prices.to_numpy(dtype=float) if hasattr(prices, 'to_numpy') else np.asarray(prices, dtype=float)
+    peak = np.maximum.accumulate(values)
+    buy_candidates = np.flatnonzero(values <= peak * (1 - buy_threshold))
+
+    entries, exits = [], []
+    position = 0
+    size = len(values)
+    while True:
+        k = np.searchsorted(buy_candidates, position)
+        if k >= len(buy_candidates):
+            break
+        entry = int(buy_candidates[k])
+        target = values[entry] * (1 + sell_threshold)
+        exit_ = _first_true(lambda lo, hi: values[lo:hi] >= target, entry + 1, size)
+        entries.append(entry)
+        exits.append(exit_)
+        if exit_ < 0:
+            break
+        position = exit_ + 1
+    return np.asarray(entries, dtype=np.int64), np.asarray(exits, dtype=np.int64)
+
+def trade_points(prices, entries, exits):
+    """把买卖位置转换为 [(日期, 'Buy'/'Sell', 价格), ...]，按时间排序"""
+    index = prices.index
+    values = prices.to_numpy(dtype=float)
+    points = []
+    for entry, exit_ in zip(entries, exits):
+        points.append((index[entry], 'Buy', float(values[entry])))
+        if exit_ >= 0:
+            points.append((index[exit_], 'Sell', float(values[exit_])))
+    return points
@@ -1,130 +1,71 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from strategies import drawdown_analytics
+
 def calculate_drawdowns(prices):
-    cumulative_max = prices.cummax()
-    drawdowns = (prices - cumulative_max) / cumulative_max
-    return drawdowns
-
-def calculate_max_drawdown_2024(df):
-    df_2024 = df[df.index.year == 2024]
-    drawdowns = calculate_drawdowns(df_2024['close'])
-    max_drawdown = drawdowns.min()
-    max_drawdown_date = drawdowns.idxmin()
-    max_drawdown_price = df_2024.loc[max_drawdown_date, 'close']
-    peak_date = df_2024['close'][:max_drawdown_date].idxmax()
-    peak_price = df_2024.loc[peak_date, 'close']
-    
-    return {
-        'max_drawdown': max_drawdown,
-        'max_drawdown_date': max_drawdown_date,
-        'max_drawdown_price': max_drawdown_price,
-        'peak_date': peak_date,
-        'peak_price': peak_price
-    }
-
-def simulate_trading_strategy(df):
-    df_2024 = df[df.index.year == 2024]
-    
-    buy_sell_points = []
-    last_peak = df_2024['close'].iloc[0]
-    in_position = False
-    buy_price = 0
-
-    for date, row in df_2024.iterrows():
-        if not in_position:
-            if row['close'] <= last_peak * 0.85:
-                buy_price = row['close']
-                buy_sell_points.append((date, 'Buy', buy_price))
-                in_position = True
-        else:
-            if row['close'] >= buy_price * 1.15:
-                sell_price = row['close']
-                buy_sell_points.append((date, 'Sell', sell_price))
-                in_position = False
-
-        if row['close'] > last_peak:
-            last_peak = row['close']
-
-    return buy_sell_points
+    return drawdown_analytics.calculate_drawdowns(prices)
+
+def calculate_max_drawdown(df, year=None):
+    """指定年份（为空时为全部数据）的最大回撤"""
+    return drawdown_analytics.max_drawdown(drawdown_analytics.select_period(df, year)['close'])
+
+def simulate_trading_strategy(df, year=None, buy_threshold=0.15, sell_threshold=0.15):
+    """距峰值下跌 buy_threshold 买入、上涨 sell_threshold 卖出，返回 [(日期, 'Buy'/'Sell', 价格), ...]"""
+    prices = drawdown_analytics.select_period(df, year)['close']
+    entries, exits = drawdown_analytics.simulate_threshold_strategy(prices, buy_threshold, sell_threshold)
+    return drawdown_analytics.trade_points(prices, entries, exits)
 
 def analyze_drawdowns_after_buy(df, buy_sell_points):
-    drawdown_analysis = []
-    for i, (buy_date, action, buy_price) in enumerate(buy_sell_points):
-        if action == 'Buy':
-            # 找到下一个卖出点或者数据结束
-            next_sell_date = df.index[-1]
-            if i + 1 < len(buy_sell_points):
-                next_sell_date = buy_sell_points[i+1][0]
-            
-            # 分析这段时间内的价格变动
-            period_df = df.loc[buy_date:next_sell_date]
-            
-            # 计算相对于买入价格的回撤
-            drawdowns = (period_df['close'] - buy_price) / buy_price
-            max_drawdown = drawdowns.min()
-            max_drawdown_date = drawdowns.idxmin()
-            max_drawdown_price = period_df.loc[max_drawdown_date, 'close']
-            
-            drawdown_analysis.append({
-                'buy_date': buy_date,
-                'buy_price': buy_price,
-                'max_drawdown': max_drawdown,
-                'max_drawdown_date': max_drawdown_date,
-                'max_drawdown_price': max_drawdown_price
-            })
-    
-    return drawdown_analysis
+    """每个买点到下一个卖点（没有卖点时到数据结束）之间相对买入价的最大浮亏"""
+    buys = [i for i, (_, action, _) in enumerate(buy_sell_points) if action == 'Buy']
+    if not buys:
+        return []
+    index = df.index
+    entry_positions = index.get_indexer([buy_sell_points[i][0] for i in buys])
+    # 下一个交易点的位置，没有下一个点时持有到数据结束
+    exit_positions = np.array([
+        index.get_loc(buy_sell_points[i + 1][0]) if i + 1 < len(buy_sell_points) else -1
+        for i in buys
+    ], dtype=np.int64)
+    excursions = drawdown_analytics.adverse_excursions(
+        df['close'], entry_positions, exit_positions,
+        entry_prices=[buy_sell_points[i][2] for i in buys]
+    )
+    return [
+        {
+            'buy_date': row.entry_date,
+            'buy_price': row.entry_price,
+            'max_drawdown': row.max_drawdown,
+            'max_drawdown_date': row.max_drawdown_date,
+            'max_drawdown_price': row.max_drawdown_price
+        }
+        for row in excursions.itertuples(index=False)
+    ]
 
 def clean_data(df):
-    # 检查并修正异常值
-    df['close'] = df[['open', 'high', 'low', 'close']].mean(axis=1)
-    
-    # 确保 close 价格在当天的最低和最高价之间
+    # 保留原始收盘价，只把超出当天最低/最高价范围的 close 截断到范围内
     df['close'] = df['close'].clip(lower=df['low'], upper=df['high'])
     
     return df
 
-def calculate_current_drawdown(df):
-    # 获取最新日期
-    latest_date = df.index.max()
-    current_price = df.loc[latest_date, 'close']
-
-    # 从最新日期向前查找峰值
-    peak_price = current_price
-    peak_date = latest_date
-    found_peak = False
-
-    for date, price in df['close'].sort_index(ascending=False).items():
-        if price > peak_price:
-            peak_price = price
-            peak_date = date
-        elif found_peak and (peak_price - price) / peak_price <= 0.15:
-            # 如果已经找到峰值，且回撤不超过15%，继续寻找
-            continue
-        elif found_peak:
-            # 如果已经找到峰值，且回撤超过15%，停止寻找
-            break
-        elif (peak_price - price) / peak_price > 0.15:
-            # 找到第一个回撤超过15%的点，标记为找到峰值
-            found_peak = True
-
-    # 计算回撤
-    drawdown = (current_price - peak_price) / peak_price
-    
-    return {
-        'current_date': latest_date,
-        'current_price': current_price,
-        'peak_date': peak_date,
-        'peak_price': peak_price,
-        'drawdown': drawdown
-    }
-
-def perform_analysis():
-    df = pd.read_csv('Strategy/bitcoin_historical_data.csv')
+def calculate_current_drawdown(df, threshold=0.15):
+    """最新价格相对上一个峰值的回撤（向前回溯越过上一轮跌幅超过 threshold 的下跌段为止）"""
+    return drawdown_analytics.current_drawdown(df['close'], threshold)
+
+def perform_analysis(csv_path='Strategy/bitcoin_historical_data.csv', year=2024):
+    df = pd.read_csv(csv_path)
     df['time'] = pd.to_datetime(df['time'])
     df.set_index('time', inplace=True)
+    df.sort_index(inplace=True)
 
     # 数据清洗
     df = clean_data(df)
@@ -138,20 +79,26 @@ def perform_analysis():
     print("\n最后几行数据：")
     print(df.tail())
 
-    # 检查是否有 2024 年的数据
-    df_2024 = df[df.index.year == 2024]
-    if df_2024.empty:
-        print("\n警告：数据集中没有 2024 年的数据")
+    # 检查是否有指定年份的数据
+    df_year = drawdown_analytics.select_period(df, year)
+    if df_year.empty:
+        print(f"\n警告：数据集中没有 {year} 年的数据")
     else:
-        # 如果有 2024 年的数据，继续之前的分析
-        max_drawdown_2024 = calculate_max_drawdown_2024(df)
-        print("\n2024年最大回撤分析：")
-        print(f"最大回撤: {max_drawdown_2024['max_drawdown']:.2%}")
-        print(f"最大回撤日期: {max_drawdown_2024['max_drawdown_date'].date()}, 价格: ${max_drawdown_2024['max_drawdown_price']:.2f}")
-        print(f"峰值日期: {max_drawdown_2024['peak_date'].date()}, 价格: ${max_drawdown_2024['peak_price']:.2f}")
-
-        buy_sell_points = simulate_trading_strategy(df)
-        print("\n2024年交易策略模拟结果：")
+        max_drawdown = calculate_max_drawdown(df, year)
+        print(f"\n{year}年最大回撤分析：")
+        print(f"最大回撤: {max_drawdown['max_drawdown']:.2%}")
+        print(f"最大回撤日期: {max_drawdown['max_drawdown_date'].date()}, 价格: ${max_drawdown['max_drawdown_price']:.2f}")
+        print(f"峰值日期: {max_drawdown['peak_date'].date()}, 价格: ${max_drawdown['peak_price']:.2f}")
+
+        episodes = drawdown_analytics.drawdown_episodes(df_year['close'], min_depth=0.1)
+        print(f"\n{year}年跌幅超过10%的回撤区间：")
+        for episode in episodes.itertuples(index=False):
+            recovery = episode.recovery_date.date() if pd.notna(episode.recovery_date) else '未恢复'
+            print(f"峰值 {episode.peak_date.date()} -> 谷底 {episode.trough_date.date()} ({episode.depth:.2%}), "
+                  f"恢复: {recovery}, 持续: {episode.duration}")
+
+        buy_sell_points = simulate_trading_strategy(df, year)
+        print(f"\n{year}年交易策略模拟结果：")
         for date, action, price in buy_sell_points:
             print(f"{date.date()}: {action} at ${price:.2f}")
 
@@ -174,4 +121,4 @@ def perform_analysis():
     print(f"当前回撤: {current_drawdown['drawdown']:.2%}")
 
 if __name__ == "__main__":
-    perform_analysis()
\ No newline at end of file
+    perform_analysis()
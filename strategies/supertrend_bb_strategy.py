@@ -1,6 +1,7 @@
 import backtrader as bt
 import numpy as np
 import logging
+from risk_management.position_sizing import atr_unit_size
 
 logger = logging.getLogger(__name__)
 
@@ -129,20 +130,6 @@ class SupertrendBBStrategy(bt.Strategy):
                 
     def calculate_size(self):
         """计算头寸大小"""
-        cash = self.broker.getcash()
-        value = self.broker.getvalue()
-        
-        # 计算每笔交易的风险金额
-        risk_amount = value * self.p.risk_ratio
-        
-        # 使用ATR计算止损点位
-        stop_loss = self.atr[0] * 2
-        
-        # 如果止损为0，使用价格的1%作为止损
-        if stop_loss == 0:
-            stop_loss = self.data.close[0] * 0.01
-            
-        # 计算头寸大小
-        size = risk_amount / stop_loss
-        
-        return size
\ No newline at end of file
+        # 每笔交易承担权益的 risk_ratio，止损距离为 2 倍 ATR；ATR 为 0 时使用价格的1%作为止损
+        return atr_unit_size(self.broker.getvalue(), self.atr[0], self.p.risk_ratio, atr_multiple=2,
+                             price=self.data.close[0], fallback_stop_pct=0.01)
\ No newline at end of file
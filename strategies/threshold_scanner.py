@@ -0,0 +1,253 @@
+"""
+阈值策略参数扫描
+
+对"距峰值下跌 buy% 买入、从买入价上涨 sell% 卖出"这一类规则，在 买入阈值 × 卖出阈值 × 年份 × 交易对
+的网格上一次性评估，返回按收益和最大浮亏排序的结果表。
+
+每个（交易对, 年份）序列先建立区间最大/最小值的稀疏表，然后所有阈值组合同步推进：
+每一轮每个组合完成一笔交易，买点用 searchsorted 在候选位置中查找，卖点用稀疏表二分跳跃查找，
+买入后的最大浮亏用稀疏表 O(1) 区间最小值得到。循环次数等于单个组合的最大交易笔数，与数据行数无关。
+"""
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from strategies.drawdown_analytics import select_period
+
+logger = logging.getLogger(__name__)
+
+# 默认网格：5% 到 50%，步长 1%
+DEFAULT_THRESHOLDS = np.round(np.arange(0.05, 0.501, 0.01), 2)
+
+RESULT_COLUMNS = ['total_return', 'trades', 'open_position', 'worst_excursion', 'avg_holding_bars', 'time_in_market']
+
+def load_close_prices(symbols, interval='4h', data_folder=None):
+    """读取 kline_data 下各交易对的收盘价，返回 {symbol: Series}"""
+    if data_folder is None:
+        data_folder = os.path.join(project_root, 'kline_data')
+    prices = {}
+    for symbol in symbols:
+        filepath = os.path.join(data_folder, f"{symbol}_{interval}_klines.h5")
+        try:
+            df = pd.read_hdf(filepath, key='klines')
+            prices[symbol] = df.set_index('timestamp')['close'].sort_index()
+        except Exception as e:
+            logger.error(f"Error loading {filepath}: {str(e)}")
+    return prices
+
+def _sparse_table(values, func):
+    """table[k][i] = func(values[i:i + 2**k])"""
+    table = [values]
+    span = 1
+    while span * 2 <= len(values):
+        previous = table[-1]
+        table.append(func(previous[:-span], previous[span:]))
+        span *= 2
+    return table
+
+def _range_min(table, starts, ends):
+    """闭区间 [starts, ends] 的最小值"""
+    lengths = ends - starts + 1
+    k = np.floor(np.log2(lengths)).astype(np.int64)
+    result = np.empty(len(starts))
+    for level in np.unique(k):
+        mask = k == level
+        rows = table[level]
+        result[mask] = np.minimum(rows[starts[mask]], rows[ends[mask] - (1 << level) + 1])
+    return result
+
+def _first_at_or_above(table, starts, targets):
+    """每个 start 之后（含）第一个不低于 target 的位置，没有时为 len(values)"""
+    n = len(table[0])
+    positions = starts.copy()
+    for level in range(len(table) - 1, -1, -1):
+        span = 1 << level
+        rows = table[level]
+        can_jump = positions + span <= n
+        jump = np.zeros(len(positions), dtype=bool)
+        jump[can_jump] = rows[positions[can_jump]] < targets[can_jump]
+        positions[jump] += span
+    return positions
+
+def scan_series(prices, buy_thresholds=DEFAULT_THRESHOLDS, sell_thresholds=DEFAULT_THRESHOLDS, fee=0.0):
+    """
+    在一个价格序列上评估全部阈值组合
+
+    Args:
+        prices: 价格序列（Series 或数组），运行峰值从序列开头起算
+        buy_thresholds (array): 买入阈值（距峰值的跌幅）
+        sell_thresholds (array): 卖出阈值（相对买入价的涨幅）
+        fee (float): 单边手续费率
+
+    Returns:
+        dict: RESULT_COLUMNS 中每项对应一个 (len(buy_thresholds), len(sell_thresholds)) 的数组
+    """
+    values = prices.to_numpy(dtype=float) if hasattr(prices, 'to_numpy') else np.asarray(prices, dtype=float)
+    buy_thresholds = np.asarray(buy_thresholds, dtype=float)
+    sell_thresholds = np.asarray(sell_thresholds, dtype=float)
+    shape = (len(buy_thresholds), len(sell_thresholds))
+    n = len(values)
+
+    growth = np.ones(shape)
+    trades = np.zeros(shape, dtype=np.int64)
+    holding = np.zeros(shape, dtype=np.int64)
+    worst = np.zeros(shape)
+    open_position = np.zeros(shape, dtype=bool)
+    if n < 2:
+        return _scan_result(growth, trades, open_position, worst, holding, n)
+
+    peak = np.maximum.accumulate(values)
+    candidates = [np.flatnonzero(values <= peak * (1 - b)) for b in buy_thresholds]
+    max_table = _sparse_table(values, np.maximum)
+    min_table = _sparse_table(values, np.minimum)
+    sell_multipliers = np.broadcast_to(1 + sell_thresholds, shape)
+    cost = (1 - fee) ** 2
+
+    positions = np.zeros(shape, dtype=np.int64)
+    active = np.ones(shape, dtype=bool)
+    while active.any():
+        # 买点：每个买入阈值的候选位置中第一个不早于当前位置的
+        entries = np.full(shape, n, dtype=np.int64)
+        for i, candidate in enumerate(candidates):
+            row = active[i]
+            if not row.any() or not len(candidate):
+                continue
+            k = np.searchsorted(candidate, positions[i, row])
+            entries[i, row] = np.where(k < len(candidate), candidate[np.minimum(k, len(candidate) - 1)], n)
+        active &= entries < n
+        if not active.any():
+            break
+
+        idx = np.nonzero(active)
+        entry = entries[idx]
+        entry_price = values[entry]
+        exit_ = _first_at_or_above(max_table, np.minimum(entry + 1, n - 1), entry_price * sell_multipliers[idx])
+        # entry 为最后一根时没有后续价格
+        exit_ = np.where(entry + 1 < n, exit_, n)
+        closed = exit_ < n
+        last = np.where(closed, exit_, n - 1)
+
+        lows = _range_min(min_table, entry, last)
+        final_price = values[last]
+        growth[idx] *= final_price / entry_price * np.where(closed, cost, 1 - fee)
+        trades[idx] += 1
+        holding[idx] += last - entry
+        worst[idx] = np.minimum(worst[idx], lows / entry_price - 1)
+        open_position[idx] = ~closed
+
+        positions[idx] = last + 1
+        # 未平仓的组合持有到数据结束
+        active[idx] = closed & (last + 1 < n)
+
+    return _scan_result(growth, trades, open_position, worst, holding, n)
+
+def _scan_result(growth, trades, open_position, worst, holding, n):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_holding = np.where(trades > 0, holding / np.maximum(trades, 1), 0.0)
+    return {
+        'total_return': growth - 1.0,
+        'trades': trades,
+        'open_position': open_position,
+        'worst_excursion': worst,
+        'avg_holding_bars': avg_holding,
+        'time_in_market': holding / n if n else np.zeros(growth.shape)
+    }
+
+def _scan_job(symbol, year, prices, buy_thresholds, sell_thresholds, fee):
+    return symbol, year, scan_series(prices, buy_thresholds, sell_thresholds, fee)
+
+def scan(prices_by_symbol, years=None, buy_thresholds=DEFAULT_THRESHOLDS, sell_thresholds=DEFAULT_THRESHOLDS,
+         fee=0.0, workers=1):
+    """
+    在 交易对 × 年份 × 买入阈值 × 卖出阈值 的网格上评估阈值策略
+
+    Args:
+        prices_by_symbol (dict): {symbol: 价格 Series（DatetimeIndex）}
+        years (list): 要评估的年份，每年单独从年初的价格起算峰值；为空时每个交易对用全部历史作为一个区间
+        fee (float): 单边手续费率
+        workers (int): 大于 1 时各（交易对, 年份）序列在进程池中并行计算
+
+    Returns:
+        DataFrame: 以 (symbol, year, buy_threshold, sell_threshold) 为索引、RESULT_COLUMNS 为列的结果表，
+                   year 为 None 表示全部历史；用 to_cube 转换为多维数组，用 rank_results 排序
+    """
+    buy_thresholds = np.asarray(buy_thresholds, dtype=float)
+    sell_thresholds = np.asarray(sell_thresholds, dtype=float)
+    jobs = []
+    for symbol, prices in prices_by_symbol.items():
+        for year in (years if years is not None else [None]):
+            series = select_period(prices, year)
+            if len(series):
+                jobs.append((symbol, year, series, buy_thresholds, sell_thresholds, fee))
+            else:
+                logger.warning(f"No data for {symbol} in {year}")
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            results = list(executor.map(_scan_job, *zip(*jobs)))
+    else:
+        results = [_scan_job(*job) for job in jobs]
+
+    frames = []
+    grid = pd.MultiIndex.from_product([buy_thresholds, sell_thresholds], names=['buy_threshold', 'sell_threshold'])
+    for symbol, year, result in results:
+        frame = pd.DataFrame({column: result[column].ravel() for column in RESULT_COLUMNS}, index=grid)
+        frame['symbol'] = symbol
+        frame['year'] = year
+        frames.append(frame.reset_index())
+    if not frames:
+        empty_index = pd.MultiIndex.from_arrays([[]] * 4, names=['symbol', 'year', 'buy_threshold', 'sell_threshold'])
+        return pd.DataFrame(columns=RESULT_COLUMNS, index=empty_index)
+    return pd.concat(frames, ignore_index=True).set_index(['symbol', 'year', 'buy_threshold', 'sell_threshold'])
+
+def to_cube(results, column='total_return'):
+    """
+    把结果表的一列转换为 (symbol, year, buy_threshold, sell_threshold) 四维数组
+
+    Returns:
+        tuple: (数组, 各维度的标签列表)
+    """
+    series = results[column]
+    levels = [series.index.get_level_values(i).unique() for i in range(series.index.nlevels)]
+    full_index = pd.MultiIndex.from_product(levels, names=series.index.names)
+    cube = series.reindex(full_index).to_numpy().reshape([len(level) for level in levels])
+    return cube, [list(level) for level in levels]
+
+def rank_results(results, max_excursion=None, min_trades=1, aggregate=False):
+    """
+    按收益降序、最大浮亏（越接近 0 越好）降序排序
+
+    Args:
+        max_excursion (float): 只保留最大浮亏不超过该比例的组合（例如 0.3 表示浮亏不超过 30%）
+        min_trades (int): 至少交易的笔数
+        aggregate (bool): 为 True 时先按阈值组合汇总（各交易对和年份的平均收益、最差浮亏）再排序
+    """
+    ranked = results[results['trades'] >= min_trades]
+    if aggregate:
+        ranked = ranked.groupby(level=['buy_threshold', 'sell_threshold']).agg(
+            total_return=('total_return', 'mean'),
+            worst_return=('total_return', 'min'),
+            worst_excursion=('worst_excursion', 'min'),
+            trades=('trades', 'sum')
+        )
+    if max_excursion is not None:
+        ranked = ranked[ranked['worst_excursion'] >= -max_excursion]
+    return ranked.sort_values(['total_return', 'worst_excursion'], ascending=False)
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    prices = load_close_prices(['BTCUSDT', 'ETHUSDT'], interval='4h')
+    all_years = sorted({year for series in prices.values() for year in series.index.year.unique()})
+    results = scan(prices, years=all_years, workers=os.cpu_count() or 1)
+    print(rank_results(results, aggregate=True).head(20))
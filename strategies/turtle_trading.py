@@ -1,5 +1,7 @@
 import logging
 import backtrader as bt
+from risk_management.position_sizing import atr_unit_size
+from risk_management.stop_loss import StopBook, atr_stop, LONG, SHORT
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +53,13 @@ class TurtleStrategy(bt.Strategy):
         self.sys2_entry_price_long = 0
         self.sys2_entry_price_short = 0
         
+        # 每个持仓单位的止损，key 为 (系统, 单位序号)
+        self.stops = StopBook()
+        self.unit_sizes = {}
+        self.unit_seq = 0
+        # 未成交的加仓订单，key 为订单 ref，value 为 (系统, 方向)
+        self.pending_units = {}
+        
     def log(self, txt, dt=None):
         """记录日志"""
         dt = dt or self.datas[0].datetime.date(0)
@@ -58,7 +67,7 @@ class TurtleStrategy(bt.Strategy):
         
     def calculate_unit_size(self):
         """计算单位头寸大小"""
-        return (self.broker.getvalue() * self.p.risk_ratio) / self.atr[0]
+        return atr_unit_size(self.broker.getvalue(), self.atr[0], self.p.risk_ratio)
         
     def print_strategy_info(self):
         """打印策略基本信息"""
@@ -133,7 +142,7 @@ class TurtleStrategy(bt.Strategy):
             # 多头入场
             if self.data.close[0] > self.sys1_entry_high[-1]:
                 size = self.calculate_unit_size()
-                self.sys1_order = self.buy(size=size)
+                self.sys1_order = self.track_unit(self.buy(size=size), 'sys1', LONG)
                 self.sys1_entry_price_long = self.data.close[0]
                 self.sys1_units_long = 1
                 self.log(f'BUY CREATE {size:.2f} @ Price {self.data.close[0]:.2f}')
@@ -141,7 +150,7 @@ class TurtleStrategy(bt.Strategy):
             # 空头入场
             elif self.data.close[0] < self.sys1_entry_low[-1]:
                 size = self.calculate_unit_size()
-                self.sys1_order = self.sell(size=size)
+                self.sys1_order = self.track_unit(self.sell(size=size), 'sys1', SHORT)
                 self.sys1_entry_price_short = self.data.close[0]
                 self.sys1_units_short = 1
                 self.log(f'SELL CREATE {size:.2f} @ Price {self.data.close[0]:.2f}')
@@ -152,14 +161,14 @@ class TurtleStrategy(bt.Strategy):
             if (self.data.close[0] >= self.sys1_entry_price_long + self.atr[0] * self.p.unit_gap and 
                 self.sys1_units_long < self.p.units):
                 size = self.calculate_unit_size()
-                self.sys1_order = self.buy(size=size)
+                self.sys1_order = self.track_unit(self.buy(size=size), 'sys1', LONG)
                 self.sys1_entry_price_long = self.data.close[0]
                 self.sys1_units_long += 1
                 self.log(f'BUY ADD {size:.2f} @ Price {self.data.close[0]:.2f}')
                 
             # 退出
             elif self.data.close[0] < self.sys1_exit_low[-1]:
-                self.sys1_order = self.close()
+                self.sys1_order = self.close_system('sys1')
                 self.sys1_units_long = 0
                 self.log(f'LONG EXIT @ Price {self.data.close[0]:.2f}')
                 
@@ -169,14 +178,14 @@ class TurtleStrategy(bt.Strategy):
             if (self.data.close[0] <= self.sys1_entry_price_short - self.atr[0] * self.p.unit_gap and 
                 self.sys1_units_short < self.p.units):
                 size = self.calculate_unit_size()
-                self.sys1_order = self.sell(size=size)
+                self.sys1_order = self.track_unit(self.sell(size=size), 'sys1', SHORT)
                 self.sys1_entry_price_short = self.data.close[0]
                 self.sys1_units_short += 1
                 self.log(f'SELL ADD {size:.2f} @ Price {self.data.close[0]:.2f}')
                 
             # 退出
             elif self.data.close[0] > self.sys1_exit_high[-1]:
-                self.sys1_order = self.close()
+                self.sys1_order = self.close_system('sys1')
                 self.sys1_units_short = 0
                 self.log(f'SHORT EXIT @ Price {self.data.close[0]:.2f}')
                 
@@ -189,7 +198,7 @@ class TurtleStrategy(bt.Strategy):
             # 多头入场
             if self.data.close[0] > self.sys2_entry_high[-1]:
                 size = self.calculate_unit_size()
-                self.sys2_order = self.buy(size=size)
+                self.sys2_order = self.track_unit(self.buy(size=size), 'sys2', LONG)
                 self.sys2_entry_price_long = self.data.close[0]
                 self.sys2_units_long = 1
                 self.log(f'BUY CREATE {size:.2f} @ Price {self.data.close[0]:.2f}')
@@ -197,7 +206,7 @@ class TurtleStrategy(bt.Strategy):
             # 空头入场
             elif self.data.close[0] < self.sys2_entry_low[-1]:
                 size = self.calculate_unit_size()
-                self.sys2_order = self.sell(size=size)
+                self.sys2_order = self.track_unit(self.sell(size=size), 'sys2', SHORT)
                 self.sys2_entry_price_short = self.data.close[0]
                 self.sys2_units_short = 1
                 self.log(f'SELL CREATE {size:.2f} @ Price {self.data.close[0]:.2f}')
@@ -208,14 +217,14 @@ class TurtleStrategy(bt.Strategy):
             if (self.data.close[0] >= self.sys2_entry_price_long + self.atr[0] * self.p.unit_gap and 
                 self.sys2_units_long < self.p.units):
                 size = self.calculate_unit_size()
-                self.sys2_order = self.buy(size=size)
+                self.sys2_order = self.track_unit(self.buy(size=size), 'sys2', LONG)
                 self.sys2_entry_price_long = self.data.close[0]
                 self.sys2_units_long += 1
                 self.log(f'BUY ADD {size:.2f} @ Price {self.data.close[0]:.2f}')
                 
             # 退出
             elif self.data.close[0] < self.sys2_exit_low[-1]:
-                self.sys2_order = self.close()
+                self.sys2_order = self.close_system('sys2')
                 self.sys2_units_long = 0
                 self.log(f'LONG EXIT @ Price {self.data.close[0]:.2f}')
                 
@@ -225,14 +234,14 @@ class TurtleStrategy(bt.Strategy):
             if (self.data.close[0] <= self.sys2_entry_price_short - self.atr[0] * self.p.unit_gap and 
                 self.sys2_units_short < self.p.units):
                 size = self.calculate_unit_size()
-                self.sys2_order = self.sell(size=size)
+                self.sys2_order = self.track_unit(self.sell(size=size), 'sys2', SHORT)
                 self.sys2_entry_price_short = self.data.close[0]
                 self.sys2_units_short += 1
                 self.log(f'SELL ADD {size:.2f} @ Price {self.data.close[0]:.2f}')
                 
             # 退出
             elif self.data.close[0] > self.sys2_exit_high[-1]:
-                self.sys2_order = self.close()
+                self.sys2_order = self.close_system('sys2')
                 self.sys2_units_short = 0
                 self.log(f'SHORT EXIT @ Price {self.data.close[0]:.2f}')
                 
@@ -246,44 +255,66 @@ class TurtleStrategy(bt.Strategy):
                 self.log(f'BUY EXECUTED, Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Comm: {order.executed.comm:.2f}')
             else:
                 self.log(f'SELL EXECUTED, Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Comm: {order.executed.comm:.2f}')
+            # 加仓订单成交后才登记该单位的止损和头寸
+            unit = self.pending_units.pop(order.ref, None)
+            if unit is not None:
+                system, side = unit
+                self.add_unit_stop(system, side, abs(order.executed.size), order.executed.price)
                 
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             self.log('Order Canceled/Margin/Rejected')
+            # 未成交的单位不计入加仓次数
+            unit = self.pending_units.pop(order.ref, None)
+            if unit is not None:
+                system, side = unit
+                name = f'{system}_units_long' if side == LONG else f'{system}_units_short'
+                setattr(self, name, max(getattr(self, name) - 1, 0))
             
         self.sys1_order = None
         self.sys2_order = None
 
+    def track_unit(self, order, system, side):
+        """记录加仓订单所属的系统和方向，成交后在 notify_order 中登记止损"""
+        if order is not None:
+            self.pending_units[order.ref] = (system, side)
+        return order
+
+    def add_unit_stop(self, system, side, size, price):
+        """记录新成交单位的 2N 止损，同一系统已有单位的止损同步移到新单位的止损位"""
+        stop = atr_stop(price, self.atr[0], 2, side)
+        for key in self.stops.keys():
+            if key[0] == system:
+                self.stops.set_stop(key, stop)
+        self.unit_seq += 1
+        key = (system, self.unit_seq)
+        self.stops.add(key, side, stop)
+        self.unit_sizes[key] = side * size
+
+    def close_system(self, system):
+        """只平掉指定系统已成交的单位，并清除该系统的止损和头寸记录，另一系统不受影响"""
+        self.stops.clear(lambda key: key[0] == system)
+        keys = [key for key in self.unit_sizes if key[0] == system]
+        # unit_sizes 中多头为正、空头为负
+        size = sum(self.unit_sizes.pop(key) for key in keys)
+        if size > 0:
+            return self.sell(size=size)
+        if size < 0:
+            return self.buy(size=-size)
+        return None
+
     def check_stop_loss(self):
-        """检查止损条件"""
-        # 系统1的止损
-        if self.sys1_units_long > 0:
-            stop_price = self.sys1_entry_price_long - 2 * self.atr[0]
-            if self.data.close[0] < stop_price:
-                self.close()
-                self.sys1_units_long = 0
-                self.log(f'SYS1 STOP LOSS @ Price {self.data.close[0]:.2f}')
-                
-        elif self.sys1_units_short > 0:
-            stop_price = self.sys1_entry_price_short + 2 * self.atr[0]
-            if self.data.close[0] > stop_price:
-                self.close()
-                self.sys1_units_short = 0
-                self.log(f'SYS1 STOP LOSS @ Price {self.data.close[0]:.2f}')
-                
-        # 系统2的止损
-        if self.sys2_units_long > 0:
-            stop_price = self.sys2_entry_price_long - 2 * self.atr[0]
-            if self.data.close[0] < stop_price:
-                self.close()
-                self.sys2_units_long = 0
-                self.log(f'SYS2 STOP LOSS @ Price {self.data.close[0]:.2f}')
-                
-        elif self.sys2_units_short > 0:
-            stop_price = self.sys2_entry_price_short + 2 * self.atr[0]
-            if self.data.close[0] > stop_price:
-                self.close()
-                self.sys2_units_short = 0
-                self.log(f'SYS2 STOP LOSS @ Price {self.data.close[0]:.2f}')
+        """检查止损条件，只平掉触发止损的系统的头寸"""
+        hits = self.stops.update(self.data.close[0])
+        for system in sorted({key[0] for key in hits}):
+            # unit_sizes 中多头为正、空头为负
+            size = sum(self.unit_sizes.pop(key) for key in hits if key[0] == system)
+            if size > 0:
+                self.sell(size=size)
+                setattr(self, f'{system}_units_long', 0)
+            else:
+                self.buy(size=-size)
+                setattr(self, f'{system}_units_short', 0)
+            self.log(f'{system.upper()} STOP LOSS {abs(size):.2f} @ Price {self.data.close[0]:.2f}')
 
     def allocate_capital(self, system_type):
         """计算每个系统可用的资金"""
@@ -295,20 +326,10 @@ class TurtleStrategy(bt.Strategy):
 
     def calculate_position_size(self, system_type):
         """计算头寸规模"""
-        # 获取系统可用资金
-        available_capital = self.allocate_capital(system_type)
-        
-        # 计算每N的美元价值
-        dollar_volatility = self.atr[0]
-        
-        # 计算单位头寸规模
-        position_size = (available_capital * self.p.risk_ratio) / dollar_volatility
-        
-        # 考虑最小交易单位
+        # 按系统可用资金和每N的美元价值计算，并考虑最小交易单位
         min_trade_unit = 0.001  # BTC最小交易单位
-        position_size = round(position_size / min_trade_unit) * min_trade_unit
-        
-        return position_size
+        return atr_unit_size(self.allocate_capital(system_type), self.atr[0], self.p.risk_ratio,
+                             lot_size=min_trade_unit)
 
     def print_final_stats(self):
         """打印最终的策略性能统计"""
@@ -1,7 +1,6 @@
 import logging
 import os
 import asyncio
-from time import sleep
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -15,25 +14,37 @@ from models.price_prediction import calculate_ahr999, get_current_price
 from models.investment_advice import get_investment_advice
 from binance_api.market_data import get_top_crypto_data, format_crypto_data
 from binance_api import trading_api, init_trading_api
-from binance_api.order_management import OrderManagement
+from binance_api.client_manager import client_manager
+from binance_api.execution import ExecutionEngine
+from binance_api.order_book import order_books
+from binance_api.ticker_book import ticker_book
+from binance_api.user_stream import user_stream
+from risk_management.risk_monitor import risk_monitor
+from utils.logging_setup import setup_logging
+from utils.update_dispatcher import UpdateDispatcher
+from utils.webhook_server import WebhookServer
+from data_storage.state_store import create_state_store
+from data_storage.trade_history import trade_ledger
 
 # 设置你的bot token
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 AUTHORIZED_USER_ID = int(os.getenv('AUTHORIZED_USER_ID'))
 
+# 运行模式：polling（默认）或 webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')          # 公网地址，例如 https://example.com
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+
 # 设置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
-class Context:
-    def __init__(self):
-        self.user_data = {}
-
-context = Context()
+# 每个用户的下单流程状态
+state_store = create_state_store()
 
 TOP_CRYPTOS = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'XRPUSDT', 'ADAUSDT', 
                 'DOGEUSDT', 'SOLUSDT', 'TRXUSDT', 'DOTUSDT', 'SHIBUSDT',
@@ -43,6 +54,16 @@ AMOUNT_OPTIONS = [5, 50, 100, 500, 1000]  # USDT 金额选项
 # 从环境变量中获取验证码
 CONFIRMATION_CODE = os.getenv('CONFIRMATION_CODE')
 ORDER_TYPES = ['Market', 'Limit']
+# 达到该金额（USDT）的市价单可选择拆单执行（TWAP/冰山）
+LARGE_ORDER_THRESHOLD = 500
+# 订单历史显示的最近订单数
+ORDER_HISTORY_LIMIT = 20
+
+# 更新分发设置
+MAX_CONCURRENT_UPDATES = 8      # 同时处理的更新数
+MAX_PENDING_UPDATES = 100       # 排队更新上限，超过后暂停拉取
+UPDATE_TIMEOUT = 60             # 单个更新的处理超时（秒）
+MAX_NETWORK_BACKOFF = 30        # 网络错误重试的最长等待（秒）
 
 def is_authorized(user_id):
     return user_id == AUTHORIZED_USER_ID
@@ -54,6 +75,7 @@ def get_main_menu_keyboard():
         [InlineKeyboardButton("Place Order", callback_data='place_order')],
         [InlineKeyboardButton("Order Status", callback_data='order_status')],
         [InlineKeyboardButton("Order History", callback_data='order_history')],
+        [InlineKeyboardButton("PnL & Fees", callback_data='pnl_fees')],
         [InlineKeyboardButton("Help", callback_data='help')],
         [InlineKeyboardButton("Return to Main Menu", callback_data='main_menu')]
     ]
@@ -71,13 +93,13 @@ async def start(bot, update):
 async def button_callback(bot, update):
     try:
         query = update.callback_query
-        logger.info("="*50)
-        logger.info(f"[button_callback] Starting with data: {query.data}")
-        logger.info(f"[button_callback] User ID: {query.from_user.id}")
-        logger.info(f"[button_callback] Current context: {context.user_data}")
+        logger.debug("="*50)
+        logger.debug("[button_callback] Starting with data: %s", query.data)
+        logger.debug("[button_callback] User ID: %s", query.from_user.id)
+        logger.debug("[button_callback] Current user data: %s", await state_store.get(query.from_user.id))
         
         if query.data == 'place_order':
-            logger.info("[button_callback] Detected place_order command")
+            logger.debug("[button_callback] Detected place_order command")
             await show_order_menu(bot, query)
     except Exception as e:
         logger.error(f"Error in button_callback: {str(e)}")
@@ -152,18 +174,13 @@ async def show_market_price(bot, query):
 
 async def show_order_menu(bot, query):
     user_id = query.from_user.id
-    logger.info("="*50)
-    logger.info(f"[show_order_menu] Starting for user {user_id}")
-    logger.info(f"[show_order_menu] Context data before: {context.user_data}")
-    logger.info(f"[show_order_menu] User state before: {context.user_data.get(user_id, {}).get('state')}")
+    logger.debug("="*50)
+    logger.debug("[show_order_menu] Starting for user %s", user_id)
+    logger.debug("[show_order_menu] User data before: %s", await state_store.get(user_id))
     
-    if user_id not in context.user_data:
-        logger.info(f"[show_order_menu] Creating new user data for {user_id}")
-        context.user_data[user_id] = {}
-    context.user_data[user_id]['state'] = 'waiting_for_confirmation_code'
+    await state_store.update(user_id, state='waiting_for_confirmation_code')
     
-    logger.info(f"[show_order_menu] Context data after: {context.user_data}")
-    logger.info(f"[show_order_menu] User state after: {context.user_data[user_id]['state']}")
+    logger.debug("[show_order_menu] User data after: %s", await state_store.get(user_id))
     
     if not is_authorized(query.from_user.id):
         await bot.answer_callback_query(query.id, text="You are not authorized to place orders.")
@@ -177,22 +194,21 @@ async def show_order_menu(bot, query):
 
 async def handle_confirmation_code(bot, message):
     user_id = message.from_user.id
-    logger.info("="*50)
-    logger.info(f"[handle_confirmation_code] Starting for user {user_id}")
-    logger.info(f"[handle_confirmation_code] Input code: {message.text}")
-    logger.info(f"[handle_confirmation_code] Context data: {context.user_data}")
-    logger.info(f"[handle_confirmation_code] User state: {context.user_data.get(user_id, {}).get('state')}")
-    logger.info(f"Input code: {message.text}, Expected code: {CONFIRMATION_CODE}")
-    logger.info(f"User state before handling: {context.user_data.get(user_id, {}).get('state')}")
-    logger.info(f"Full context data: {context.user_data}")
+    logger.debug("="*50)
+    logger.debug("[handle_confirmation_code] Starting for user %s", user_id)
+    # 不记录用户输入的验证码，只记录是否匹配
+    logger.debug("[handle_confirmation_code] Confirmation code received")
     
     # 检查用户状态是否正确
-    current_state = context.user_data.get(user_id, {}).get('state')
+    current_state = (await state_store.get(user_id)).get('state')
+    logger.debug("[handle_confirmation_code] User state: %s", current_state)
     if current_state != 'waiting_for_confirmation_code':
-        logger.info(f"Unexpected state: {current_state}, expected: waiting_for_confirmation_code")
+        logger.debug("Unexpected state: %s, expected: waiting_for_confirmation_code", current_state)
         return
     
-    if message.text == CONFIRMATION_CODE:
+    code_matched = message.text == CONFIRMATION_CODE
+    logger.debug("[handle_confirmation_code] Confirmation code matched: %s", code_matched)
+    if code_matched:
         keyboard = [
             [InlineKeyboardButton(f"{order_type} Order", callback_data=f'order_type_{order_type}') for order_type in ORDER_TYPES]
         ]
@@ -202,8 +218,8 @@ async def handle_confirmation_code(bot, message):
             text="Confirmation code correct. Please select order type:",
             reply_markup=reply_markup
         )
-        context.user_data[user_id]['state'] = 'selecting_order_type'
-        logger.info(f"State updated to: {context.user_data[user_id]['state']}")
+        await state_store.update(user_id, state='selecting_order_type')
+        logger.debug("State updated to: selecting_order_type")
     else:
         await bot.send_message(
             chat_id=message.chat_id,
@@ -211,16 +227,13 @@ async def handle_confirmation_code(bot, message):
             reply_markup=get_main_menu_keyboard()
         )
         # 只清除状态，不清除整个用户数据
-        context.user_data[user_id]['state'] = None
+        await state_store.update(user_id, state=None)
 
 async def handle_order_type_selection(bot, query):
     try:
         user_id = query.from_user.id
-        if user_id not in context.user_data:
-            context.user_data[user_id] = {}
-            
         order_type = query.data.split('_')[2]
-        context.user_data[user_id]['order_type'] = order_type
+        await state_store.update(user_id, order_type=order_type)
         
         # 创建一个包含所有选项的键盘
         keyboard = []
@@ -249,18 +262,11 @@ async def handle_order_type_selection(bot, query):
 async def handle_order_selection(bot, query):
     try:
         parts = query.data.split('_')
-        logger.info(f"Order selection parts: {parts}")
+        logger.debug("Order selection parts: %s", parts)
         
-        # 添加状态检查
-        # if "order_type not in context.user_data:
-        #    logger.error("Order type not found in context")
-        #    await show_order_menu(bot, query)
-        #    return
-            
         if len(parts) >= 3:
             _, symbol, side = parts
-            context.user_data['symbol'] = symbol
-            context.user_data['side'] = side
+            await state_store.update(query.from_user.id, symbol=symbol, side=side)
             
             # 创建一个包含金额选项的键盘
             keyboard = [[InlineKeyboardButton(f"{amount} USDT", callback_data=f'amount_{amount}')] for amount in AMOUNT_OPTIONS]
@@ -291,55 +297,43 @@ async def handle_order_selection(bot, query):
 async def handle_amount_selection(bot, query):
     try:
         user_id = query.from_user.id
-        logger.info("="*50)
-        logger.info(f"[handle_amount_selection] Starting for user {user_id}")
-        logger.info(f"[handle_amount_selection] Raw query data: {query.data}")
-        logger.info(f"[handle_amount_selection] Split result: {query.data.split('_')}")
-        logger.info(f"[handle_amount_selection] Current context before: {context.user_data}")
-        logger.info(f"[handle_amount_selection] User state before: {context.user_data.get(user_id, {}).get('state')}")
-        logger.info(f"[handle_amount_selection] Order type before: {context.user_data.get(user_id, {}).get('order_type')}")
-        logger.info(f"[handle_amount_selection] Symbol before: {context.user_data.get(user_id, {}).get('symbol')}")
-        logger.info(f"[handle_amount_selection] Side before: {context.user_data.get(user_id, {}).get('side')}")
-        
-        # 确保用户数据存在
-        if user_id not in context.user_data:
-            logger.info(f"[handle_amount_selection] Creating new user data for {user_id}")
-            context.user_data[user_id] = {}
+        logger.debug("="*50)
+        logger.debug("[handle_amount_selection] Starting for user %s", user_id)
+        logger.debug("[handle_amount_selection] Raw query data: %s", query.data)
+        logger.debug("[handle_amount_selection] Split result: %s", query.data.split('_'))
+        logger.debug("[handle_amount_selection] User data before: %s", await state_store.get(user_id))
         
         # 获取金额
         amount = float(query.data.split('_')[1])
-        logger.info(f"[handle_amount_selection] Parsed amount: {amount}")
+        logger.debug("[handle_amount_selection] Parsed amount: %s", amount)
         
         # 存储金额
-        context.user_data[user_id]['amount'] = amount
-        logger.info(f"[handle_amount_selection] Stored amount in context: {context.user_data[user_id]}")
-        logger.info(f"[handle_amount_selection] Full context after storing amount: {context.user_data}")
+        await state_store.update(user_id, amount=amount)
+        user_data = await state_store.get(user_id)
+        logger.debug("[handle_amount_selection] User data after storing amount: %s", user_data)
         
         # 获取订单类型
-        order_type = context.user_data[user_id].get('order_type')
-        logger.info(f"[handle_amount_selection] Retrieved order_type: {order_type}")
+        order_type = user_data.get('order_type')
+        logger.debug("[handle_amount_selection] Retrieved order_type: %s", order_type)
         
         if order_type == 'Limit':
-            logger.info("[handle_amount_selection] Processing limit order")
+            logger.debug("[handle_amount_selection] Processing limit order")
             await bot.edit_message_text(
                 chat_id=query.message.chat_id,
                 message_id=query.message.message_id,
                 text="Please enter the limit price:"
             )
-            context.user_data[user_id]['state'] = 'waiting_for_limit_price'
-            logger.info(f"[handle_amount_selection] Updated state: {context.user_data[user_id]['state']}")
-            logger.info(f"[handle_amount_selection] Final context for limit order: {context.user_data}")
+            await state_store.update(user_id, state='waiting_for_limit_price')
+            logger.debug("[handle_amount_selection] Updated state: waiting_for_limit_price")
         else:
-            logger.info("[handle_amount_selection] Processing market order")
-            logger.info(f"[handle_amount_selection] Context before show_order_confirmation: {context.user_data}")
+            logger.debug("[handle_amount_selection] Processing market order")
             await show_order_confirmation(bot, query)
             
     except Exception as e:
         logger.error(f"[handle_amount_selection] Error: {str(e)}")
         logger.error("[handle_amount_selection] Full error details:", exc_info=True)
-        logger.error(f"[handle_amount_selection] Context data at error: {context.user_data}")
         logger.error(f"[handle_amount_selection] Query data at error: {query.data}")
-        logger.error(f"[handle_amount_selection] User data at error: {context.user_data.get(user_id, {})}")
+        logger.error(f"[handle_amount_selection] User data at error: {await state_store.get(query.from_user.id)}")
         await bot.send_message(
             chat_id=query.message.chat_id,
             text="An error occurred while processing your selection. Please try again.",
@@ -349,7 +343,7 @@ async def handle_amount_selection(bot, query):
 async def handle_limit_price_input(bot, message):
     try:
         price = float(message.text)
-        context.user_data['price'] = price
+        await state_store.update(message.from_user.id, price=price, state='waiting_for_order_confirmation')
         await show_order_confirmation(bot, message)
     except ValueError:
         await bot.send_message(
@@ -358,10 +352,11 @@ async def handle_limit_price_input(bot, message):
         )
 
 async def show_order_confirmation(bot, update):
-    symbol = context.user_data['symbol']
-    side = context.user_data['side']
-    amount = context.user_data['amount']
-    order_type = context.user_data['order_type']
+    user_data = await state_store.get(update.from_user.id)
+    symbol = user_data['symbol']
+    side = user_data['side']
+    amount = user_data['amount']
+    order_type = user_data['order_type']
     
     confirmation_text = (
         f"Order Summary:\n"
@@ -372,8 +367,18 @@ async def show_order_confirmation(bot, update):
     )
     
     if order_type == 'Limit':
-        price = context.user_data['price']
+        price = user_data['price']
         confirmation_text += f"Price: {price}\n"
+    else:
+        # 用本地订单簿估算成交均价和滑点，不需要额外请求
+        estimate = order_books.estimate_fill(symbol, side, float(amount))
+        if estimate:
+            confirmation_text += (
+                f"Expected avg price: {format_number(estimate['vwap'], 8)}\n"
+                f"Expected slippage: {estimate['slippage_pct']:.3f}% ({estimate['levels']} levels)\n"
+            )
+            if not estimate['complete']:
+                confirmation_text += "Warning: visible order book depth is not enough for this amount\n"
     
     confirmation_text += "\nDo you confirm this order?"
     
@@ -381,6 +386,12 @@ async def show_order_confirmation(bot, update):
         [InlineKeyboardButton("Confirm", callback_data='confirm_order')],
         [InlineKeyboardButton("Cancel", callback_data='cancel_order')]
     ]
+    if order_type == 'Market' and amount >= LARGE_ORDER_THRESHOLD:
+        # 大额市价单可以拆成多笔子单执行，降低冲击成本
+        keyboard.insert(1, [
+            InlineKeyboardButton("Confirm (TWAP)", callback_data='confirm_order_twap'),
+            InlineKeyboardButton("Confirm (Iceberg)", callback_data='confirm_order_iceberg')
+        ])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     if isinstance(update, CallbackQuery):
@@ -397,26 +408,79 @@ async def show_order_confirmation(bot, update):
             reply_markup=reply_markup
         )
 
+def format_execution_progress(job):
+    """格式化拆单执行进度"""
+    text = (
+        f"{job.strategy} {job.side} {job.symbol}: {job.status}\n\n"
+        f"Filled: {format_number(job.filled_quote)} / {format_number(job.amount)} USDT ({job.progress:.1f}%)\n"
+        f"Child orders: {len(job.children)}"
+    )
+    if job.failed_children:
+        text += f" ({job.failed_children} failed)"
+    if job.avg_price:
+        text += f"\nAverage price: {format_number(job.avg_price, 8)}"
+    return text
+
+async def start_split_execution(bot, query, strategy, symbol, side, amount):
+    """在后台启动拆单执行，进度实时更新到当前消息"""
+    chat_id = query.message.chat_id
+    message_id = query.message.message_id
+
+    async def report(job):
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=format_execution_progress(job),
+                reply_markup=None if job.status == 'running' else get_main_menu_keyboard()
+            )
+        except Exception as e:
+            # 进度没有变化时 Telegram 会拒绝编辑，忽略即可
+            logger.debug("Could not update execution progress: %s", e)
+
+    if strategy == 'twap':
+        job = execution_engine.start_twap(symbol, side, amount, on_progress=report)
+    else:
+        job = execution_engine.start_iceberg(symbol, side, amount, on_progress=report)
+    await report(job)
+
 async def handle_order_confirmation(bot, query):
-    if query.data == 'confirm_order':
+    user_id = query.from_user.id
+    if query.data in ('confirm_order_twap', 'confirm_order_iceberg'):
+        try:
+            user_data = await state_store.get(user_id)
+            strategy = query.data.rsplit('_', 1)[1]
+            logger.info(f"Starting {strategy} execution: symbol={user_data['symbol']}, side={user_data['side']}, amount={user_data['amount']}")
+            await start_split_execution(bot, query, strategy, user_data['symbol'], user_data['side'], user_data['amount'])
+        except Exception as e:
+            logger.error(f"Error starting split execution: {str(e)}")
+            await bot.edit_message_text(
+                chat_id=query.message.chat_id,
+                message_id=query.message.message_id,
+                text=f"An error occurred while placing the order: {str(e)}",
+                reply_markup=get_main_menu_keyboard()
+            )
+    elif query.data == 'confirm_order':
         try:
-            symbol = context.user_data['symbol']
-            side = context.user_data['side']
-            amount = context.user_data['amount']
-            order_type = context.user_data['order_type']
+            user_data = await state_store.get(user_id)
+            symbol = user_data['symbol']
+            side = user_data['side']
+            amount = user_data['amount']
+            order_type = user_data['order_type']
             
             logger.info(f"Attempting to place order: symbol={symbol}, side={side}, amount={amount}, type={order_type}")
             
             if order_type == 'Market':
-                logger.info("Placing market order")
+                logger.debug("Placing market order")
                 order = await trading_api.place_market_order(symbol, side, amount)
             else:  # Limit
-                price = context.user_data['price']
-                logger.info(f"Placing limit order with price: {price}")
+                price = user_data['price']
+                logger.debug("Placing limit order with price: %s", price)
                 order = await trading_api.place_limit_order(symbol, side, amount, price)
             
             if order:
-                logger.info(f"Order placed successfully: {order}")
+                logger.info(f"Order placed successfully: {symbol} {side} orderId={order['orderId']}")
+                logger.debug("Order response: %s", order)
                 await bot.edit_message_text(
                     chat_id=query.message.chat_id,
                     message_id=query.message.message_id,
@@ -448,12 +512,15 @@ async def handle_order_confirmation(bot, query):
             reply_markup=get_main_menu_keyboard()
         )
     
-    context.user_data.clear()
+    state_store.clear(user_id)
 
 async def show_order_status(bot, query):
     try:
-        # 使用 trading_api 实例调用 get_open_orders 方法
-        orders = await trading_api.get_open_orders()
+        # 用户数据流已同步时直接读取本地订单簿，否则回退到 REST 接口
+        if user_stream.ready:
+            orders = user_stream.get_open_orders()
+        else:
+            orders = await trading_api.get_open_orders()
         
         if not orders:
             await bot.send_message(
@@ -494,7 +561,8 @@ async def show_help(bot, query):
         "- Current Market Price: Check current prices for top 10 cryptocurrencies\n"
         "- Place Order: Place a new order (requires confirmation code)\n"
         "- Order Status: (Coming soon) Check your order status\n"
-        "- Order History: (Coming soon) Check your order history\n"
+        "- Order History: Check your recent orders from the local ledger\n"
+        "- PnL & Fees: Realized/unrealized PnL and fees from the local ledger\n"
         "- Help: Show this help message"
     )
     await bot.send_message(
@@ -504,31 +572,33 @@ async def show_help(bot, query):
     )
 
 async def show_order_history(bot, query):
+    """从本地账本读取最近的订单，不请求交易所接口"""
     try:
-        orders_by_symbol = await order_manager.get_order_history()
+        orders = await asyncio.to_thread(trade_ledger.get_order_history, limit=ORDER_HISTORY_LIMIT)
         
-        if not orders_by_symbol:
+        if not orders:
             await bot.send_message(
                 chat_id=query.message.chat_id,
-                text="No order history found in the last 24 hours.",
+                text="No orders recorded in the local ledger yet.",
                 reply_markup=get_main_menu_keyboard()
             )
             return
 
-        message = "Your order history (last 24 hours):\n\n"
+        message = f"Your order history (latest {len(orders)} orders):\n\n"
         
-        # 使用 TOP_CRYPTOS 替代 COMMON_SYMBOLS
-        for symbol in TOP_CRYPTOS:
-            if symbol in orders_by_symbol and orders_by_symbol[symbol]:
-                message += f"=== {symbol} ===\n"
-                for order in orders_by_symbol[symbol]:
-                    message += f"Order ID: {order['orderId']}\n"
-                    message += f"Type: {order['type']}\n"
-                    message += f"Side: {order['side']}\n"
-                    message += f"Price: {order['price']}\n"
-                    message += f"Amount: {order['origQty']}\n"
-                    message += f"Status: {order['status']}\n"
-                    message += f"Time: {datetime.fromtimestamp(order['time']/1000).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        orders_by_symbol = {}
+        for order in orders:
+            orders_by_symbol.setdefault(order['symbol'], []).append(order)
+        for symbol, symbol_orders in orders_by_symbol.items():
+            message += f"=== {symbol} ===\n"
+            for order in symbol_orders:
+                message += f"Order ID: {order['orderId']}\n"
+                message += f"Type: {order['type']}\n"
+                message += f"Side: {order['side']}\n"
+                message += f"Price: {order['price']}\n"
+                message += f"Amount: {order['origQty']}\n"
+                message += f"Status: {order['status']}\n"
+                message += f"Time: {datetime.fromtimestamp(order['time']/1000).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
 
         # 如果消息太长,分段发送
         if len(message) > 4096:
@@ -552,6 +622,49 @@ async def show_order_history(bot, query):
             reply_markup=get_main_menu_keyboard()
         )
 
+async def show_pnl_and_fees(bot, query):
+    """从本地账本计算各交易对的盈亏和手续费，未实现盈亏使用本地行情表的最新价"""
+    try:
+        pnl = await asyncio.to_thread(trade_ledger.get_pnl)
+        fees = await asyncio.to_thread(trade_ledger.get_fees)
+        
+        if not pnl:
+            await bot.send_message(
+                chat_id=query.message.chat_id,
+                text="No fills recorded in the local ledger yet.",
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+
+        message = "PnL from the local ledger:\n\n"
+        for symbol, stats in pnl.items():
+            price = ticker_book.get_price(symbol)
+            message += f"=== {symbol} ===\n"
+            message += f"Position: {format_number(stats['position'], 6)}\n"
+            message += f"Avg Cost: {format_number(stats['avg_cost'], 4)}\n"
+            message += f"Realized PnL: {format_number(stats['realized_pnl'], 4)} USDT\n"
+            if price is not None and stats['position'] > 0:
+                unrealized = (price - stats['avg_cost']) * stats['position']
+                message += f"Unrealized PnL: {format_number(unrealized, 4)} USDT\n"
+            message += f"Volume: {format_number(stats['volume'])} USDT\n\n"
+
+        message += "Fees:\n"
+        for asset, total in fees.items():
+            message += f"{asset or 'Unknown'}: {format_number(total, 8)}\n"
+
+        await bot.send_message(
+            chat_id=query.message.chat_id,
+            text=message[:4096],
+            reply_markup=get_main_menu_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Error in show_pnl_and_fees: {str(e)}")
+        await bot.send_message(
+            chat_id=query.message.chat_id,
+            text="An error occurred while calculating PnL. Please try again later.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
 async def show_main_menu(bot, query):
     """显示主菜单"""
     try:
@@ -578,6 +691,7 @@ class CallbackHandler:
         self.handlers = {
             'place_order': show_order_menu,
             'order_history': show_order_history,
+            'pnl_fees': show_pnl_and_fees,
             'calculate_ahr999': calculate_ahr999_index,
             'market_price': show_market_price,
             'order_status': show_order_status,
@@ -599,41 +713,42 @@ callback_handler = CallbackHandler()
 async def process_update(bot, update):
     try:
         user_id = update.effective_user.id
-        logger.info("="*50)
-        logger.info(f"[process_update] Processing update for user {user_id}")
-        logger.info(f"[process_update] Update type: {type(update)}")
+        logger.debug("="*50)
+        logger.debug("[process_update] Processing update for user %s", user_id)
+        logger.debug("[process_update] Update type: %s", type(update))
         
         # 处理消息更新
         if update.message:
-            logger.info(f"[process_update] Received message: {update.message.text}")
-            logger.info(f"[process_update] Message type: {type(update.message)}")
+            # 消息内容可能是验证码，不写入日志
+            logger.debug("[process_update] Received message (%d chars)", len(update.message.text or ''))
+            logger.debug("[process_update] Message type: %s", type(update.message))
             
             # 检查是否是 /start 命令
             if update.message.text == '/start':
-                logger.info("[process_update] Processing /start command")
+                logger.debug("[process_update] Processing /start command")
                 await start(bot, update)
                 return
             
             # 检查用户状态
-            current_state = context.user_data.get(user_id, {}).get('state')
-            logger.info(f"[process_update] Current state: {current_state}")
+            current_state = (await state_store.get(user_id)).get('state')
+            logger.debug("[process_update] Current state: %s", current_state)
             
             if current_state == 'waiting_for_confirmation_code':
-                logger.info("[process_update] Processing confirmation code")
+                logger.debug("[process_update] Processing confirmation code")
                 await handle_confirmation_code(bot, update.message)
             elif current_state == 'waiting_for_limit_price':
-                logger.info("[process_update] Processing limit price input")
+                logger.debug("[process_update] Processing limit price input")
                 await handle_limit_price_input(bot, update.message)
             else:
                 # 如果没有特定状态，显示主菜单
-                logger.info("[process_update] No specific state, showing main menu")
+                logger.debug("[process_update] No specific state, showing main menu")
                 await start(bot, update)
             return
             
         # 处理回调查询（按钮点击）
         if update.callback_query:
             query = update.callback_query
-            logger.info(f"[process_update] Callback query data: {query.data}")
+            logger.debug("[process_update] Callback query data: %s", query.data)
             
             # 使用回调处理器处理基本命令
             if await callback_handler.handle(bot, query):
@@ -648,7 +763,7 @@ async def process_update(bot, update):
                     await handle_amount_selection(bot, query)
                 elif len(parts) == 3 and parts[0] == 'order':
                     await handle_order_selection(bot, query)
-                elif query.data in ['confirm_order', 'cancel_order']:
+                elif query.data in ['confirm_order', 'cancel_order', 'confirm_order_twap', 'confirm_order_iceberg']:
                     await handle_order_confirmation(bot, query)
             
     except Exception as e:
@@ -676,7 +791,24 @@ async def send_market_price_update(bot):
         )
     except Exception as e:
         logger.error(f"Error in scheduled market price update: {str(e)}")
-        logger.error(f"Formatted data: {formatted_data}")  # 添加这行来录格化后的数据
+
+async def send_fill_notification(bot, fill):
+    """订单成交时推送通知"""
+    status = "filled" if fill['status'] == 'FILLED' else "partially filled"
+    message = (
+        f"Order {fill['order_id']} {status}\n\n"
+        f"Symbol: {fill['symbol']}\n"
+        f"Side: {fill['side']}\n"
+        f"Price: {format_number(fill['price'], 8)}\n"
+        f"Quantity: {format_number(fill['qty'], 8)}\n"
+        f"Executed: {format_number(fill['executed_qty'], 8)} / {format_number(fill['orig_qty'], 8)}\n"
+        f"Fee: {format_number(fill['commission'], 8)} {fill['commission_asset'] or ''}"
+    )
+    await bot.send_message(chat_id=AUTHORIZED_USER_ID, text=message)
+
+async def send_risk_alert(bot, message):
+    """风险监控超限时推送告警"""
+    await bot.send_message(chat_id=AUTHORIZED_USER_ID, text=f"Risk alert\n\n{message}")
 
 async def schedule_market_updates(bot):
     while True:
@@ -688,11 +820,22 @@ async def schedule_market_updates(bot):
 
 async def main():
     await init_trading_api()
+    await ticker_book.start(TOP_CRYPTOS)
+    await order_books.start(TOP_CRYPTOS)
+    await state_store.start()
     bot = Bot(TOKEN)
+    user_stream.add_fill_listener(lambda fill: send_fill_notification(bot, fill))
+    await risk_monitor.start(TOP_CRYPTOS, on_alert=lambda message: send_risk_alert(bot, message))
+    await user_stream.start(trading_api.client)
     logger.info("Starting bot")
     
+    dispatcher = create_dispatcher(bot)
+    
     # 创建并运行两个任务
-    update_task = asyncio.create_task(run_main_loop(bot))
+    if BOT_MODE == 'webhook':
+        update_task = asyncio.create_task(run_webhook(bot, dispatcher))
+    else:
+        update_task = asyncio.create_task(run_main_loop(bot, dispatcher))
     market_update_task = asyncio.create_task(schedule_market_updates(bot))
     
     try:
@@ -705,22 +848,69 @@ async def main():
         update_task.cancel()
         market_update_task.cancel()
         await asyncio.gather(update_task, market_update_task, return_exceptions=True)
+        await dispatcher.close(timeout=UPDATE_TIMEOUT)
+        await execution_engine.close()
+        await state_store.close()
+        await trade_ledger.close()
+        await risk_monitor.stop()
+        await user_stream.stop()
+        await ticker_book.stop()
+        await order_books.stop()
+        await trading_api.close()
+        await client_manager.close()
+
+def get_update_key(update):
+    """同一个聊天的更新按顺序处理"""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+def create_dispatcher(bot):
+    return UpdateDispatcher(
+        handler=lambda update: process_update(bot, update),
+        key_func=get_update_key,
+        max_concurrency=MAX_CONCURRENT_UPDATES,
+        max_pending=MAX_PENDING_UPDATES,
+        timeout=UPDATE_TIMEOUT
+    )
+
+async def run_webhook(bot, dispatcher):
+    """webhook 模式：本地 HTTP 服务接收更新，交给与轮询相同的分发器"""
+    server = WebhookServer(
+        bot, dispatcher, WEBHOOK_SECRET,
+        host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH
+    )
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+            logger.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        # 服务在后台运行，直到任务被取消
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
 
-async def run_main_loop(bot):
+async def run_main_loop(bot, dispatcher):
     offset = 0
+    backoff = 1
     while True:
         try:
             updates = await bot.get_updates(offset=offset, timeout=30)
+            backoff = 1
             for update in updates:
                 offset = update.update_id + 1
-                await process_update(bot, update)
-        except NetworkError:
-            sleep(1)
+                await dispatcher.submit(update)
+        except NetworkError as e:
+            logger.warning(f"Network error while polling: {str(e)}, retrying in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_NETWORK_BACKOFF)
         except Exception as e:
             logger.error(f"An error occurred: {str(e)}")
-            sleep(1)
+            await asyncio.sleep(1)
 
-order_manager = OrderManagement(api_key=os.getenv('BINANCE_API_KEY'), api_secret=os.getenv('BINANCE_SECRET_KEY'))
+execution_engine = ExecutionEngine(trading_api)
 
 def run_bot():
     """启动机器人的函数"""
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+# 添加项目根目录到 Python 路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from data_storage.state_store import MemoryStateStore, SQLiteStateStore
+
+class MemoryStateStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_clear_then_get(self):
+        store = MemoryStateStore()
+        await store.update(1, state='waiting_for_limit_price', symbol='BTCUSDT')
+        store.clear(1)
+        self.assertEqual(await store.get(1), {})
+
+    async def test_lru_eviction(self):
+        store = MemoryStateStore(max_users=2)
+        for user_id in range(3):
+            await store.update(user_id, state='selecting_order_type')
+        self.assertEqual(await store.get(0), {})
+        self.assertEqual(await store.get(2), {'state': 'selecting_order_type'})
+
+class SQLiteStateStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'state.db')
+        self.store = SQLiteStateStore(self.path, flush_interval=3600)
+        await self.store.start()
+
+    async def asyncTearDown(self):
+        await self.store.close()
+        self.tmpdir.cleanup()
+
+    async def test_clear_then_get_after_flush(self):
+        await self.store.update(1, state='waiting_for_limit_price', symbol='BTCUSDT')
+        await self.store.flush()
+        self.store.clear(1)
+        self.assertEqual(await self.store.get(1), {})
+        await self.store.flush()
+        self.assertEqual(await self.store.get(1), {})
+        self.assertIsNone(self.store._read(1))
+
+    async def test_clear_then_get_while_delete_in_flight(self):
+        await self.store.update(1, state='waiting_for_limit_price')
+        await self.store.flush()
+        self.store.clear(1)
+        flush = asyncio.create_task(self.store.flush())
+        await asyncio.sleep(0)
+        # 删除正在线程中写入时，缓存中的删除标记也不能被数据库中的旧记录覆盖
+        self.store._entries.pop(1, None)
+        self.assertEqual(await self.store.get(1), {})
+        await flush
+        self.assertEqual(await self.store.get(1), {})
+
+    async def test_evicted_state_written_and_reloaded(self):
+        self.store.max_users = 1
+        await self.store.update(1, state='waiting_for_confirmation_code')
+        await self.store.update(2, state='selecting_order_type')
+        self.assertNotIn(1, self.store._entries)
+        # 淘汰后、写入前仍能读到
+        self.assertEqual(await self.store.get(1), {'state': 'waiting_for_confirmation_code'})
+        await self.store.flush()
+        self.store._entries.clear()
+        self.assertEqual(await self.store.get(2), {'state': 'selecting_order_type'})
+
+    async def test_state_survives_restart(self):
+        await self.store.update(1, state='waiting_for_order_confirmation', price=50000.0)
+        await self.store.close()
+        self.store = SQLiteStateStore(self.path, flush_interval=3600)
+        await self.store.start()
+        self.assertEqual(await self.store.get(1), {'state': 'waiting_for_order_confirmation', 'price': 50000.0})
+
+if __name__ == '__main__':
+    unittest.main()
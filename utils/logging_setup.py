@@ -0,0 +1,60 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+def setup_logging(level=None, log_file=None):
+    """
+    配置根日志记录器
+
+    日志记录只把 LogRecord 放进内存队列，格式化和写入终端/文件由后台线程完成，
+    事件循环不会阻塞在日志 I/O 上。
+
+    Args:
+        level (str|int): 日志级别，默认读取环境变量 LOG_LEVEL，未设置时为 INFO
+        log_file (str): 可选的日志文件路径
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = level or os.getenv('LOG_LEVEL') or 'INFO'
+    invalid_level = None
+    if isinstance(level, str):
+        # 未知的级别名 getLevelName 会返回 "Level XXX" 字符串，回退到 INFO
+        name = level.strip().upper()
+        level = int(name) if name.isdigit() else logging.getLevelName(name)
+        if not isinstance(level, int):
+            invalid_level, level = name, logging.INFO
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    # 第三方库的调试输出量很大，单独限制在 WARNING
+    for noisy in ('httpx', 'httpcore', 'websockets', 'asyncio'):
+        logging.getLogger(noisy).setLevel(max(level, logging.WARNING))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    if invalid_level is not None:
+        logging.getLogger(__name__).warning(f"Unknown log level {invalid_level!r}, falling back to INFO")
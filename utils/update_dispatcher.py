@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UpdateDispatcher:
+    """
+    并发更新分发器
+
+    每个更新作为独立任务运行：
+    - 同一个 key（通常是 chat id）的更新按到达顺序串行处理
+    - 不同 key 的更新并发处理，同时运行的数量受 max_concurrency 限制
+    - 排队中的更新超过 max_pending 时 submit 会等待，形成背压
+    - 单个更新处理超过 timeout 秒会被取消
+    """
+
+    def __init__(self, handler, key_func, max_concurrency=8, max_pending=100, timeout=60):
+        self._handler = handler
+        self._key_func = key_func
+        self._timeout = timeout
+        self._running = asyncio.Semaphore(max_concurrency)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._tails = {}
+        self._tasks = set()
+
+    async def submit(self, update):
+        """提交一个更新，队列已满时等待空位"""
+        await self._pending.acquire()
+        key = self._key_func(update)
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._process(key, update, previous))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, key, update, previous):
+        try:
+            # 等待同一 key 的上一个更新处理完，保证顺序
+            if previous is not None:
+                await asyncio.wait({previous})
+            async with self._running:
+                await asyncio.wait_for(self._handler(update), timeout=self._timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Update for {key} timed out after {self._timeout}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error dispatching update for {key}: {str(e)}")
+            logger.error("Full error details:", exc_info=True)
+        finally:
+            self._pending.release()
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def close(self, timeout=None):
+        """等待已提交的更新处理完成，超时后取消剩余任务"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
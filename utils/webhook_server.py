@@ -0,0 +1,123 @@
+import asyncio
+import hmac
+import logging
+import time
+from aiohttp import web, ClientSession
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """
+    Telegram webhook 接收服务
+
+    Telegram 以 POST 推送更新，校验 secret token 后直接交给与轮询模式相同的分发器。
+    /health 用于反向代理或负载均衡器的健康检查。会话状态保存在本进程（或本机 SQLite 文件）中，
+    不在进程间共享，同一个 bot 只能运行一个实例。
+    """
+
+    def __init__(self, bot, dispatcher, secret_token, host='0.0.0.0', port=8443,
+                 path='/telegram/webhook'):
+        if not secret_token:
+            raise ValueError("Webhook mode requires a secret token")
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.path = path
+        self.started_at = None
+        self.updates_received = 0
+        self._runner = None
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/health', self.handle_health)
+        return app
+
+    async def handle_update(self, request):
+        token = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(token, self.secret_token):
+            logger.warning(f"Rejected webhook request from {request.remote}: invalid secret token")
+            return web.Response(status=401)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.bot)
+        except Exception as e:
+            logger.warning(f"Invalid webhook payload: {str(e)}")
+            return web.Response(status=400)
+
+        if update is None:
+            return web.Response(status=400)
+
+        self.updates_received += 1
+        await self.dispatcher.submit(update)
+        return web.Response(text='ok')
+
+    async def handle_health(self, request):
+        return web.json_response({
+            'status': 'ok',
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.started_at else 0,
+            'updates_received': self.updates_received
+        })
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.started_at = time.monotonic()
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+async def send_fake_update(url, secret_token, update_data):
+    """模拟 Telegram 向 webhook 推送一条更新，返回 HTTP 状态码"""
+    headers = {SECRET_TOKEN_HEADER: secret_token} if secret_token else {}
+    async with ClientSession() as session:
+        async with session.post(url, json=update_data, headers=headers) as response:
+            return response.status
+
+def make_fake_message_update(update_id, chat_id, text):
+    """构造一条最小的文本消息更新"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': text
+        }
+    }
+
+if __name__ == "__main__":
+    # 本地测试：启动服务，用伪造的 Telegram 请求验证 secret 校验与分发
+    from telegram import Bot
+
+    class PrintDispatcher:
+        async def submit(self, update):
+            print(f"Dispatched update {update.update_id}: {update.message.text}")
+
+    async def main():
+        secret = 'local-test-secret'
+        server = WebhookServer(Bot('123456:TEST'), PrintDispatcher(), secret, host='127.0.0.1', port=8081)
+        await server.start()
+        try:
+            url = f"http://127.0.0.1:8081{server.path}"
+            print("valid token:", await send_fake_update(url, secret, make_fake_message_update(1, 42, '/start')))
+            print("invalid token:", await send_fake_update(url, 'wrong', make_fake_message_update(2, 42, '/start')))
+            async with ClientSession() as session:
+                async with session.get("http://127.0.0.1:8081/health") as response:
+                    print("health:", await response.json())
+        finally:
+            await server.stop()
+
+    asyncio.run(main())